@@ -0,0 +1,235 @@
+import threading
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # optional dependency, only needed for ANN_BACKEND=hnsw
+    hnswlib = None
+
+
+# ============================================================
+# 🧭 APPROXIMATE NEAREST-NEIGHBOUR ENGINES
+# ============================================================
+# An engine only proposes candidate rows of the VectorIndex matrix. The index
+# rescores those candidates exactly (category boost, tombstones, exclusions),
+# so the engines trade recall for latency and never change the score scale.
+
+def train_centroids(vectors: np.ndarray, nlist: int, iters: int = 20, sample: int = 65536, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: unit-length centroids maximizing inner product with their members"""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    nlist = max(1, min(nlist, n))
+    train = vectors if n <= sample else vectors[rng.choice(n, sample, replace=False)]
+
+    centroids = train[rng.choice(train.shape[0], nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        counts = np.bincount(assign, minlength=nlist)
+
+        # Per-cluster sums via one sorted pass (np.add.at is far slower)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(train[order], starts[filled], axis=0)
+
+        # Re-seed empty clusters from random training points
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = train[rng.choice(train.shape[0], empty.size, replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Nearest centroid per row, in chunks so N x nlist scores never materialize at once"""
+    assign = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk):
+        assign[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return assign
+
+
+class IVFFlatEngine:
+    """Inverted-file index over k-means coarse centroids with uncompressed (flat) vectors.
+
+    A query scores the `nprobe` closest lists only, so the cost drops from
+    N·dim to roughly N·dim·nprobe/nlist. Rows appended after training go to
+    their nearest centroid; retraining is requested once the catalog has
+    doubled since the last build.
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist: int = 1024, nprobe: int = 16, min_rows: int = 10000, iters: int = 20):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.iters = iters
+        self._lock = threading.Lock()
+        self._centroids = None
+        self._lists = []
+        self._assign = np.empty(0, dtype=np.int32)
+        self._trained_rows = 0
+        self._added_rows = 0
+
+    @property
+    def ready(self):
+        return self._centroids is not None
+
+    def build(self, matrix: np.ndarray, alive: np.ndarray):
+        rows = np.flatnonzero(alive)
+        if rows.size < self.min_rows:
+            # Small catalogs are faster (and exact) with a brute-force scan
+            with self._lock:
+                self._centroids = None
+            return
+
+        # ~sqrt(N) lists keeps list length and centroid count balanced
+        nlist = min(self.nlist, max(1, int(np.sqrt(rows.size))))
+        centroids = train_centroids(matrix[rows], nlist, iters=self.iters)
+        assign = np.full(matrix.shape[0], -1, dtype=np.int32)
+        assign[rows] = assign_to_centroids(matrix[rows], centroids)
+
+        order = rows[np.argsort(assign[rows], kind="stable")]
+        bounds = np.searchsorted(assign[order], np.arange(centroids.shape[0] + 1))
+        lists = [list(order[bounds[i]:bounds[i + 1]]) for i in range(centroids.shape[0])]
+
+        with self._lock:
+            self._centroids = centroids
+            self._lists = lists
+            self._assign = assign
+            self._trained_rows = rows.size
+            self._added_rows = 0
+
+    def needs_rebuild(self, live_rows: int) -> bool:
+        if self._centroids is None:
+            return live_rows >= self.min_rows
+        return self._added_rows > self._trained_rows
+
+    def add(self, row: int, vector: np.ndarray):
+        with self._lock:
+            if self._centroids is None:
+                return
+            if row >= self._assign.shape[0]:
+                grown = np.full(max(row + 1, self._assign.shape[0] * 2), -1, dtype=np.int32)
+                grown[:self._assign.shape[0]] = self._assign
+                self._assign = grown
+
+            list_id = int(np.argmax(self._centroids @ vector))
+            previous = self._assign[row]
+            if previous == list_id:
+                return
+            if previous >= 0:
+                self._lists[previous].remove(row)
+            else:
+                self._added_rows += 1
+            self._lists[list_id].append(row)
+            self._assign[row] = list_id
+
+    def remove(self, row: int):
+        # Tombstoned rows are masked out by the index; lists are cleaned on rebuild
+        pass
+
+    def candidates(self, query: np.ndarray, k: int, nprobe=None, ef=None) -> np.ndarray:
+        nprobe = int(nprobe or self.nprobe)
+        with self._lock:
+            centroids = self._centroids
+            lists = self._lists
+            if centroids is None:
+                return None
+            nprobe = max(1, min(nprobe, centroids.shape[0]))
+            probes = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            rows = [np.asarray(lists[p], dtype=np.int64) for p in probes]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+
+class HNSWEngine:
+    """Hierarchical navigable small-world graph backed by the optional `hnswlib` package.
+
+    `ef` (search beam width) is the recall knob; labels are VectorIndex row
+    numbers, so the graph is rebuilt after every compaction.
+    """
+
+    name = "hnsw"
+
+    def __init__(self, m: int = 16, ef_construction: int = 200, ef: int = 64, min_rows: int = 10000):
+        if hnswlib is None:
+            raise ImportError("ANN_BACKEND=hnsw requires the optional 'hnswlib' package")
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.min_rows = min_rows
+        self._lock = threading.Lock()
+        self._graph = None
+        self._deleted = set()
+
+    @property
+    def ready(self):
+        return self._graph is not None
+
+    def build(self, matrix: np.ndarray, alive: np.ndarray):
+        rows = np.flatnonzero(alive)
+        if rows.size < self.min_rows:
+            with self._lock:
+                self._graph = None
+            return
+
+        graph = hnswlib.Index(space="ip", dim=matrix.shape[1])
+        graph.init_index(max_elements=max(matrix.shape[0], 1), ef_construction=self.ef_construction, M=self.m)
+        graph.add_items(matrix[rows], rows)
+        with self._lock:
+            self._graph = graph
+            self._deleted = set()
+
+    def needs_rebuild(self, live_rows: int) -> bool:
+        return self._graph is None and live_rows >= self.min_rows
+
+    def add(self, row: int, vector: np.ndarray):
+        with self._lock:
+            if self._graph is None:
+                return
+            if row >= self._graph.get_max_elements():
+                self._graph.resize_index(max(row + 1, self._graph.get_max_elements() * 2))
+            if row in self._deleted:
+                self._graph.unmark_deleted(row)
+                self._deleted.discard(row)
+            self._graph.add_items(vector.reshape(1, -1), [row])
+
+    def remove(self, row: int):
+        with self._lock:
+            if self._graph is None or row in self._deleted:
+                return
+            try:
+                self._graph.mark_deleted(row)
+                self._deleted.add(row)
+            except RuntimeError:
+                pass  # row was appended before the graph was built
+
+    def candidates(self, query: np.ndarray, k: int, nprobe=None, ef=None) -> np.ndarray:
+        with self._lock:
+            if self._graph is None:
+                return None
+            live = self._graph.get_current_count() - len(self._deleted)
+            if live <= 0:
+                return np.empty(0, dtype=np.int64)
+            k = min(k, live)
+            # ef is global on the graph, so set it and query under the same lock
+            self._graph.set_ef(max(int(ef or self.ef), k))
+            labels, _ = self._graph.knn_query(query.reshape(1, -1), k=k)
+        return labels[0].astype(np.int64)
+
+
+def make_engine(backend: str, **options):
+    """Build an ANN engine from config; 'exact' (or empty) means brute force only"""
+    backend = (backend or "exact").lower()
+    if backend == "exact":
+        return None
+    if backend == "ivf":
+        return IVFFlatEngine(**{k: v for k, v in options.items() if k in ("nlist", "nprobe", "min_rows", "iters")})
+    if backend == "hnsw":
+        return HNSWEngine(**{k: v for k, v in options.items() if k in ("m", "ef_construction", "ef", "min_rows")})
+    raise ValueError(f"Unknown ANN backend: {backend}")
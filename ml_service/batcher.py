@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+
+# ============================================================
+# 📦 DYNAMIC MICRO-BATCHING
+# ============================================================
+class MicroBatcher:
+    """Coalesces concurrent single-item requests into one batched call.
+
+    Awaiting `submit(item)` enqueues the item; a worker task takes the first
+    waiting item, keeps collecting until `max_batch` items or `max_wait_ms`
+    have passed, runs `batch_fn(items)` once off the event loop and routes
+    each result (or the batch's exception) back to its caller.
+    `batch_fn` must return one result per item, in order. Once `max_queue`
+    items are waiting, `submit` raises asyncio.QueueFull.
+    """
+
+    def __init__(
+        self,
+        batch_fn,
+        max_batch: int = 16,
+        max_wait_ms: float = 10.0,
+        name: str = "batcher",
+        executor=None,
+        max_queue: int = 0,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self.executor = executor
+        self.max_queue = max_queue
+        self._queue = None
+        self._worker = None
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._size_counts = {}
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._run_total = 0.0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run(), name=self.name)
+
+    async def submit(self, item):
+        self._ensure_worker()
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            raise asyncio.QueueFull(f"{self.name} queue is full")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        # Anything already queued rides along without extra waiting
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            self._record_queue_wait(started - entry[2] for entry in batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, [entry[0] for entry in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            self._record_batch(len(batch), time.perf_counter() - started)
+
+    def _record_queue_wait(self, waits):
+        with self._stats_lock:
+            for wait in waits:
+                self._queue_wait_total += wait
+                self._queue_wait_max = max(self._queue_wait_max, wait)
+
+    def _record_batch(self, size, seconds):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._size_counts[size] = self._size_counts.get(size, 0) + 1
+            self._run_total += seconds
+
+    def stats(self):
+        with self._stats_lock:
+            batches = max(self._batches, 1)
+            items = max(self._items, 1)
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queued": self._queue.qsize() if self._queue is not None else 0,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / batches, 3),
+                "batch_size_counts": dict(sorted(self._size_counts.items())),
+                "queue_wait_ms_avg": round(self._queue_wait_total * 1000 / items, 3),
+                "queue_wait_ms_max": round(self._queue_wait_max * 1000, 3),
+                "batch_run_ms_avg": round(self._run_total * 1000 / batches, 3),
+            }
@@ -0,0 +1,115 @@
+"""Recall@k vs latency of the ANN engines against brute force.
+
+Run from ml_service/:
+
+    python -m benchmarks.ann_recall --rows 200000 --backend ivf --nprobe 1 4 8 16 32
+    python -m benchmarks.ann_recall --rows 200000 --backend hnsw --ef 16 32 64 128
+
+The synthetic catalog is a mixture of Gaussian clusters (products cluster by
+category/look much like real CLIP embeddings do) and queries are perturbed
+catalog vectors, i.e. "a different photo of something we sell".
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ann import make_engine
+from vector_index import VectorIndex
+
+
+def synthetic_catalog(rows: int, dim: int, clusters: int, spread: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + spread * rng.normal(size=(rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def synthetic_queries(catalog: np.ndarray, count: int, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picks = catalog[rng.integers(0, catalog.shape[0], count)]
+    return picks + noise * rng.normal(size=picks.shape).astype(np.float32)
+
+
+def run_queries(index: VectorIndex, queries: np.ndarray, k: int, **knobs):
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search(query, top_k=k, **knobs)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([hit["product_id"] for hit in hits])
+    return results, np.array(latencies)
+
+
+def recall_at_k(truth, found, k: int) -> float:
+    return float(np.mean([len(set(t[:k]) & set(f[:k])) / max(min(k, len(t)), 1) for t, f in zip(truth, found)]))
+
+
+def summarize(label, latencies, recall=None):
+    row = {
+        "setting": label,
+        "recall": recall,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "qps": round(1000.0 / float(np.mean(latencies)), 1),
+    }
+    recall_text = f"{recall:.4f}" if recall is not None else "  1.0 "
+    print(f"{label:>16}  recall@k={recall_text}  p50={row['p50_ms']:8.3f}ms  p99={row['p99_ms']:8.3f}ms  qps={row['qps']:8.1f}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--spread", type=float, default=0.6, help="cluster noise relative to center norm")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=0.3)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backend", choices=["ivf", "hnsw"], default="ivf")
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} x {args.dim} catalog ({args.clusters} clusters)...")
+    catalog = synthetic_catalog(args.rows, args.dim, args.clusters, args.spread)
+    queries = synthetic_queries(catalog, args.queries, args.query_noise)
+
+    engine = make_engine(
+        args.backend,
+        nlist=args.nlist,
+        m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        min_rows=0,
+    )
+    index = VectorIndex(dim=args.dim, engine=engine)
+    index.load((str(i), "", None, catalog[i]) for i in range(args.rows))
+
+    started = time.perf_counter()
+    index.rebuild_engine()
+    build_seconds = time.perf_counter() - started
+    print(f"{args.backend} build: {build_seconds:.2f}s")
+
+    truth, exact_latencies = run_queries(index, queries, args.k, exact=True)
+    rows = [summarize("exact", exact_latencies)]
+
+    knob = "nprobe" if args.backend == "ivf" else "ef"
+    for value in (args.nprobe if knob == "nprobe" else args.ef):
+        found, latencies = run_queries(index, queries, args.k, **{knob: value})
+        rows.append(summarize(f"{knob}={value}", latencies, recall_at_k(truth, found, args.k)))
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"config": vars(args), "build_seconds": build_seconds, "results": rows}, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Latency / throughput of the CLIP inference backends on this machine.
+
+Run from ml_service/:
+
+    python -m benchmarks.clip_latency --backends torch torch-int8 onnx onnx-int8 --threads 4
+    python -m benchmarks.clip_latency --batch-sizes 1 8 16 --iterations 30 --output clip.json
+
+For every backend and batch size it times the vision tower alone (the part
+camera search waits on) plus one text-prompt encode, after a warmup pass.
+Preprocessing is excluded: it is identical across backends.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.clip_parity import DEFAULT_PROMPTS, sample_images
+from clip_encoder import BACKENDS, CLIP_MODEL_NAME, ClipEncoder
+
+
+def time_calls(fn, iterations: int):
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=CLIP_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = library default)")
+    parser.add_argument("--images", default=None, help="folder of sample product images (default: synthetic)")
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    args = parser.parse_args()
+
+    images = sample_images(args.images, max(args.batch_sizes))
+    results = []
+    for backend in args.backends:
+        started = time.perf_counter()
+        encoder = ClipEncoder(args.model, backend=backend, threads=args.threads)
+        load_seconds = time.perf_counter() - started
+        pixels = [encoder.preprocess(image) for image in images]
+        encoder.warmup()
+
+        for batch_size in args.batch_sizes:
+            batch = (pixels * batch_size)[:batch_size]
+            latencies = time_calls(lambda: encoder.encode_images(batch), args.iterations)
+            row = {
+                "backend": backend,
+                "batch_size": batch_size,
+                "threads": args.threads,
+                "load_s": round(load_seconds, 2),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                "images_per_s": round(batch_size * 1000.0 / float(np.mean(latencies)), 1),
+            }
+            results.append(row)
+            print(f"{backend:>11}  batch={batch_size:<3}  p50={row['p50_ms']:8.2f}ms  p99={row['p99_ms']:8.2f}ms  "
+                  f"{row['images_per_s']:7.1f} img/s  (load {row['load_s']}s)")
+
+        text_latencies = time_calls(lambda: encoder.encode_texts(DEFAULT_PROMPTS[:1]), args.iterations)
+        print(f"{backend:>11}  text prompt  p50={np.percentile(text_latencies, 50):8.2f}ms")
+        results.append({
+            "backend": backend,
+            "text_p50_ms": round(float(np.percentile(text_latencies, 50)), 2),
+        })
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump({"model": args.model, "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
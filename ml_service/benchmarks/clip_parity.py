@@ -0,0 +1,121 @@
+"""Parity of the optimized CLIP backends against the fp32 PyTorch reference.
+
+Run from ml_service/:
+
+    python -m benchmarks.clip_parity --backends torch-int8 onnx onnx-int8
+    python -m benchmarks.clip_parity --images ../storage/app/public/products --limit 64
+
+Every backend must reach a cosine similarity of at least --min-cosine
+(default 0.99) with the reference on every sample image and prompt; top-1
+neighbour agreement within the sample is reported alongside. Exits with
+status 1 when any backend falls short, so it can gate a CLIP_BACKEND change.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from clip_encoder import BACKENDS, CLIP_MODEL_NAME, ClipEncoder
+
+DEFAULT_PROMPTS = [
+    "a photo of a t-shirt", "a pair of running shoes", "a wireless headphone",
+    "a wooden chair", "a lipstick", "a children's book", "a football", "a vintage painting",
+]
+
+
+def synthetic_images(count: int, size: int = 256, seed: int = 0):
+    """Shapes on gradients: structured enough to exercise the whole vision tower"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        base = np.linspace(0, 255, size, dtype=np.float32)
+        pixels = np.stack(np.meshgrid(base, base[::-1]), axis=-1)
+        pixels = np.concatenate([pixels, np.full((size, size, 1), rng.uniform(0, 255))], axis=-1)
+        image = Image.fromarray(pixels.astype(np.uint8))
+        draw = ImageDraw.Draw(image)
+        for _ in range(4):
+            x0, y0 = rng.integers(0, size // 2, 2)
+            x1, y1 = x0 + rng.integers(16, size // 2, 2)
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            (draw.ellipse if rng.random() < 0.5 else draw.rectangle)([x0, y0, x1, y1], fill=color)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def sample_images(folder, limit: int):
+    """Up to `limit` image files from `folder` (recursively), or synthetic images if none"""
+    if folder:
+        paths = []
+        for root, _, files in os.walk(folder):
+            paths.extend(os.path.join(root, f) for f in sorted(files)
+                         if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp")))
+        images = []
+        for path in paths[:limit]:
+            with open(path, "rb") as fh:
+                images.append(fh.read())
+        if images:
+            return images
+        print(f"[WARN] No images under {folder}; using synthetic images")
+    return synthetic_images(limit)
+
+
+def encode_all(encoder: ClipEncoder, images, prompts, batch_size: int = 16):
+    pixels = [encoder.preprocess(image) for image in images]
+    vectors = []
+    for start in range(0, len(pixels), batch_size):
+        vectors.extend(encoder.encode_images(pixels[start:start + batch_size]))
+    return np.vstack(vectors), encoder.encode_texts(prompts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=CLIP_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", default=[b for b in BACKENDS if b != "torch"], choices=BACKENDS)
+    parser.add_argument("--images", default=None, help="folder of sample product images (default: synthetic)")
+    parser.add_argument("--limit", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+
+    images = sample_images(args.images, args.limit)
+    reference = ClipEncoder(args.model, backend="torch", threads=args.threads)
+    ref_images, ref_texts = encode_all(reference, images, DEFAULT_PROMPTS)
+    ref_top1 = np.argmax(ref_images @ ref_images.T - 2 * np.eye(len(images)), axis=1)
+    print(f"Reference: {args.model} fp32 torch, {len(images)} images, {len(DEFAULT_PROMPTS)} prompts")
+
+    report, failed = [], False
+    for backend in args.backends:
+        encoder = ClipEncoder(args.model, backend=backend, threads=args.threads)
+        images_out, texts_out = encode_all(encoder, images, DEFAULT_PROMPTS)
+        image_cos = np.sum(images_out * ref_images, axis=1)
+        text_cos = np.sum(texts_out * ref_texts, axis=1)
+        top1 = np.argmax(images_out @ images_out.T - 2 * np.eye(len(images)), axis=1)
+        row = {
+            "backend": backend,
+            "image_cosine_min": round(float(image_cos.min()), 5),
+            "image_cosine_mean": round(float(image_cos.mean()), 5),
+            "text_cosine_min": round(float(text_cos.min()), 5),
+            "top1_agreement": round(float(np.mean(top1 == ref_top1)), 4),
+        }
+        row["passed"] = min(row["image_cosine_min"], row["text_cosine_min"]) >= args.min_cosine
+        failed |= not row["passed"]
+        report.append(row)
+        print(f"{backend:>11}  image cos min={row['image_cosine_min']:.5f} mean={row['image_cosine_mean']:.5f}  "
+              f"text cos min={row['text_cosine_min']:.5f}  top1={row['top1_agreement']:.3f}  "
+              f"{'PASS' if row['passed'] else 'FAIL'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump({"model": args.model, "min_cosine": args.min_cosine, "results": report}, fh, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Recall, latency and memory of the compressed vector storages against float32.
+
+Run from ml_service/:
+
+    python -m benchmarks.quantization_recall --rows 200000
+    python -m benchmarks.quantization_recall --storage int8 pq --pq-m 64 128 --rerank 5 10 20 50
+
+Each storage is loaded into its own VectorIndex over the same synthetic
+catalog (see ann_recall) and every query is answered both exactly (float32
+scan) and through the compressed scan + float32 re-rank. "scan MB" is what a
+query streams from memory; with a mapped snapshot it is also roughly the
+worker's private memory for vectors, since the float32 rows are only read
+for the re-ranked candidates.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.ann_recall import recall_at_k, run_queries, summarize, synthetic_catalog, synthetic_queries
+from quantization import make_storage
+from vector_index import VectorIndex
+
+
+def build(catalog, storage):
+    index = VectorIndex(dim=catalog.shape[1], storage=storage)
+    started = time.perf_counter()
+    index.load((str(i), "", None, catalog[i]) for i in range(catalog.shape[0]))
+    return index, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--spread", type=float, default=0.6, help="cluster noise relative to center norm")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-noise", type=float, default=0.3)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--storage", nargs="+", choices=["float16", "int8", "pq"], default=["float16", "int8", "pq"])
+    parser.add_argument("--pq-m", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[5, 10, 20, 50],
+                        help="rerank factors: top_k * factor candidates are rescored in float32")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} x {args.dim} catalog ({args.clusters} clusters)...")
+    catalog = synthetic_catalog(args.rows, args.dim, args.clusters, args.spread)
+    queries = synthetic_queries(catalog, args.queries, args.query_noise)
+
+    baseline, load_seconds = build(catalog, None)
+    truth, exact_latencies = run_queries(baseline, queries, args.k, exact=True)
+    matrix_mb = baseline.memory_usage()["matrix_bytes"] / 2**20
+    row = summarize("float32", exact_latencies)
+    row.update(storage="float32", load_seconds=round(load_seconds, 2), scan_mb=round(matrix_mb, 1))
+    print(f"{'':>16}  load={load_seconds:.2f}s  scan={matrix_mb:.1f}MB")
+    rows = [row]
+    del baseline
+
+    configs = []
+    for kind in args.storage:
+        if kind == "pq":
+            configs.extend((f"pq m={m}", kind, {"m": m, "min_rows": 0}) for m in args.pq_m)
+        else:
+            configs.append((kind, kind, {}))
+
+    for label, kind, options in configs:
+        index, load_seconds = build(catalog, make_storage(kind, **options))
+        usage = index.memory_usage()
+        scan_mb = usage["compressed_bytes"] / 2**20
+        print(f"{label}: load+encode={load_seconds:.2f}s  scan={scan_mb:.1f}MB "
+              f"({usage['matrix_bytes'] / max(usage['compressed_bytes'], 1):.1f}x smaller)")
+        for factor in args.rerank:
+            index.rerank_factor = factor
+            found, latencies = run_queries(index, queries, args.k)
+            row = summarize(f"rerank x{factor}", latencies, recall_at_k(truth, found, args.k))
+            row.update(storage=label, rerank_factor=factor, load_seconds=round(load_seconds, 2), scan_mb=round(scan_mb, 1))
+            rows.append(row)
+        del index
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"config": vars(args), "results": rows}, fh, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
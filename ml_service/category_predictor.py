@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+
+# ============================================================
+# 🏷️ CATEGORY PREDICTION FROM CLIP TEXT PROTOTYPES
+# ============================================================
+# category_prompts.json:
+#   "templates": prompt patterns, "{}" is replaced by each variation
+#   "synonyms":  keyword -> extra variations; the first keyword contained in
+#                the (lower-cased) category name applies, in file order
+
+log = logging.getLogger("ml_service")
+
+DEFAULT_PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "category_prompts.json")
+
+
+class CategoryPredictor:
+    """Scores an image embedding against precomputed text prototypes for every category.
+
+    All prompts are encoded in one batched text-tower call whenever the
+    category set or the prompt file changes; predicting is then a single
+    (prompts x dim) @ (dim,) product plus a per-category max.
+
+    `predict` never rebuilds: callers check `needs_refresh` and leave the
+    rebuild to a background thread, and predictions keep using the previous
+    prototypes until the new ones are swapped in.
+    """
+
+    def __init__(self, encode_texts, prompts_path: str = DEFAULT_PROMPTS_PATH):
+        self.encode_texts = encode_texts
+        self.prompts_path = prompts_path
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._config_mtime = None
+        self._templates = ["{}"]
+        self._synonyms = {}
+        self._categories = ()
+        self._prototypes = None
+        self._starts = None
+
+    def _prompts_mtime(self):
+        try:
+            return os.path.getmtime(self.prompts_path)
+        except OSError:
+            return None
+
+    def _load_config(self) -> bool:
+        """Reload the prompt file if it changed; returns True when it did"""
+        mtime = self._prompts_mtime()
+        if mtime == self._config_mtime:
+            return False
+
+        templates, synonyms = ["{}"], {}
+        if mtime is not None:
+            with open(self.prompts_path, encoding="utf-8") as fh:
+                config = json.load(fh)
+            templates = config.get("templates") or ["{}"]
+            synonyms = {k.lower(): list(v) for k, v in (config.get("synonyms") or {}).items()}
+
+        self._templates, self._synonyms, self._config_mtime = templates, synonyms, mtime
+        return True
+
+    def variations(self, category: str):
+        name = category.lower()
+        variations = [name]
+        for keyword, extra in self._synonyms.items():
+            if keyword in name:
+                variations.extend(v for v in extra if v not in variations)
+                break
+        return [template.format(v) for v in variations for template in self._templates]
+
+    def needs_refresh(self, categories) -> bool:
+        """Cheap check (one stat call) for a changed category set or prompt file"""
+        categories = tuple(sorted(c for c in categories if c))
+        return (categories != self._categories or self._prompts_mtime() != self._config_mtime
+                or (self._prototypes is None and bool(categories)))
+
+    def refresh(self, categories, force: bool = False) -> bool:
+        """Rebuild prototypes if the category set or prompt file changed; returns True if rebuilt.
+
+        The text-tower call runs outside the prediction lock, so predictions
+        keep being served from the previous prototypes meanwhile.
+        """
+        categories = tuple(sorted(c for c in categories if c))
+        with self._refresh_lock:
+            config_changed = self._load_config()
+            if not force and not config_changed and categories == self._categories and self._prototypes is not None:
+                return False
+
+            prompts, starts = [], []
+            for category in categories:
+                starts.append(len(prompts))
+                prompts.extend(self.variations(category))
+
+            if prompts:
+                prototypes = np.asarray(self.encode_texts(prompts), dtype=np.float32)
+                prototypes /= np.linalg.norm(prototypes, axis=1, keepdims=True)
+            else:
+                prototypes = None
+
+            with self._lock:
+                self._categories = categories
+                self._prototypes = prototypes
+                self._starts = np.asarray(starts, dtype=np.int64)
+        log.info(f"Category prototypes rebuilt: {len(categories)} categories, {len(prompts)} prompts")
+        return True
+
+    def predict(self, image_embedding):
+        """Best matching category and its similarity ("unknown", 0.0 when there are none)"""
+        with self._lock:
+            categories, prototypes, starts = self._categories, self._prototypes, self._starts
+        if prototypes is None:
+            return "unknown", 0.0
+
+        sims = prototypes @ np.asarray(image_embedding, dtype=np.float32).reshape(-1)
+        # Best variation per category; like the old loop, similarities start from 0
+        best = np.maximum(np.maximum.reduceat(sims, starts), 0.0)
+        best_idx = int(np.argmax(best))
+        return categories[best_idx], float(best[best_idx])
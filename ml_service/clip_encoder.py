@@ -0,0 +1,229 @@
+import io
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_preprocess import ImagePreprocessor
+
+
+# ============================================================
+# 🧠 CLIP ENCODER
+# ============================================================
+# Shared by the API service and the offline jobs (reembed_catalog.py), so the
+# same preprocessing and normalization produce every stored vector.
+# torch/transformers are imported when an encoder is built, not when this
+# module is imported, so DB-only code paths never pay for them.
+#
+# CLIP_BACKEND selects the inference path:
+#   "torch"       fp32 PyTorch (reference)
+#   "torch-int8"  PyTorch with dynamically quantized int8 Linear layers
+#   "onnx"        ONNX Runtime, graphs exported on first use (see clip_onnx.py)
+#   "onnx-int8"   ONNX Runtime with int8-quantized weights
+# CLIP_THREADS / CLIP_INTEROP_THREADS pin the intra-/inter-op thread pools
+# (0 keeps the library default). Check a backend against the reference with
+# benchmarks/clip_parity.py before switching production to it.
+
+log = logging.getLogger("ml_service")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch")
+CLIP_THREADS = int(os.getenv("CLIP_THREADS", "0"))
+CLIP_INTEROP_THREADS = int(os.getenv("CLIP_INTEROP_THREADS", "0"))
+CLIP_ONNX_DIR = os.getenv("CLIP_ONNX_DIR", os.path.join(BASE_DIR, "onnx_models"))
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+EMBEDDING_DIM = 512
+
+
+def l2_normalize(features) -> np.ndarray:
+    features = np.asarray(features, dtype=np.float32)
+    return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+
+class ClipEncoder:
+    """CLIP image/text towers returning L2-normalized float32 embeddings"""
+
+    def __init__(
+        self,
+        model_name: str = CLIP_MODEL_NAME,
+        backend: str = CLIP_BACKEND,
+        threads: int = CLIP_THREADS,
+        interop_threads: int = CLIP_INTEROP_THREADS,
+        onnx_dir: str = CLIP_ONNX_DIR,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown CLIP backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+        from transformers import CLIPProcessor
+
+        self.model_name = model_name
+        self.backend = backend
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+        self.preprocessor = ImagePreprocessor.from_processor(self.processor.image_processor)
+
+        if backend.startswith("onnx"):
+            from clip_onnx import ensure_onnx, make_session
+
+            vision_path, text_path = ensure_onnx(model_name, onnx_dir, quantized=backend == "onnx-int8")
+            self._vision_session = make_session(vision_path, threads, interop_threads)
+            self._text_session = make_session(text_path, threads, interop_threads)
+            self.model = None
+        else:
+            import torch
+            from transformers import CLIPModel
+
+            if threads:
+                torch.set_num_threads(threads)
+            if interop_threads:
+                try:
+                    torch.set_num_interop_threads(interop_threads)
+                except RuntimeError:
+                    # Only settable before torch's first parallel region in this process
+                    log.warning("CLIP_INTEROP_THREADS ignored: torch inter-op pool already started")
+
+            model = CLIPModel.from_pretrained(model_name)
+            model.eval()
+            if backend == "torch-int8":
+                model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.torch = torch
+            self.model = model
+
+    def preprocess(self, image_bytes: bytes) -> np.ndarray:
+        """Decode one image into CLIP pixel values, shape (1, 3, 224, 224); raises on undecodable input"""
+        return self.preprocessor.preprocess(image_bytes)
+
+    def preprocess_batch(self, images, out: np.ndarray = None):
+        """Decode many images into one (B, 3, 224, 224) array; returns (pixel_values, {position: error})"""
+        return self.preprocessor.preprocess_batch(images, out=out)
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        """Unnormalized projected image embeddings for a (B, 3, H, W) batch"""
+        if self.model is None:
+            return self._vision_session.run(None, {"pixel_values": pixel_values})[0]
+
+        torch = self.torch
+        with torch.inference_mode():
+            # Same as get_image_features: pooled vision output through the projection
+            vision_outputs = self.model.vision_model(pixel_values=torch.from_numpy(pixel_values))
+            return self.model.visual_projection(vision_outputs.pooler_output).numpy()
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Unnormalized projected text embeddings for tokenized prompts"""
+        if self.model is None:
+            return self._text_session.run(None, {
+                "input_ids": input_ids.astype(np.int64, copy=False),
+                "attention_mask": attention_mask.astype(np.int64, copy=False),
+            })[0]
+
+        torch = self.torch
+        with torch.inference_mode():
+            text_outputs = self.model.text_model(
+                input_ids=torch.from_numpy(input_ids).long(),
+                attention_mask=torch.from_numpy(attention_mask).long(),
+            )
+            return self.model.text_projection(text_outputs.pooler_output).numpy()
+
+    def encode_images(self, pixel_batches) -> list:
+        """Run the vision tower once over preprocessed images (a list of batches or one batch array); returns normalized arrays"""
+        if isinstance(pixel_batches, np.ndarray):
+            pixel_values = np.ascontiguousarray(pixel_batches, dtype=np.float32)
+        else:
+            pixel_values = np.ascontiguousarray(np.concatenate(list(pixel_batches), axis=0), dtype=np.float32)
+        return list(l2_normalize(self.image_features(pixel_values)))
+
+    def encode_texts(self, texts) -> np.ndarray:
+        """Normalized text embeddings for a batch of strings, one forward pass"""
+        text_inputs = self.processor(
+            text=list(texts),
+            return_tensors="np",
+            padding=True,
+            truncation=True
+        )
+        return l2_normalize(self.text_features(text_inputs["input_ids"], text_inputs["attention_mask"]))
+
+    def warmup(self):
+        """One image and one text forward pass so the first real request skips lazy init costs"""
+        buffer = io.BytesIO()
+        Image.new("RGB", (224, 224), (127, 127, 127)).save(buffer, format="PNG")
+        embedding = self.encode_images([self.preprocess(buffer.getvalue())])[0]
+        self.encode_texts(["warmup"])
+        if embedding.shape[-1] != EMBEDDING_DIM:
+            log.warning(f"{self.model_name} produces {embedding.shape[-1]}-dim embeddings, index expects {EMBEDDING_DIM}")
+
+
+# ============================================================
+# ⏳ MODEL LIFECYCLE
+# ============================================================
+class ModelNotReady(Exception):
+    """Raised when the encoder is still loading (or failed to load) after the caller's wait"""
+
+
+class EncoderLoader:
+    """Builds one ClipEncoder on demand or in the background and reports its readiness"""
+
+    def __init__(self, model_name: str = CLIP_MODEL_NAME, warmup: bool = True):
+        self.model_name = model_name
+        self.warmup = warmup
+        self.state = "idle"  # idle -> loading -> ready | failed
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._encoder = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._encoder is not None
+
+    def start(self):
+        """Begin loading in a daemon thread (no-op if loading or loaded; retries after a failure)"""
+        with self._lock:
+            if self.state in ("loading", "ready"):
+                return
+            self.state = "loading"
+            self.error = None
+            self._done.clear()
+        threading.Thread(target=self._load, name="clip-load", daemon=True).start()
+
+    def _load(self):
+        try:
+            started = time.perf_counter()
+            encoder = ClipEncoder(self.model_name)
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            if self.warmup:
+                started = time.perf_counter()
+                encoder.warmup()
+                self.warmup_seconds = round(time.perf_counter() - started, 3)
+            self._encoder = encoder
+            self.state = "ready"
+            log.info(f"✅ CLIP model {self.model_name} loaded in {self.load_seconds}s (warmup {self.warmup_seconds}s)")
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            log.error(f"❌ CLIP model load failed: {e}")
+        finally:
+            self._done.set()
+
+    def get(self, timeout: float = None) -> ClipEncoder:
+        """The loaded encoder, starting the load if needed and waiting up to `timeout` seconds"""
+        if self._encoder is not None:
+            return self._encoder
+        self.start()
+        self._done.wait(timeout)
+        if self._encoder is None:
+            raise ModelNotReady(self.error or f"CLIP model is {self.state}")
+        return self._encoder
+
+    def status(self):
+        return {
+            "model": self.model_name,
+            "backend": self._encoder.backend if self._encoder is not None else CLIP_BACKEND,
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
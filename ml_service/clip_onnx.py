@@ -0,0 +1,115 @@
+import logging
+import os
+import re
+import uuid
+
+
+# ============================================================
+# ⚡ ONNX RUNTIME EXPORT OF THE CLIP TOWERS
+# ============================================================
+# The vision and text towers (encoder + projection) are exported once per
+# model into CLIP_ONNX_DIR/<model>/ and reused by every worker:
+#   vision.onnx       pixel_values (B, 3, 224, 224) -> image_embeds (B, dim)
+#   text.onnx         input_ids, attention_mask (B, T) -> text_embeds (B, dim)
+#   *.int8.onnx       the same graphs with dynamically quantized int8 weights
+# Outputs are unnormalized, exactly like get_image_features/get_text_features.
+
+log = logging.getLogger("ml_service")
+
+ONNX_OPSET = 17
+
+
+def onnx_paths(model_name: str, onnx_dir: str, quantized: bool = False):
+    folder = os.path.join(onnx_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+    suffix = ".int8.onnx" if quantized else ".onnx"
+    return os.path.join(folder, "vision" + suffix), os.path.join(folder, "text" + suffix)
+
+
+def _replace_atomically(write, path):
+    """Write to a temp file next to `path` and rename, so concurrent workers never load a partial graph"""
+    tmp_path = f"{path}.{os.getpid()}-{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def export_onnx(model_name: str, onnx_dir: str):
+    """Export the fp32 vision and text towers; returns (vision_path, text_path)"""
+    import torch
+    from transformers import CLIPModel
+
+    vision_path, text_path = onnx_paths(model_name, onnx_dir)
+    os.makedirs(os.path.dirname(vision_path), exist_ok=True)
+    model = CLIPModel.from_pretrained(model_name).eval()
+
+    class VisionTower(torch.nn.Module):
+        def forward(self, pixel_values):
+            return model.visual_projection(model.vision_model(pixel_values=pixel_values).pooler_output)
+
+    class TextTower(torch.nn.Module):
+        def forward(self, input_ids, attention_mask):
+            outputs = model.text_model(input_ids=input_ids, attention_mask=attention_mask)
+            return model.text_projection(outputs.pooler_output)
+
+    size = model.config.vision_config.image_size
+    pixels = torch.zeros((1, 3, size, size), dtype=torch.float32)
+    tokens = torch.ones((1, 8), dtype=torch.int64)
+
+    with torch.no_grad():
+        _replace_atomically(lambda path: torch.onnx.export(
+            VisionTower(), (pixels,), path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        ), vision_path)
+        _replace_atomically(lambda path: torch.onnx.export(
+            TextTower(), (tokens, torch.ones_like(tokens)), path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["text_embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "text_embeds": {0: "batch"},
+            },
+            opset_version=ONNX_OPSET,
+        ), text_path)
+
+    log.info(f"Exported {model_name} to {os.path.dirname(vision_path)}")
+    return vision_path, text_path
+
+
+def quantize_onnx(source: str, target: str):
+    """Dynamic int8 quantization of MatMul/Gemm weights (activations stay fp32)"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    _replace_atomically(lambda path: quantize_dynamic(source, path, weight_type=QuantType.QInt8), target)
+
+
+def ensure_onnx(model_name: str, onnx_dir: str, quantized: bool = False):
+    """Paths of the requested graphs, exporting/quantizing whatever is missing"""
+    fp32_paths = onnx_paths(model_name, onnx_dir)
+    if not all(os.path.exists(p) for p in fp32_paths):
+        export_onnx(model_name, onnx_dir)
+    if not quantized:
+        return fp32_paths
+
+    int8_paths = onnx_paths(model_name, onnx_dir, quantized=True)
+    for source, target in zip(fp32_paths, int8_paths):
+        if not os.path.exists(target):
+            quantize_onnx(source, target)
+    return int8_paths
+
+
+def make_session(path: str, threads: int = 0, interop_threads: int = 0):
+    """CPU InferenceSession with explicit thread pools (0 = onnxruntime default)"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = interop_threads
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
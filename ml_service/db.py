@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+
+# ============================================================
+# 🧩 DATABASE CONNECTION POOL
+# ============================================================
+# Settings use the same DB_* names as the Laravel .env so both apps can share
+# one file; DATABASE_URL (a libpq DSN/URI) takes precedence when set.
+
+def connect_params():
+    """libpq connection arguments from the environment"""
+    params = {
+        "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
+        "application_name": os.getenv("DB_APPLICATION_NAME", "relove-ml-service"),
+    }
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "10000"))
+    if statement_timeout > 0:
+        params["options"] = f"-c statement_timeout={statement_timeout}"
+
+    dsn = os.getenv("DATABASE_URL")
+    if dsn:
+        params["dsn"] = dsn
+    else:
+        params.update(
+            dbname=os.getenv("DB_DATABASE", "postgres"),
+            user=os.getenv("DB_USERNAME", "postgres"),
+            password=os.getenv("DB_PASSWORD", ""),
+            host=os.getenv("DB_HOST", "127.0.0.1"),
+            port=os.getenv("DB_PORT", "5432"),
+        )
+        sslmode = os.getenv("DB_SSLMODE")
+        if sslmode:
+            params["sslmode"] = sslmode
+    return params
+
+
+def connect():
+    """A standalone (unpooled) connection, for CLI jobs and migrations"""
+    return psycopg2.connect(**connect_params())
+
+
+class PoolTimeout(Exception):
+    """No connection became free within DB_POOL_TIMEOUT seconds"""
+
+
+class ConnectionPool:
+    """ThreadedConnectionPool that waits for a free connection instead of failing.
+
+    psycopg2's pool raises as soon as `maxconn` connections are checked out,
+    so a semaphore bounds checkouts and lets callers queue for up to
+    `timeout` seconds. Connections idle for longer than `check_after`
+    seconds are pinged before reuse and replaced if the server dropped them.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 10.0, check_after: float = 30.0, **params):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self._params = params
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats_lock = threading.Lock()
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _get_pool(self):
+        # Created lazily so importing the service never opens a connection
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self._params)
+        return self._pool
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0.0) < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+        waited = time.perf_counter() - started
+
+        try:
+            db_pool = self._get_pool()
+            conn = db_pool.getconn()
+            while not self._healthy(conn):
+                db_pool.putconn(conn, close=True)
+                with self._stats_lock:
+                    self._discarded += 1
+                conn = db_pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            if waited > 0.001:
+                self._waits += 1
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            self._last_used[id(conn)] = time.monotonic()
+            self._get_pool().putconn(conn, close=close or conn.closed)
+            if close or conn.closed:
+                self._last_used.pop(id(conn), None)
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "saturation": round(self._in_use / self.maxconn, 4),
+                "checkouts": self._checkouts,
+                "waited_checkouts": self._waits,
+                "wait_ms_total": round(self._wait_total * 1000, 3),
+                "wait_ms_avg": round(self._wait_total * 1000 / max(self._checkouts, 1), 3),
+                "wait_ms_max": round(self._wait_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "discarded_connections": self._discarded,
+            }
+
+    def closeall(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
+
+db_pool = ConnectionPool(
+    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    check_after=float(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+    **connect_params(),
+)
+
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection; commits on success, rolls back on error, always returns it"""
+    conn = db_pool.getconn()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, close=broken)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_codec import decode_embedding, encode_embedding, is_encoded
+
+
+# ============================================================
+# 🧊 CONTENT-HASH EMBEDDING CACHE
+# ============================================================
+# Key: blake2b(namespace + image bytes), where the namespace names everything
+# that changes the vector (model, inference backend, preprocessing version),
+# so switching any of them never serves a stale embedding.
+# Tiers: a bounded in-process LRU, then optionally one small file per key
+# under disk_dir (canonical embedding_codec bytes) that survives restarts and
+# is shared by every worker on the host.
+
+class EmbeddingCache:
+    """LRU (+ optional disk) cache of image embeddings keyed by content hash"""
+
+    def __init__(self, max_entries: int = 10000, disk_dir: str = None, namespace: str = ""):
+        self.max_entries = max(0, max_entries)
+        self.disk_dir = disk_dir or None
+        self.namespace = namespace
+        self._prefix = hashlib.blake2b(namespace.encode("utf-8"), digest_size=8).hexdigest()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._disk_errors = 0
+
+    def key(self, data: bytes) -> str:
+        digest = hashlib.blake2b(data, digest_size=20, person=b"clip-embed")
+        digest.update(self._prefix.encode("ascii"))
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, self._prefix, key[:2], key + ".emb")
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str):
+        """Cached vector (read-only) or None"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._memory_hits += 1
+                return vector
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as fh:
+                    payload = fh.read()
+                if is_encoded(payload):
+                    vector = np.array(decode_embedding(payload))
+                    vector.flags.writeable = False
+                    self._remember(key, vector)
+                    with self._lock:
+                        self._disk_hits += 1
+                    return vector
+            except FileNotFoundError:
+                pass
+            except OSError:
+                with self._lock:
+                    self._disk_errors += 1
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def lookup(self, data: bytes):
+        """(key, cached vector or None) for raw image bytes"""
+        key = self.key(data)
+        return key, self.get(key)
+
+    def put(self, key: str, vector) -> np.ndarray:
+        """Store a vector under `key`; returns the read-only copy that was cached"""
+        vector = np.array(vector, dtype=np.float32).reshape(-1)
+        vector.flags.writeable = False
+        self._remember(key, vector)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, "wb") as fh:
+                    fh.write(encode_embedding(vector))
+                os.replace(tmp_path, path)
+            except OSError:
+                with self._lock:
+                    self._disk_errors += 1
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                "namespace": self.namespace,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_tier": self.disk_dir is not None,
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "disk_errors": self._disk_errors,
+            }
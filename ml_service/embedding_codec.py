@@ -0,0 +1,78 @@
+import base64
+import json
+import pickle
+import struct
+
+import numpy as np
+
+
+# ============================================================
+# 💾 CANONICAL EMBEDDING FORMAT
+# ============================================================
+# 8-byte header followed by raw little-endian float32 values:
+#
+#   magic   2s   b"EV"
+#   version u8   FORMAT_VERSION
+#   dtype   u8   1 = float32 (reserved for other precisions)
+#   dim     u32  number of values
+#
+# The header keeps the payload 4-byte aligned, so decoding is a zero-copy
+# np.frombuffer view. A 512-dim vector is 2056 bytes (2744 as base64).
+
+MAGIC = b"EV"
+FORMAT_VERSION = 1
+DTYPE_FLOAT32 = 1
+HEADER = struct.Struct("<2sBBI")
+
+
+def encode_embedding(vector) -> bytes:
+    """Serialize a vector to the canonical header + float32 bytes"""
+    vec = np.ascontiguousarray(np.asarray(vector, dtype="<f4").reshape(-1))
+    return HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_FLOAT32, vec.shape[0]) + vec.tobytes()
+
+
+def is_encoded(data) -> bool:
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:2]) == MAGIC
+
+
+def decode_embedding(data) -> np.ndarray:
+    """Read canonical bytes as a read-only float32 view (no copy, no parsing)"""
+    if len(data) < HEADER.size:
+        raise ValueError("Embedding payload shorter than its header")
+    magic, version, dtype, dim = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a canonical embedding payload")
+    if version != FORMAT_VERSION or dtype != DTYPE_FLOAT32:
+        raise ValueError(f"Unsupported embedding format v{version} dtype {dtype}")
+    if len(data) != HEADER.size + 4 * dim:
+        raise ValueError(f"Embedding payload size does not match dim {dim}")
+    return np.frombuffer(data, dtype="<f4", count=dim, offset=HEADER.size)
+
+
+def embedding_to_b64(vector) -> str:
+    return base64.b64encode(encode_embedding(vector)).decode("ascii")
+
+
+def b64_to_embedding(text: str) -> np.ndarray:
+    return decode_embedding(base64.b64decode(text, validate=True))
+
+
+def decode_legacy(data) -> np.ndarray:
+    """Parse the pre-v1 storage formats: JSON/Python lists, '[...]' or comma text, pickled arrays.
+
+    Only used for rows that have not been rewritten by migrate_embeddings.py.
+    """
+    if isinstance(data, (list, tuple)):
+        return np.asarray(data, dtype=np.float32)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if isinstance(data, (bytes, bytearray)):
+        if is_encoded(data):
+            return decode_embedding(data)
+        # Trusted rows written by older versions of this service only
+        return np.asarray(pickle.loads(data), dtype=np.float32).reshape(-1)
+
+    text = str(data).strip()
+    if text.startswith("["):
+        return np.asarray(json.loads(text), dtype=np.float32)
+    return np.array([float(x) for x in text.replace(",", " ").split()], dtype=np.float32)
@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from db import PoolTimeout
+
+
+# ============================================================
+# ⚙️ EXECUTION MODEL
+# ============================================================
+# The event loop only parses requests and awaits results. Blocking work runs
+# in bounded pools:
+#   inference_executor  CLIP forward passes (torch parallelizes each call
+#                       internally, so few workers)
+#   cpu_executor        image decoding and NumPy scoring, sized to the cores
+#   db_executor         psycopg2 queries, sized to the connection pool
+# Each pool admits at most `max_pending` queued+running jobs; beyond that
+# requests fail fast with 503 + Retry-After instead of queueing unboundedly.
+# A DB job that times out waiting for a pooled connection is reported the same way.
+
+class Overloaded(HTTPException):
+    """503 raised when a pool's queue is full"""
+
+    def __init__(self, pool_name: str, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"Service busy ({pool_name} queue full), retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor with admission control for use from async handlers"""
+
+    def __init__(self, name: str, workers: int, max_pending: int, retry_after: int = 1, overload_errors=()):
+        self.name = name
+        # Exceptions from the job itself that also mean "saturated, retry later"
+        self.overload_errors = tuple(overload_errors)
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise Overloaded(self.name, self.retry_after)
+            self._pending += 1
+
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in this pool and await its result"""
+        self._admit()
+        try:
+            # Carry the request's context (metrics/log labels) into the worker thread
+            call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+        except self.overload_errors:
+            with self._lock:
+                self._rejected += 1
+            raise Overloaded(self.name, self.retry_after)
+        finally:
+            self._done()
+
+    @property
+    def executor(self):
+        """The underlying pool, for callers that manage their own admission"""
+        return self._pool
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "saturation": round(self._pending / self.max_pending, 4),
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+inference_executor = BoundedExecutor(
+    "inference",
+    workers=int(os.getenv("INFERENCE_WORKERS", "1")),
+    max_pending=int(os.getenv("INFERENCE_MAX_PENDING", "64")),
+    retry_after=int(os.getenv("OVERLOAD_RETRY_AFTER", "2")),
+)
+cpu_executor = BoundedExecutor(
+    "cpu",
+    workers=int(os.getenv("CPU_WORKERS", str(CPU_COUNT))),
+    max_pending=int(os.getenv("CPU_MAX_PENDING", str(CPU_COUNT * 16))),
+    retry_after=int(os.getenv("OVERLOAD_RETRY_AFTER", "2")),
+)
+db_executor = BoundedExecutor(
+    "db",
+    workers=int(os.getenv("DB_POOL_MAX", "10")),
+    max_pending=int(os.getenv("DB_MAX_PENDING", "100")),
+    retry_after=int(os.getenv("OVERLOAD_RETRY_AFTER", "2")),
+    overload_errors=(PoolTimeout,),
+)
@@ -0,0 +1,128 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+# ============================================================
+# 🖼️ IMAGE PREPROCESSING (decode → CLIP pixel values)
+# ============================================================
+# Equivalent to CLIPProcessor's image path (shortest side → 224 bicubic,
+# center crop, rescale, normalize) but much cheaper on phone photos:
+#   - payloads over MAX_IMAGE_BYTES and images over MAX_IMAGE_PIXELS are
+#     rejected from the header, before any pixel is decoded
+#   - JPEGs are decoded at 1/2, 1/4 or 1/8 scale via Image.draft when that
+#     still leaves the shortest side >= the target size
+#   - EXIF orientation is applied, so rotated uploads match upright ones
+#   - resize and crop happen in one resample of the crop region, and the
+#     uint8 → normalized float32 conversion writes straight into `out`
+
+# Bump whenever the pixel pipeline changes output, so cached embeddings are not reused
+PREPROCESS_VERSION = 1
+
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class ImageTooLarge(ValueError):
+    """Payload or pixel count over the configured limit"""
+
+
+class ImagePreprocessor:
+    """Decodes image bytes into normalized (3, crop, crop) float32 CLIP inputs"""
+
+    def __init__(
+        self,
+        size: int = 224,
+        crop_size: int = 224,
+        mean=CLIP_MEAN,
+        std=CLIP_STD,
+        max_bytes: int = MAX_IMAGE_BYTES,
+        max_pixels: int = MAX_IMAGE_PIXELS,
+    ):
+        self.size = size
+        self.crop_size = crop_size
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        std = np.asarray(std, dtype=np.float32).reshape(3, 1, 1)
+        # (x / 255 - mean) / std  ==  x * scale - offset
+        self._scale = 1.0 / (255.0 * std)
+        self._offset = np.asarray(mean, dtype=np.float32).reshape(3, 1, 1) / std
+
+    @classmethod
+    def from_processor(cls, image_processor, **limits):
+        """Mirror a transformers CLIPImageProcessor's size, crop and normalization settings"""
+        size = image_processor.size
+        crop = image_processor.crop_size
+        return cls(
+            size=size.get("shortest_edge", 224) if isinstance(size, dict) else int(size),
+            crop_size=crop.get("height", 224) if isinstance(crop, dict) else int(crop),
+            mean=image_processor.image_mean,
+            std=image_processor.image_std,
+            **limits,
+        )
+
+    def open(self, data: bytes) -> Image.Image:
+        """Decode to an upright RGB image, at reduced scale for JPEGs when possible"""
+        if len(data) > self.max_bytes:
+            raise ImageTooLarge(f"Image is {len(data)} bytes; the limit is {self.max_bytes}")
+
+        image = Image.open(io.BytesIO(data))  # lazy: only the header is parsed here
+        width, height = image.size
+        if width * height > self.max_pixels:
+            raise ImageTooLarge(f"Image is {width}x{height}; the limit is {self.max_pixels} pixels")
+
+        # JPEG only; picks the largest DCT downscale that keeps both sides >= size
+        image.draft("RGB", (self.size, self.size))
+        image = ImageOps.exif_transpose(image)
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    def to_array(self, image: Image.Image, out: np.ndarray = None) -> np.ndarray:
+        """Resize shortest side to `size`, center crop and normalize into `out` (3, crop, crop)"""
+        width, height = image.size
+        scale = self.size / min(width, height)
+        crop_w = crop_h = self.crop_size / scale
+        left = (width - crop_w) / 2
+        top = (height - crop_h) / 2
+        image = image.resize(
+            (self.crop_size, self.crop_size),
+            Image.BICUBIC,
+            box=(left, top, left + crop_w, top + crop_h),
+        )
+
+        if out is None:
+            out = np.empty((3, self.crop_size, self.crop_size), dtype=np.float32)
+        np.multiply(np.asarray(image, dtype=np.uint8).transpose(2, 0, 1), self._scale, out=out)
+        np.subtract(out, self._offset, out=out)
+        return out
+
+    def preprocess(self, data: bytes) -> np.ndarray:
+        """One image as a (1, 3, crop, crop) batch; raises on undecodable or oversized input"""
+        out = np.empty((1, 3, self.crop_size, self.crop_size), dtype=np.float32)
+        self.to_array(self.open(data), out=out[0])
+        return out
+
+    def preprocess_batch(self, images, out: np.ndarray = None):
+        """Decode many images into one contiguous batch.
+
+        Returns (pixel_values, errors): pixel_values holds the decodable
+        images in order, errors maps input position → message for the rest.
+        Pass a reusable `out` buffer (at least len(images) rows) to avoid
+        allocating per batch; the returned array is a view into it.
+        """
+        shape = (len(images), 3, self.crop_size, self.crop_size)
+        if out is None or out.shape[0] < len(images) or out.shape[1:] != shape[1:]:
+            out = np.empty(shape, dtype=np.float32)
+
+        row, errors = 0, {}
+        for position, data in enumerate(images):
+            try:
+                self.to_array(self.open(data), out=out[row])
+                row += 1
+            except Exception as e:
+                errors[position] = str(e)
+        return out[:row], errors
@@ -0,0 +1,42 @@
+import re
+import unicodedata
+
+
+# ============================================================
+# 🔤 LEXICAL NAME MATCHING (text search blend)
+# ============================================================
+# CLIP ranks by what a product looks like; shoppers also type brand names,
+# models and sizes that only appear in the product name. The lexical score is
+# the share of query tokens found in the name (a token also matches a name
+# word it is a prefix of, so "sneak" matches "sneakers"), computed only for
+# the CLIP shortlist, so it never scans the catalog.
+
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text: str):
+    """Lowercased, accent-folded word tokens"""
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _TOKEN.findall(folded)
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form used as the text-embedding cache key"""
+    return " ".join(tokenize(text))
+
+
+def lexical_score(query_tokens, name: str) -> float:
+    """Fraction of query tokens present in `name` (exact or as a word prefix), in [0, 1]"""
+    if not query_tokens:
+        return 0.0
+    words = set(tokenize(name))
+    if not words:
+        return 0.0
+    matched = 0
+    for token in query_tokens:
+        if token in words or any(word.startswith(token) for word in words):
+            matched += 1
+    return matched / len(query_tokens)
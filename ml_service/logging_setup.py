@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import sys
+import time
+
+from metrics import request_endpoint
+
+
+# ============================================================
+# 📝 STRUCTURED LOGGING
+# ============================================================
+# LOG_FORMAT=text (default) keeps one readable line per event; LOG_FORMAT=json
+# emits one JSON object per line for log shippers. Either way each record
+# carries the request's endpoint and any `extra={"fields": {...}}` passed by
+# the caller. The level starts at LOG_LEVEL and can be changed at runtime
+# (POST /log_level/), so debug detail costs nothing until it is switched on.
+
+LOGGER_NAME = "ml_service"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "endpoint": request_endpoint.get(),
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(level: str = None, fmt: str = None) -> logging.Logger:
+    """Set up the service logger once (idempotent under reloads)"""
+    logger = logging.getLogger(LOGGER_NAME)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+        handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    set_log_level(level or os.getenv("LOG_LEVEL", "INFO"))
+    return logger
+
+
+def set_log_level(level: str) -> str:
+    """Change the service log level; returns the level now in effect"""
+    name = str(level).upper()
+    if not isinstance(logging.getLevelName(name), int):
+        raise ValueError(f"Unknown log level {level!r}")
+    logging.getLogger(LOGGER_NAME).setLevel(name)
+    return name
+
+
+def get_log_level() -> str:
+    return logging.getLevelName(logging.getLogger(LOGGER_NAME).level)
@@ -0,0 +1,169 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ============================================================
+# 📈 METRICS (Prometheus text exposition, no client library)
+# ============================================================
+# Counters and histograms are updated inline on the request path (a dict
+# lookup and an add under a lock). Values other components already track
+# (cache hit counts, pool depth, index size) are read from their stats()
+# only when /metrics is scraped, via callback metrics, so nothing is counted
+# twice. Stage timers label themselves with the endpoint stored in
+# `request_endpoint` by the request middleware; BoundedExecutor copies the
+# context into worker threads, so timers inside jobs are labelled too.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+request_endpoint = contextvars.ContextVar("request_endpoint", default="background")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.label_names, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            snapshot = {key: list(state) for key, state in self._values.items()}
+        samples = []
+        for key, state in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _labels(self.label_names, key, [("le", _number(bound))]), cumulative))
+            samples.append((f"{self.name}_sum", _labels(self.label_names, key), state[-2]))
+            samples.append((f"{self.name}_count", _labels(self.label_names, key), state[-1]))
+        return samples
+
+
+class CallbackMetric:
+    """Gauge or counter whose values come from `fn()` -> [(labels dict, value)] at scrape time"""
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge"):
+        self.name, self.help, self.kind, self.fn = name, help, kind, fn
+
+    def samples(self):
+        samples = []
+        for labels, value in self.fn():
+            if value is None:
+                continue
+            samples.append((self.name, _labels(labels.keys(), labels.values()), value))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, fn, kind="gauge"):
+        return self.register(CallbackMetric(name, help, fn, kind))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One broken collector must not take the whole scrape down
+                lines.append(f"# {metric.name} collection failed: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "ml_stage_duration_seconds",
+    "Time spent per request stage (upload, decode, preprocess, encode, scoring, db_fetch, hydration, ...)",
+    labels=("endpoint", "stage"),
+)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as stage `name` of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, endpoint=request_endpoint.get(), stage=name)
@@ -0,0 +1,182 @@
+import threading
+import time
+
+import numpy as np
+
+
+# ============================================================
+# 📋 MATERIALIZED NEIGHBOUR TABLE (/recommend/)
+# ============================================================
+# product_id -> its top-K exact neighbours, scored exactly like /recommend/
+# (same-category boost, capped). A full build scores the catalog in blocks of
+# matrix-matrix products; afterwards only what changed is recomputed:
+#   - the changed product itself
+#   - products whose list contains it (its score or name is now outdated)
+#   - products in its new list (by symmetry it has probably entered theirs)
+# Products missed by the symmetry shortcut are picked up by the periodic full
+# rebuild, so every entry is at most one full-rebuild interval stale.
+
+class NeighborTable:
+    """Precomputed top-K recommendation lists over a VectorIndex"""
+
+    def __init__(self, index, k: int = 50, boost: float = 0.0, max_score: float = None, block_size: int = 256):
+        self.index = index
+        self.k = k
+        self.boost = boost
+        self.max_score = max_score
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._entries = {}  # product_id -> (neighbours, computed_at)
+        self._reverse = {}  # neighbour id -> ids whose list contains it
+        self._dirty = set()
+        self._all_dirty = True  # nothing built yet
+        self.last_full_build = None
+        self.last_full_build_seconds = None
+        self.last_refresh = None
+        self._recomputed = 0
+        self.version = 0  # bumped whenever any stored list changes
+        index.add_listener(self.mark_changed)
+
+    # ---- change tracking -------------------------------------------------
+    def mark_changed(self, product_id):
+        """Index listener: a product was upserted/removed (None = everything reloaded)"""
+        with self._lock:
+            if product_id is None:
+                self._all_dirty = True
+            else:
+                self._dirty.add(product_id)
+
+    def is_stale(self, product_id) -> bool:
+        with self._lock:
+            return self._all_dirty or product_id in self._dirty or any(
+                n["product_id"] in self._dirty for n in self._entries.get(product_id, ((),))[0]
+            )
+
+    # ---- computation -----------------------------------------------------
+    def _compute(self, product_ids):
+        """Exact neighbour lists for products still in the index"""
+        sources = []
+        for product_id in product_ids:
+            indexed = self.index.get(product_id)
+            if indexed is not None:
+                sources.append((product_id, indexed[0], indexed[2]))
+
+        computed = {}
+        for start in range(0, len(sources), self.block_size):
+            block = sources[start:start + self.block_size]
+            lists = self.index.search_batch(
+                np.vstack([vector for _, vector, _ in block]),
+                top_k=self.k,
+                exclude_ids=[(product_id,) for product_id, _, _ in block],
+                boost_categories=[category for _, _, category in block],
+                boost=self.boost,
+                max_score=self.max_score,
+            )
+            for (product_id, _, _), neighbours in zip(block, lists):
+                computed[product_id] = neighbours
+        return computed
+
+    def _store(self, computed, removed=()):
+        now = time.time()
+        with self._lock:
+            for product_id in list(computed) + list(removed):
+                old = self._entries.pop(product_id, None)
+                if old is not None:
+                    for neighbour in old[0]:
+                        holders = self._reverse.get(neighbour["product_id"])
+                        if holders is not None:
+                            holders.discard(product_id)
+            for product_id, neighbours in computed.items():
+                self._entries[product_id] = (neighbours, now)
+                for neighbour in neighbours:
+                    self._reverse.setdefault(neighbour["product_id"], set()).add(product_id)
+            self._recomputed += len(computed)
+            if computed or removed:
+                self.version += 1
+
+    def rebuild(self) -> int:
+        """Recompute every product's list; returns the number of entries built"""
+        started = time.perf_counter()
+        with self._lock:
+            self._all_dirty = False
+            self._dirty.clear()
+        product_ids = sorted(self.index.product_ids())
+
+        built = 0
+        for start in range(0, len(product_ids), self.block_size * 8):
+            # Publish as we go so lists become servable during a long build
+            computed = self._compute(product_ids[start:start + self.block_size * 8])
+            self._store(computed)
+            built += len(computed)
+
+        live = set(product_ids)
+        with self._lock:
+            stale = [product_id for product_id in self._entries if product_id not in live]
+        self._store({}, removed=stale)
+        self.last_full_build = time.time()
+        self.last_full_build_seconds = round(time.perf_counter() - started, 3)
+        return built
+
+    def refresh(self) -> int:
+        """Incrementally recompute what changed since the last refresh; returns entries recomputed"""
+        with self._lock:
+            if self._all_dirty:
+                full = True
+            else:
+                full = False
+                dirty, self._dirty = self._dirty, set()
+        if full:
+            return self.rebuild()
+        if not dirty:
+            return 0
+
+        with self._lock:
+            affected = set(dirty)
+            for product_id in dirty:
+                affected |= self._reverse.get(product_id, set())
+
+        computed = self._compute(affected)
+        for product_id in dirty:
+            # Symmetry: whoever is now near a changed product probably lists it too
+            affected |= {n["product_id"] for n in computed.get(product_id, ())}
+        computed.update(self._compute(affected - set(computed)))
+
+        removed = [product_id for product_id in affected if product_id not in computed]
+        self._store(computed, removed=removed)
+        self.last_refresh = time.time()
+        return len(computed)
+
+    def recompute(self, product_id):
+        """On-demand exact recompute of one product's list; None if it is not indexed"""
+        computed = self._compute([product_id])
+        self._store(computed, removed=() if computed else (product_id,))
+        return self.get(product_id)
+
+    # ---- serving ---------------------------------------------------------
+    def get(self, product_id, top_k: int = None):
+        """(neighbours, computed_at) with at most top_k copies, or None if not materialized"""
+        if top_k is not None and top_k > self.k:
+            return None
+        with self._lock:
+            entry = self._entries.get(str(product_id))
+        if entry is None:
+            return None
+        neighbours, computed_at = entry
+        return [dict(n) for n in neighbours[:top_k]], computed_at
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            oldest = min((computed_at for _, computed_at in self._entries.values()), default=None)
+            return {
+                "k": self.k,
+                "entries": len(self._entries),
+                "indexed_products": len(self.index),
+                "dirty": len(self._dirty),
+                "full_rebuild_pending": self._all_dirty,
+                "oldest_entry_age_s": round(now - oldest, 1) if oldest is not None else None,
+                "last_full_build_age_s": round(now - self.last_full_build, 1) if self.last_full_build else None,
+                "last_full_build_seconds": self.last_full_build_seconds,
+                "last_refresh_age_s": round(now - self.last_refresh, 1) if self.last_refresh else None,
+                "recomputed_total": self._recomputed,
+            }
@@ -0,0 +1,242 @@
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from embedding_codec import decode_embedding, decode_legacy, is_encoded
+from vector_index import normalize
+
+
+# ============================================================
+# 🐘 PGVECTOR SEARCH BACKEND (SEARCH_BACKEND=pgvector)
+# ============================================================
+# Postgres stays the only copy of the vectors: product_embeddings gains an
+# `embedding_vec vector(dim)` column with an HNSW (or IVFFlat) cosine index
+# (see migrate_pgvector.py), and each query is one
+#     ORDER BY embedding_vec <=> query LIMIT k
+# so only k rows leave the database. The class mirrors the parts of
+# VectorIndex the search endpoints use (get / search / categories / len /
+# version), so they can run against either backend.
+#
+# Embeddings are L2-normalized, so 1 - cosine distance equals the dot-product
+# similarity the in-process index returns. The category boost cannot be
+# expressed in an index-ordered scan: the query over-fetches
+# top_k * candidate_factor rows, then boosts and re-ranks them here.
+
+VECTOR_COLUMN = "embedding_vec"
+
+
+def vector_literal(vector) -> str:
+    """pgvector text input ('[x,y,...]') for a float vector"""
+    return "[" + ",".join(repr(float(x)) for x in np.asarray(vector, dtype=np.float32).reshape(-1)) + "]"
+
+
+def has_vector_column(cursor) -> bool:
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'product_embeddings' AND column_name = %s
+    """, (VECTOR_COLUMN,))
+    return cursor.fetchone() is not None
+
+
+class PgVectorIndex:
+    """VectorIndex-compatible search that runs inside Postgres via pgvector"""
+
+    def __init__(
+        self,
+        get_conn,
+        dim: int = 512,
+        ef_search: int = 40,
+        probes: int = 10,
+        candidate_factor: int = 4,
+        iterative_scan: str = "",
+    ):
+        self._get_conn = get_conn
+        self.dim = dim
+        self.ef_search = ef_search
+        self.probes = probes
+        self.candidate_factor = max(1, candidate_factor)
+        # pgvector >= 0.8: keep scanning the HNSW graph until filtered queries fill LIMIT
+        self.iterative_scan = iterative_scan
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._checked_writes = 0  # _writes when the last check() started
+        self._summary = (None, 0, [])  # (max updated_at, row count, categories)
+
+    # ---- catalog summary (polled, not queried per request) ---------------
+    def check(self):
+        """Verify the vector column exists and refresh the cached catalog summary"""
+        with self._lock:
+            writes = self._writes
+        with self._get_conn() as conn:
+            with conn.cursor() as cursor:
+                if not has_vector_column(cursor):
+                    raise RuntimeError(
+                        f"product_embeddings.{VECTOR_COLUMN} not found; run migrate_pgvector.py"
+                    )
+                cursor.execute(f"""
+                    SELECT MAX(updated_at), COUNT(*) FROM product_embeddings
+                    WHERE {VECTOR_COLUMN} IS NOT NULL
+                """)
+                latest, count = cursor.fetchone()
+                cursor.execute(f"""
+                    SELECT DISTINCT category FROM product_embeddings
+                    WHERE {VECTOR_COLUMN} IS NOT NULL AND category IS NOT NULL
+                """)
+                categories = sorted(row[0] for row in cursor.fetchall())
+        with self._lock:
+            self._summary = (latest, count, categories)
+            self._checked_writes = writes
+        if self.loaded_at is None:
+            self.loaded_at = time.time()
+
+    def _current_summary(self):
+        # Refreshed by check() on a timer (the service's maintenance loop), never per request
+        with self._lock:
+            return self._summary
+
+    @property
+    def version(self):
+        """Changes when rows are written (here or elsewhere) or deleted through this service"""
+        latest, count, _ = self._current_summary()
+        with self._lock:
+            return [str(latest), count, self._writes]
+
+    @property
+    def shared_version(self):
+        """Same on every worker with the same summary; None until check() has seen this worker's writes"""
+        latest, count, _ = self._current_summary()
+        with self._lock:
+            if self._writes != self._checked_writes:
+                return None
+        return [str(latest), count]
+
+    @property
+    def attributes_version(self) -> int:
+        # Price/stock filters read live rows; the response cache TTL bounds staleness
+        return 0
+
+    def __len__(self):
+        return self._current_summary()[1]
+
+    def categories(self):
+        return list(self._current_summary()[2])
+
+    # ---- writes happen in Postgres; just note them -----------------------
+    def upsert(self, product_id, name, category, vector):
+        with self._lock:
+            self._writes += 1
+
+    def remove(self, product_id) -> bool:
+        with self._lock:
+            self._writes += 1
+        return True
+
+    # ---- lookups ---------------------------------------------------------
+    def get(self, product_id):
+        """(vector, name, category) for a stored product, or None"""
+        with self._get_conn() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT embedding, name, category FROM product_embeddings
+                    WHERE product_id::text = %s AND {VECTOR_COLUMN} IS NOT NULL
+                """, (str(product_id),))
+                row = cursor.fetchone()
+        if row is None:
+            return None
+        raw = bytes(row[0]) if isinstance(row[0], memoryview) else row[0]
+        vector = decode_embedding(raw) if is_encoded(raw) else decode_legacy(raw)
+        return normalize(vector), row[1], row[2]
+
+    def search(
+        self,
+        query,
+        top_k: int = 10,
+        exclude_ids=(),
+        boost_category: Optional[str] = None,
+        boost: float = 0.0,
+        max_score: Optional[float] = None,
+        exact: bool = False,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None,
+        include_categories=None,
+        exclude_categories=None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        in_stock: bool = False,
+        min_score: Optional[float] = None,
+    ):
+        """Same contract as VectorIndex.search, answered by the database"""
+        query = normalize(query)
+        if query is None or query.shape[0] != self.dim:
+            raise ValueError(f"Query embedding must be a non-zero {self.dim}-dim vector")
+
+        conditions = [f"pe.{VECTOR_COLUMN} IS NOT NULL"]
+        params = []
+        exclude_ids = [str(pid) for pid in exclude_ids]
+        if exclude_ids:
+            conditions.append("NOT (pe.product_id::text = ANY(%s))")
+            params.append(exclude_ids)
+        if include_categories is not None:
+            conditions.append("pe.category = ANY(%s)")
+            params.append(list(include_categories))
+        if exclude_categories:
+            conditions.append("NOT (pe.category = ANY(%s))")
+            params.append(list(exclude_categories))
+
+        join = ""
+        if min_price is not None or max_price is not None or in_stock:
+            join = "JOIN products p ON p.product_id::text = pe.product_id::text"
+            if min_price is not None:
+                conditions.append("p.product_price >= %s")
+                params.append(min_price)
+            if max_price is not None:
+                conditions.append("p.product_price <= %s")
+                params.append(max_price)
+            if in_stock:
+                conditions.append("p.product_quantity > 0")
+
+        limit = top_k * self.candidate_factor if boost and boost_category is not None else top_k
+        literal = vector_literal(query)
+
+        with self._get_conn() as conn:
+            with conn.cursor() as cursor:
+                # SET LOCAL lasts until the pooled connection's transaction ends
+                if exact:
+                    cursor.execute("SET LOCAL enable_indexscan = off")
+                # HNSW returns at most ef_search rows per scan (pgvector caps it at 1000)
+                ef_search = min(max(ef or self.ef_search, limit), 1000)
+                cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+                cursor.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(nprobe or self.probes),))
+                if self.iterative_scan and len(conditions) > 1:
+                    cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (self.iterative_scan,))
+                cursor.execute(f"""
+                    SELECT pe.product_id::text, pe.name, pe.category,
+                           1 - (pe.{VECTOR_COLUMN} <=> %s::vector) AS similarity
+                    FROM product_embeddings pe
+                    {join}
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY pe.{VECTOR_COLUMN} <=> %s::vector
+                    LIMIT %s
+                """, [literal, *params, literal, limit])
+                rows = cursor.fetchall()
+
+        results = []
+        for product_id, name, category, similarity in rows:
+            score = float(similarity)
+            if boost and boost_category is not None and category == boost_category:
+                score += boost
+                if max_score is not None:
+                    score = min(score, max_score)
+            if min_score is not None and score < min_score:
+                continue
+            results.append({
+                "product_id": product_id,
+                "name": name,
+                "category": category,
+                "similarity": score,
+            })
+        results.sort(key=lambda r: r["similarity"], reverse=True)
+        return results[:top_k]
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# ============================================================
+# 🏷️ PRODUCT METADATA CACHE (result hydration)
+# ============================================================
+# Search ranks on ids and vectors only; price, stock, primary image and store
+# name are looked up afterwards for the top-k winners. This keeps those
+# lookups in memory: entries expire after `ttl` seconds, and products whose
+# row changed are invalidated by the attribute sync, so a price edit shows up
+# on the next maintenance cycle rather than after the TTL.
+
+class ProductMetadataCache:
+    """LRU + TTL cache of per-product display metadata"""
+
+    def __init__(self, max_entries: int = 50000, ttl: float = 300.0):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # product_id -> (expires_at, details)
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get_many(self, product_ids):
+        """(found {product_id: details}, missing [product_id]) for the requested ids"""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for product_id in product_ids:
+                entry = self._entries.get(product_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(product_id)
+                    found[product_id] = entry[1]
+                else:
+                    if entry is not None:
+                        del self._entries[product_id]
+                    missing.append(product_id)
+            self._hits += len(found)
+            self._misses += len(missing)
+        return found, missing
+
+    def put_many(self, details):
+        if self.max_entries == 0:
+            return
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for product_id, detail in details.items():
+                self._entries[product_id] = (expires_at, detail)
+                self._entries.move_to_end(product_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, product_ids=None):
+        """Drop the given products (None = everything)"""
+        with self._lock:
+            if product_ids is None:
+                self._invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            for product_id in product_ids:
+                if self._entries.pop(product_id, None) is not None:
+                    self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self._invalidations,
+            }
@@ -0,0 +1,251 @@
+import threading
+
+import numpy as np
+
+
+# ============================================================
+# 🗜️ COMPRESSED VECTOR STORAGE (float16 / int8 / PQ)
+# ============================================================
+# A storage keeps a compressed copy of the VectorIndex matrix that queries
+# scan instead of the float32 rows; the best `top_k * rerank_factor`
+# candidates are then rescored exactly against the float32 matrix, so result
+# scores keep their scale. When the float32 matrix is a mapped snapshot only
+# the pages of rescored rows are ever read, and a worker's private memory is
+# the compressed copy alone.
+#
+#   float16  2 bytes/dim. Halves memory; numpy converts back to float32 in
+#            small blocks, which costs more than the bandwidth it saves.
+#   int8     1 byte/dim + a float32 scale per vector (scale = max|x| / 127).
+#   pq       product quantization: `m` bytes/vector, one 256-centroid
+#            codebook per dim/m-wide subspace; a query scores by summing
+#            per-subspace lookup tables. Needs training, so it stays off until
+#            the index has `min_rows` rows to train on (at a full load, or
+#            later via VectorIndex.build_storage from the maintenance loop).
+#
+# The float32 matrix is always kept as well: without a mapped snapshot the
+# compressed copy adds to each worker's memory and only the scan gets cheaper.
+#
+# Data is a tuple of arrays with one slot per matrix row (spare capacity
+# included); `axes` gives each array's row axis. Codebooks never change once
+# trained, so codes written earlier stay comparable with new ones.
+
+SCORE_BLOCK_ROWS = 256  # float32 block converted at a time: 256 x 512 x 4 B stays in L2
+ENCODE_BLOCK_ROWS = 65536
+
+
+def _blocked_scores(n: int, score_block) -> np.ndarray:
+    scores = np.empty(n, dtype=np.float32)
+    for start in range(0, n, SCORE_BLOCK_ROWS):
+        stop = min(start + SCORE_BLOCK_ROWS, n)
+        scores[start:stop] = score_block(start, stop)
+    return scores
+
+
+class _Storage:
+    axes = (0,)
+    ready = True
+
+    def train(self, matrix: np.ndarray):
+        pass
+
+    def write(self, data, rows, vectors: np.ndarray):
+        """Encode `vectors` into `rows` (a slice or an array of row numbers)"""
+        for array, part, axis in zip(data, self.encode(vectors), self.axes):
+            if axis == 0:
+                array[rows] = part
+            else:
+                array[:, rows] = part
+
+    def copy_rows(self, data, rows, source, source_rows):
+        for array, other, axis in zip(data, source, self.axes):
+            if axis == 0:
+                array[rows] = other[source_rows]
+            else:
+                array[:, rows] = other[:, source_rows]
+
+    def grow(self, data, size: int, capacity: int):
+        grown = self.allocate(capacity, self.dim)
+        for old, new, axis in zip(data, grown, self.axes):
+            if axis == 0:
+                new[:size] = old[:size]
+            else:
+                new[:, :size] = old[:, :size]
+        return grown
+
+    def view(self, data, size: int):
+        return tuple(array[:size] if axis == 0 else array[:, :size] for array, axis in zip(data, self.axes))
+
+    def take(self, data, rows: np.ndarray):
+        return tuple(np.take(array, rows, axis=axis) for array, axis in zip(data, self.axes))
+
+    def compress(self, matrix: np.ndarray, size: int, reuse=None):
+        """Compressed copy of matrix[:size] with room for all of matrix's rows (None if untrained).
+
+        `reuse` is (previous data, rows, previous rows): codes copied over
+        instead of re-encoded, for rows whose vectors did not change.
+        """
+        if not self.ready:
+            self.train(matrix[:size])
+            reuse = None
+        if not self.ready:
+            return None
+        data = self.allocate(matrix.shape[0], matrix.shape[1])
+        if reuse is None:
+            for start in range(0, size, ENCODE_BLOCK_ROWS):
+                rows = slice(start, min(start + ENCODE_BLOCK_ROWS, size))
+                self.write(data, rows, np.asarray(matrix[rows], dtype=np.float32))
+            return data
+
+        previous, rows, previous_rows = reuse
+        self.copy_rows(data, rows, previous, previous_rows)
+        pending = np.ones(size, dtype=bool)
+        pending[rows] = False
+        pending = np.flatnonzero(pending)
+        for start in range(0, pending.shape[0], ENCODE_BLOCK_ROWS):
+            rows = pending[start:start + ENCODE_BLOCK_ROWS]
+            self.write(data, rows, np.asarray(matrix[rows], dtype=np.float32))
+        return data
+
+    @staticmethod
+    def nbytes(data) -> int:
+        return sum(array.nbytes for array in data)
+
+
+class Float16Storage(_Storage):
+    name = "float16"
+
+    def allocate(self, capacity: int, dim: int):
+        self.dim = dim
+        return (np.zeros((capacity, dim), dtype=np.float16),)
+
+    def encode(self, vectors: np.ndarray):
+        return (vectors.astype(np.float16),)
+
+    def scores(self, data, query: np.ndarray) -> np.ndarray:
+        (halves,) = data
+        return _blocked_scores(halves.shape[0], lambda start, stop: halves[start:stop].astype(np.float32) @ query)
+
+
+class Int8Storage(_Storage):
+    name = "int8"
+    axes = (0, 0)
+
+    def allocate(self, capacity: int, dim: int):
+        self.dim = dim
+        return np.zeros((capacity, dim), dtype=np.int8), np.zeros(capacity, dtype=np.float32)
+
+    def encode(self, vectors: np.ndarray):
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def scores(self, data, query: np.ndarray) -> np.ndarray:
+        codes, scales = data
+        scores = _blocked_scores(codes.shape[0], lambda start, stop: codes[start:stop].astype(np.float32) @ query)
+        scores *= scales
+        return scores
+
+
+def train_codebooks(vectors: np.ndarray, m: int, ksub: int = 256, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Euclidean k-means per subspace: (m, ksub, dim/m) float32 codebooks"""
+    rng = np.random.default_rng(seed)
+    n, dim = vectors.shape
+    dsub = dim // m
+    codebooks = np.empty((m, ksub, dsub), dtype=np.float32)
+    for j in range(m):
+        sub = np.ascontiguousarray(vectors[:, j * dsub:(j + 1) * dsub])
+        centroids = sub[rng.choice(n, ksub, replace=False)].copy()
+        for _ in range(iters):
+            scores = sub @ centroids.T
+            scores -= 0.5 * (centroids * centroids).sum(axis=1)
+            assign = np.argmax(scores, axis=1)
+            counts = np.bincount(assign, minlength=ksub)
+            filled = counts > 0
+            # Per-centroid means, one weighted bincount per subspace dimension
+            for d in range(dsub):
+                sums = np.bincount(assign, weights=sub[:, d], minlength=ksub)
+                centroids[filled, d] = sums[filled] / counts[filled]
+            # Re-seed empty centroids from random training points
+            empty = np.flatnonzero(~filled)
+            if empty.size:
+                centroids[empty] = sub[rng.choice(n, empty.size, replace=False)]
+        codebooks[j] = centroids
+    return codebooks
+
+
+class PQStorage(_Storage):
+    """Product quantization with codes stored subspace-major, (m, rows) uint8.
+
+    Scoring gathers one contiguous row of codes per subspace, which numpy
+    does several times faster than a row-major (rows, m) fancy index.
+    """
+
+    name = "pq"
+    axes = (1,)
+
+    def __init__(self, m: int = 128, min_rows: int = 10000, sample: int = 10000, iters: int = 10):
+        self.m = m
+        self.min_rows = min_rows
+        self.sample = sample
+        self.iters = iters
+        self._lock = threading.Lock()
+        self._codebooks = None
+        self._norms = None
+
+    @property
+    def ready(self):
+        return self._codebooks is not None
+
+    def train(self, matrix: np.ndarray):
+        rows = matrix.shape[0]
+        if rows < max(self.min_rows, 256):
+            return
+        if matrix.shape[1] % self.m:
+            raise ValueError(f"PQ needs dim {matrix.shape[1]} divisible by m={self.m}")
+        rng = np.random.default_rng(0)
+        train = matrix if rows <= self.sample else matrix[np.sort(rng.choice(rows, self.sample, replace=False))]
+        codebooks = train_codebooks(np.asarray(train, dtype=np.float32), self.m, iters=self.iters)
+        with self._lock:
+            if self._codebooks is None:
+                self._codebooks = codebooks
+                self._norms = 0.5 * (codebooks * codebooks).sum(axis=2)
+
+    def allocate(self, capacity: int, dim: int):
+        self.dim = dim
+        return (np.zeros((self.m, capacity), dtype=np.uint8),)
+
+    def encode(self, vectors: np.ndarray):
+        codebooks, norms = self._codebooks, self._norms
+        dsub = vectors.shape[1] // self.m
+        codes = np.empty((self.m, vectors.shape[0]), dtype=np.uint8)
+        for j in range(self.m):
+            # Nearest centroid: argmin |x - c|^2 == argmax (x.c - |c|^2 / 2)
+            scores = vectors[:, j * dsub:(j + 1) * dsub] @ codebooks[j].T
+            scores -= norms[j]
+            codes[j] = np.argmax(scores, axis=1)
+        return (codes,)
+
+    def scores(self, data, query: np.ndarray) -> np.ndarray:
+        (codes,) = data
+        dsub = query.shape[0] // self.m
+        # lut[j, c] = query subvector j . centroid c of subspace j
+        lut = np.einsum("jd,jkd->jk", query.reshape(self.m, dsub), self._codebooks)
+        scores = lut[0].take(codes[0])
+        for j in range(1, self.m):
+            scores += lut[j].take(codes[j])
+        return scores
+
+
+def make_storage(kind: str, **options):
+    """Build a compressed storage from config; 'float32' (or empty) means none"""
+    kind = (kind or "float32").lower()
+    if kind == "float32":
+        return None
+    if kind == "float16":
+        return Float16Storage()
+    if kind == "int8":
+        return Int8Storage()
+    if kind == "pq":
+        return PQStorage(**{k: v for k, v in options.items() if k in ("m", "min_rows", "sample", "iters")})
+    raise ValueError(f"Unknown vector storage: {kind}")
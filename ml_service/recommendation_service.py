@@ -1,134 +1,792 @@
+import asyncio
+import base64
+import json
 import psycopg2
-import pickle
+from psycopg2.extras import execute_values
 import numpy as np
-import io
-import binascii
-from fastapi import FastAPI, UploadFile, Form, HTTPException
+from fastapi import FastAPI, UploadFile, Form, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from transformers import CLIPProcessor, CLIPModel
-from PIL import Image
-import torch
-import ast
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
+import os
+import threading
+import time
+
+from ann import make_engine
+from batcher import MicroBatcher
+from category_predictor import DEFAULT_PROMPTS_PATH, CategoryPredictor
+from clip_encoder import CLIP_BACKEND, CLIP_MODEL_NAME, EncoderLoader, ModelNotReady
+from db import db_pool, get_conn
+from embedding_cache import EmbeddingCache
+from embedding_codec import (
+    b64_to_embedding,
+    decode_embedding,
+    decode_legacy,
+    embedding_to_b64,
+    encode_embedding,
+    is_encoded,
+)
+from lexical import lexical_score, normalize_query, tokenize
+from image_preprocess import MAX_IMAGE_BYTES, PREPROCESS_VERSION, ImageTooLarge
+from executors import Overloaded, cpu_executor, db_executor, inference_executor
+from logging_setup import configure_logging, get_log_level, set_log_level
+from metrics import REGISTRY, request_endpoint, stage
+from neighbor_table import NeighborTable
+from pgvector_index import VECTOR_COLUMN, PgVectorIndex, has_vector_column, vector_literal
+from product_metadata import ProductMetadataCache
+from response_cache import ResponseCache
+from quantization import make_storage
+from snapshot import open_snapshot, prune_snapshots, snapshot_lock, write_snapshot
+from vector_index import VectorIndex, normalize
 
 app = FastAPI(title="AI Camera Search API", version="1.0")
 
+log = configure_logging()
+
 # ============================================================
-# 🧩 DATABASE CONNECTION
+# 📈 REQUEST METRICS (scraped at /metrics)
 # ============================================================
-def get_conn():
-    """Connect to Supabase PostgreSQL"""
-    return psycopg2.connect(
-        dbname="postgres",
-        user="postgres",
-        password="gLdv4DObzlTii1RV",
-        host="db.zavcdgxjqbkpsafishmg.supabase.co",
-        port="5432"
-    )
+REQUESTS = REGISTRY.counter("ml_requests_total", "HTTP requests by endpoint and status", ("endpoint", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("ml_request_duration_seconds", "End-to-end handler latency", ("endpoint",))
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Label the request's stage timers and logs with its endpoint, and time it"""
+    endpoint = request.url.path
+    token = request_endpoint.set(endpoint)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route, so scans of unknown paths cannot blow up label cardinality
+        route = request.scope.get("route")
+        label = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=label)
+        REQUESTS.inc(endpoint=label, status=status)
+        request_endpoint.reset(token)
 
 # ============================================================
-# 🧠 LOAD CLIP MODEL (once at startup)
+# 🧠 CLIP MODEL LIFECYCLE
 # ============================================================
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+# CLIP_LOAD_MODE:
+#   "background"  start loading + warmup at startup without blocking it (default)
+#   "eager"       block startup until the model is loaded and warmed up
+#   "lazy"        load on the first request that needs the model
+# Requests that need the model wait up to MODEL_WAIT_TIMEOUT seconds for it,
+# then get 503 + Retry-After. DB-only routes never touch it.
+CLIP_LOAD_MODE = os.getenv("CLIP_LOAD_MODE", "background")
+MODEL_WAIT_TIMEOUT = float(os.getenv("MODEL_WAIT_TIMEOUT", "30"))
+
+clip_loader = EncoderLoader(CLIP_MODEL_NAME, warmup=os.getenv("CLIP_WARMUP", "1") != "0")
+
+def get_clip_encoder():
+    try:
+        return clip_loader.get(timeout=MODEL_WAIT_TIMEOUT)
+    except ModelNotReady as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model not ready: {e}",
+            headers={"Retry-After": str(inference_executor.retry_after)},
+        )
+
+async def read_upload(upload: UploadFile) -> bytes:
+    """Read an uploaded image, refusing anything over MAX_IMAGE_BYTES without buffering the rest"""
+    with stage("upload"):
+        data = await upload.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+    return data
+
+def preprocess_image(image_bytes: bytes):
+    """Decode one uploaded image into CLIP pixel values, shape (1, 3, 224, 224)"""
+    preprocessor = get_clip_encoder().preprocessor
+    try:
+        log.debug("Processing image", extra={"fields": {"bytes": len(image_bytes)}})
+        with stage("decode"):
+            image = preprocessor.open(image_bytes)
+        with stage("preprocess"):
+            pixel_values = np.empty((1, 3, preprocessor.crop_size, preprocessor.crop_size), dtype=np.float32)
+            preprocessor.to_array(image, out=pixel_values[0])
+        return pixel_values
+
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        log.warning(f"Image preprocessing failed: {e}")
+        raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
+
+def encode_pixel_batch(pixel_batches) -> list:
+    """Run the CLIP vision tower once over a list of preprocessed images; returns normalized 512-dim arrays"""
+    return get_clip_encoder().encode_images(pixel_batches)
 
 def get_embedding(image_bytes: bytes) -> np.ndarray:
-    """Extract normalized CLIP image embedding (should be 512-dim)"""
+    """Extract normalized CLIP image embedding (should be 512-dim), unbatched"""
+    pixel_values = preprocess_image(image_bytes)
     try:
-        print(f"[DEBUG] Processing image of size: {len(image_bytes)} bytes")
-        
-        # Open and convert image
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        
-        # Process image
-        inputs = clip_processor(images=image, return_tensors="pt")
-        
-        with torch.no_grad():
-            # Get image features - this should return 512-dim for base-patch32
-            embedding = clip_model.get_image_features(**inputs)
-            
-            # Ensure we have a tensor and get the correct shape
-            if isinstance(embedding, torch.Tensor):
-                print(f"[DEBUG] Raw embedding shape: {embedding.shape}")
-                
-                # If shape is (1, 768), we need to project it down
-                if embedding.shape[-1] == 768:
-                    print("[WARN] Got 768-dim embedding, attempting to fix...")
-                    # Try to get the pooler output instead
-                    vision_outputs = clip_model.vision_model(**inputs)
-                    embedding = vision_outputs.pooler_output
-                    print(f"[DEBUG] After pooling: {embedding.shape}")
-            else:
-                print(f"[DEBUG] Unexpected type: {type(embedding)}")
-                # Try to extract from BaseModelOutput
-                if hasattr(embedding, 'pooler_output'):
-                    embedding = embedding.pooler_output
-                elif hasattr(embedding, 'last_hidden_state'):
-                    embedding = embedding.last_hidden_state[:, 0, :]
-        
-        # Normalize
-        embedding = embedding / embedding.norm(p=2, dim=-1, keepdim=True)
-        
-        # Convert to numpy
-        result = embedding.squeeze().cpu().numpy()
-        print(f"[DEBUG] Final embedding shape: {result.shape}, norm: {np.linalg.norm(result):.4f}")
-        
-        # Verify dimension
-        if result.shape[0] != 512:
-            print(f"[WARN] Expected 512-dim embedding, got {result.shape[0]}-dim")
-            
-        return result
-        
+        return encode_pixel_batch([pixel_values])[0]
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error in get_embedding: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"Embedding failed: {e}")
         raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
 
-def embedding_to_hex(embedding: np.ndarray) -> str:
-    """Convert numpy embedding to hex string for transmission"""
-    return binascii.hexlify(pickle.dumps(embedding)).decode('ascii')
-
-def hex_to_embedding(hex_string: str) -> np.ndarray:
-    """Convert hex string back to numpy embedding"""
-    return pickle.loads(binascii.unhexlify(hex_string))
+# Concurrent requests share one vision-tower call of up to EMBED_MAX_BATCH images,
+# waiting at most EMBED_MAX_WAIT_MS for the batch to fill
+image_batcher = MicroBatcher(
+    encode_pixel_batch,
+    max_batch=int(os.getenv("EMBED_MAX_BATCH", "16")),
+    max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "10")),
+    name="clip-image-batcher",
+    executor=inference_executor.executor,
+    max_queue=inference_executor.max_pending,
+)
+
+# Identical image bytes (re-uploads, client retries, popular camera searches) skip
+# the encoder. EMBED_CACHE_SIZE bounds the in-memory LRU (0 disables it);
+# EMBED_CACHE_DIR adds an on-disk tier that survives restarts.
+embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("EMBED_CACHE_SIZE", "10000")),
+    disk_dir=os.getenv("EMBED_CACHE_DIR") or None,
+    namespace=f"{CLIP_MODEL_NAME}|{CLIP_BACKEND}|preprocess-v{PREPROCESS_VERSION}",
+)
+
+async def embed_image(image_bytes: bytes) -> np.ndarray:
+    """Batched, cached equivalent of get_embedding for request handlers (all work off the event loop)"""
+    # Hashing a multi-MB upload and the disk tier are both blocking
+    with stage("embedding_cache"):
+        cache_key, cached = await cpu_executor.run(embedding_cache.lookup, image_bytes)
+    if cached is not None:
+        return cached
+
+    pixel_values = await cpu_executor.run(preprocess_image, image_bytes)
+    try:
+        with stage("encode"):
+            embedding = await image_batcher.submit(pixel_values)
+    except asyncio.QueueFull:
+        raise Overloaded("inference", inference_executor.retry_after)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception(f"Embedding failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
+    return await cpu_executor.run(embedding_cache.put, cache_key, embedding)
+
+# Free-text queries repeat heavily ("red dress", "iphone case"), so their CLIP
+# text embeddings are cached in memory (TEXT_EMBED_CACHE_SIZE, 0 disables),
+# keyed by the normalized query. TEXT_QUERY_TEMPLATE wraps the query in CLIP's
+# caption style, which matches image embeddings better than bare keywords.
+TEXT_QUERY_TEMPLATE = os.getenv("TEXT_QUERY_TEMPLATE", "a photo of {}")
+
+text_embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("TEXT_EMBED_CACHE_SIZE", "5000")),
+    namespace=f"{CLIP_MODEL_NAME}|{CLIP_BACKEND}|text|{TEXT_QUERY_TEMPLATE}",
+)
+
+async def embed_text(query: str) -> np.ndarray:
+    """Cached normalized CLIP text embedding of a search query"""
+    normalized = normalize_query(query)
+    cache_key = text_embedding_cache.key(normalized.encode("utf-8"))
+    cached = text_embedding_cache.get(cache_key)  # memory tier only: no I/O on the loop
+    if cached is not None:
+        return cached
+    with stage("text_encode"):
+        embeddings = await inference_executor.run(get_text_embeddings, [TEXT_QUERY_TEMPLATE.format(normalized)])
+    return text_embedding_cache.put(cache_key, embeddings[0])
 
 def convert_embedding(embedding_data):
-    """Convert embedding from any format to numpy array"""
+    """Convert a stored embedding to a float32 numpy array"""
     if embedding_data is None:
         return None
-        
+
     try:
-        # Case 1: Already a list
-        if isinstance(embedding_data, list):
-            return np.array(embedding_data, dtype=np.float32)
-        
-        # Case 2: String representation of list
-        elif isinstance(embedding_data, str):
-            # Remove brackets and split by commas
-            cleaned = embedding_data.strip('[]')
-            values = [float(x.strip()) for x in cleaned.split(',') if x.strip()]
-            return np.array(values, dtype=np.float32)
-        
-        # Case 3: Bytes (pickle)
-        elif isinstance(embedding_data, bytes):
-            return pickle.loads(embedding_data)
-        
-        # Case 4: PostgreSQL vector type or other
+        # Canonical format: zero-copy view over the bytea payload
+        if is_encoded(embedding_data):
+            return decode_embedding(embedding_data)
+
+        # Rows not yet rewritten by migrate_embeddings.py
+        return decode_legacy(embedding_data)
+
+    except Exception as e:
+        log.warning(f"Cannot convert stored embedding: {e}")
+        return None
+
+# Whether product_embeddings.embedding has been migrated to bytea, and whether the
+# pgvector column exists and must be written too (checked at startup)
+embedding_column_binary = False
+embedding_vector_column = False
+
+def detect_embedding_column():
+    global embedding_column_binary, embedding_vector_column
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'product_embeddings' AND column_name = 'embedding'
+            """)
+            row = cursor.fetchone()
+            embedding_vector_column = has_vector_column(cursor)
+    embedding_column_binary = bool(row) and row[0] == "bytea"
+    if not embedding_column_binary:
+        log.warning("product_embeddings.embedding is not bytea yet; run migrate_embeddings.py")
+
+def embedding_db_value(embedding):
+    """Value to store in product_embeddings.embedding for the current column type"""
+    if embedding_column_binary:
+        return psycopg2.Binary(encode_embedding(embedding))
+    return np.asarray(embedding, dtype=np.float32).tolist()
+
+def embedding_upsert_sql(values: str) -> str:
+    """INSERT ... ON CONFLICT for product_embeddings rows (also fills embedding_vec once it exists)"""
+    vector_column = f", {VECTOR_COLUMN}" if embedding_vector_column else ""
+    vector_update = f"{VECTOR_COLUMN} = EXCLUDED.{VECTOR_COLUMN},\n                " if embedding_vector_column else ""
+    return f"""
+        INSERT INTO product_embeddings (product_id, name, category, embedding{vector_column}, created_at, updated_at)
+        VALUES {values}
+        ON CONFLICT (product_id) DO UPDATE
+        SET name = EXCLUDED.name,
+            category = EXCLUDED.category,
+            embedding = EXCLUDED.embedding,
+            {vector_update}updated_at = EXCLUDED.updated_at
+    """
+
+def embedding_row(product_id, name, category, embedding, created_at, updated_at):
+    """Parameters matching embedding_upsert_sql's column list"""
+    if embedding_vector_column:
+        return (product_id, name, category, embedding_db_value(embedding), vector_literal(embedding), created_at, updated_at)
+    return (product_id, name, category, embedding_db_value(embedding), created_at, updated_at)
+
+def get_text_embeddings(texts) -> np.ndarray:
+    """Normalized CLIP text embeddings for a batch of strings, one forward pass"""
+    return get_clip_encoder().encode_texts(texts)
+
+# Category prompts live in category_prompts.json (override with CATEGORY_PROMPTS_PATH)
+category_predictor = CategoryPredictor(
+    get_text_embeddings,
+    prompts_path=os.getenv("CATEGORY_PROMPTS_PATH", DEFAULT_PROMPTS_PATH),
+)
+
+# ============================================================
+# 🗂️ IN-MEMORY PRODUCT INDEX (shared by all search endpoints)
+# ============================================================
+# ANN_BACKEND: "exact" (brute force), "ivf" (IVF-flat) or "hnsw" (needs hnswlib)
+ANN_BACKEND = os.getenv("ANN_BACKEND", "exact")
+
+# VECTOR_STORAGE: "float32" (scan the matrix itself), "float16", "int8" or "pq".
+# A compressed copy is scanned instead of the matrix and the best
+# top_k * VECTOR_RERANK_FACTOR rows are rescored in float32; combined with the
+# mapped snapshot this keeps only the compressed copy in each worker's memory;
+# without SNAPSHOT_DIR the copy comes on top of the float32 matrix.
+# PQ trains once VECTOR_PQ_MIN_ROWS products are indexed (index maintenance).
+# Measured tradeoffs: python -m benchmarks.quantization_recall
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32")
+
+product_index = VectorIndex(
+    dim=512,
+    engine=make_engine(
+        ANN_BACKEND,
+        nlist=int(os.getenv("ANN_NLIST", "1024")),
+        nprobe=int(os.getenv("ANN_NPROBE", "16")),
+        m=int(os.getenv("ANN_HNSW_M", "16")),
+        ef_construction=int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "200")),
+        ef=int(os.getenv("ANN_HNSW_EF", "64")),
+        min_rows=int(os.getenv("ANN_MIN_ROWS", "10000")),
+    ),
+    storage=make_storage(
+        VECTOR_STORAGE,
+        m=int(os.getenv("VECTOR_PQ_M", "128")),
+        min_rows=int(os.getenv("VECTOR_PQ_MIN_ROWS", "10000")),
+    ),
+    rerank_factor=int(os.getenv("VECTOR_RERANK_FACTOR", "10")),
+)
+
+# Materialized top-K lists for /recommend/ (NEIGHBOR_TABLE_K=0 disables): changed
+# products are recomputed every NEIGHBOR_REFRESH_INTERVAL seconds and the whole
+# table every NEIGHBOR_FULL_REBUILD_INTERVAL seconds
+NEIGHBOR_TABLE_K = int(os.getenv("NEIGHBOR_TABLE_K", "50"))
+NEIGHBOR_REFRESH_INTERVAL = float(os.getenv("NEIGHBOR_REFRESH_INTERVAL", "5"))
+NEIGHBOR_FULL_REBUILD_INTERVAL = float(os.getenv("NEIGHBOR_FULL_REBUILD_INTERVAL", "3600"))
+RECOMMEND_CATEGORY_BOOST = 0.03
+
+# SEARCH_BACKEND: "memory" (the resident index above) or "pgvector" (queries run in
+# Postgres against product_embeddings.embedding_vec; see migrate_pgvector.py).
+# With pgvector nothing is loaded into memory and the neighbour table is off.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "memory")
+PGVECTOR_SUMMARY_INTERVAL = float(os.getenv("PGVECTOR_SUMMARY_INTERVAL", "5"))
+
+if SEARCH_BACKEND == "pgvector":
+    search_index = PgVectorIndex(
+        get_conn,
+        dim=512,
+        ef_search=int(os.getenv("PGVECTOR_EF_SEARCH", "40")),
+        probes=int(os.getenv("PGVECTOR_PROBES", "10")),
+        candidate_factor=int(os.getenv("PGVECTOR_CANDIDATE_FACTOR", "4")),
+        iterative_scan=os.getenv("PGVECTOR_ITERATIVE_SCAN", ""),
+    )
+    # Searches wait on the database, not the CPU
+    search_executor = db_executor
+elif SEARCH_BACKEND == "memory":
+    search_index = product_index
+    search_executor = cpu_executor
+else:
+    raise ValueError(f"Unknown SEARCH_BACKEND {SEARCH_BACKEND!r}; expected 'memory' or 'pgvector'")
+
+neighbor_table = (
+    NeighborTable(product_index, k=NEIGHBOR_TABLE_K, boost=RECOMMEND_CATEGORY_BOOST, max_score=1.0)
+    if NEIGHBOR_TABLE_K > 0 and SEARCH_BACKEND == "memory" else None
+)
+
+# Seconds between delta syncs, and how many syncs between full id reconciliations
+INDEX_SYNC_INTERVAL = float(os.getenv("INDEX_SYNC_INTERVAL", "10"))
+INDEX_RECONCILE_EVERY = int(os.getenv("INDEX_RECONCILE_EVERY", "30"))
+# Seconds between full-load retries when the startup load failed and syncing is off
+INDEX_LOAD_RETRY_INTERVAL = float(os.getenv("INDEX_LOAD_RETRY_INTERVAL", "10"))
+
+# Highest product_embeddings.updated_at already applied to the index
+index_synced_until = None
+
+# Highest products.updated_at whose price/stock is loaded into the index filters
+attributes_synced_until = None
+
+# When this worker last upserted/removed a product itself (/add_product/,
+# /add_products/, /delete_product/), cleared once a delta sync (upserts) or a
+# reconciliation (removals) started after it. Until then the other workers have
+# not seen the change, so the shared response cache tier is skipped.
+local_write_lock = threading.Lock()
+local_upsert_at = None
+local_remove_at = None
+
+def note_local_write(removal=False):
+    global local_upsert_at, local_remove_at
+    with local_write_lock:
+        if removal:
+            local_remove_at = time.monotonic()
         else:
-            # Try to convert to string and parse
-            str_data = str(embedding_data)
-            if '[' in str_data and ']' in str_data:
-                return convert_embedding(str_data)
+            local_upsert_at = time.monotonic()
+
+def clear_local_writes(started, upserts=True, removals=True):
+    """Forget local writes that a sync/reconciliation started at `started` has caught up with"""
+    global local_upsert_at, local_remove_at
+    with local_write_lock:
+        if upserts and local_upsert_at is not None and local_upsert_at <= started:
+            local_upsert_at = None
+        if removals and local_remove_at is not None and local_remove_at <= started:
+            local_remove_at = None
+
+# Memory-mapped snapshot shared by every worker on the host (see snapshot.py);
+# SNAPSHOT_DIR="" disables it and each worker loads its own copy from Postgres.
+# One worker republishes at most every SNAPSHOT_INTERVAL seconds; the others
+# swap the new file in on their next maintenance cycle.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots"))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "600"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+SNAPSHOT_HEADROOM = float(os.getenv("SNAPSHOT_HEADROOM", "0.1"))
+
+# Version of the snapshot this worker is serving (None when loaded from Postgres)
+snapshot_version = None
+
+def load_product_index():
+    """Load every stored embedding into the resident index (one table scan at startup)"""
+    global index_synced_until
+
+    started = time.monotonic()
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT product_id, name, category, embedding, updated_at
+                FROM product_embeddings
+                WHERE embedding IS NOT NULL
+            """)
+            rows = cursor.fetchall()
+
+    loaded, skipped = product_index.load(
+        (pid, name, category, convert_embedding(emb_data))
+        for pid, name, category, emb_data, _ in rows
+    )
+    index_synced_until = max((row[4] for row in rows if row[4] is not None), default=None)
+    clear_local_writes(started)
+    log.info(f"✅ Product index loaded: {loaded} products ({skipped} skipped)")
+
+def sync_product_index():
+    """Apply rows written since the last sync (including writes made outside this service)"""
+    global index_synced_until
+
+    started = time.monotonic()
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            if index_synced_until is None:
+                cursor.execute("""
+                    SELECT product_id, name, category, embedding, updated_at
+                    FROM product_embeddings
+                    ORDER BY updated_at
+                """)
             else:
-                print(f"⚠️ Unknown embedding format: {type(embedding_data)}")
-                return None
-                
+                # >= so rows sharing the last timestamp are never missed; re-applying is idempotent
+                cursor.execute("""
+                    SELECT product_id, name, category, embedding, updated_at
+                    FROM product_embeddings
+                    WHERE updated_at >= %s
+                    ORDER BY updated_at
+                """, (index_synced_until,))
+            rows = cursor.fetchall()
+
+    for pid, name, category, emb_data, updated_at in rows:
+        product_index.upsert(pid, name, category, convert_embedding(emb_data))
+        if updated_at is not None and (index_synced_until is None or updated_at > index_synced_until):
+            index_synced_until = updated_at
+    clear_local_writes(started, removals=False)
+    return len(rows)
+
+def reconcile_product_index():
+    """Tombstone indexed products whose rows were deleted outside this service"""
+    started = time.monotonic()
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT product_id FROM product_embeddings WHERE embedding IS NOT NULL")
+            stored_ids = {str(r[0]) for r in cursor.fetchall()}
+
+    removed = 0
+    for pid in product_index.product_ids() - stored_ids:
+        removed += product_index.remove(pid)
+    clear_local_writes(started, upserts=False)
+    return removed
+
+def sync_product_attributes():
+    """Load price/stock filter attributes changed since the last sync (everything on the first call)"""
+    global attributes_synced_until
+
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            if attributes_synced_until is None:
+                cursor.execute("""
+                    SELECT product_id::text, product_price, product_quantity, updated_at
+                    FROM products
+                """)
+            else:
+                cursor.execute("""
+                    SELECT product_id::text, product_price, product_quantity, updated_at
+                    FROM products
+                    WHERE updated_at >= %s
+                """, (attributes_synced_until,))
+            rows = cursor.fetchall()
+
+    product_index.set_attributes(
+        (pid, float(price) if price is not None else None, quantity)
+        for pid, price, quantity, _ in rows
+    )
+    if attributes_synced_until is not None:
+        # Changed rows also carry the price/stock shown in results
+        product_metadata.invalidate(row[0] for row in rows)
+    latest = max((row[3] for row in rows if row[3] is not None), default=None)
+    if latest is not None and (attributes_synced_until is None or latest > attributes_synced_until):
+        attributes_synced_until = latest
+    return len(rows)
+
+def publish_snapshot():
+    """Write the current index as a new snapshot (caller holds snapshot_lock)"""
+    started = time.perf_counter()
+    ids, names, categories, matrix = product_index.export()
+    version = write_snapshot(
+        SNAPSHOT_DIR, ids, names, categories, matrix,
+        synced_until=index_synced_until, headroom=SNAPSHOT_HEADROOM,
+    )
+    pruned = prune_snapshots(SNAPSHOT_DIR, keep=SNAPSHOT_KEEP)
+    log.info(f"💾 Snapshot v{version} written: {len(ids)} products in {time.perf_counter() - started:.1f}s ({pruned} pruned)")
+    return version
+
+def install_snapshot(snap):
+    """Serve a mapped snapshot, then catch up on rows written since it was taken.
+
+    The ANN engine and compressed codes carry over when the snapshot holds
+    the same rows in the same order (see VectorIndex._install), so swapping
+    in an unchanged catalog does not retrain anything.
+    """
+    global index_synced_until, snapshot_version
+
+    product_index.load_matrix(snap.ids[:snap.rows], snap.names[:snap.rows], snap.categories[:snap.rows], snap.matrix)
+    index_synced_until = snap.synced_until
+    snapshot_version = snap.version
+    synced = sync_product_index()
+    removed = reconcile_product_index()
+    log.info(f"✅ Product index mapped from snapshot v{snap.version}: {snap.rows} products "
+             f"(+{synced} synced, -{removed} removed)")
+
+def load_product_index_shared():
+    """Startup load: map the host's snapshot, building it from Postgres if no worker has yet"""
+    # Blocking: workers booting together wait for the first one to publish
+    with snapshot_lock(SNAPSHOT_DIR):
+        snap = open_snapshot(SNAPSHOT_DIR, product_index.dim)
+        if snap is None:
+            load_product_index()
+            publish_snapshot()
+            snap = open_snapshot(SNAPSHOT_DIR, product_index.dim)
+    if snap is not None:
+        install_snapshot(snap)
+
+def refresh_snapshot():
+    """Swap in a snapshot another worker published, or publish one if ours is due"""
+    snap = open_snapshot(SNAPSHOT_DIR, product_index.dim)
+    if snap is not None and snap.version != snapshot_version:
+        install_snapshot(snap)
+        return
+    if snap is not None and snap.age < SNAPSHOT_INTERVAL:
+        return
+
+    with snapshot_lock(SNAPSHOT_DIR, blocking=False) as acquired:
+        if not acquired:
+            return
+        latest = open_snapshot(SNAPSHOT_DIR, product_index.dim)
+        if latest is not None and latest.version != (snap.version if snap else None):
+            # Someone else published while we were checking; take theirs next cycle
+            return
+        publish_snapshot()
+        snap = open_snapshot(SNAPSHOT_DIR, product_index.dim)
+    if snap is not None:
+        install_snapshot(snap)
+
+def build_vector_storage():
+    started = time.perf_counter()
+    ready = product_index.build_storage()
+    log.info(f"{VECTOR_STORAGE} vector storage built in {time.perf_counter() - started:.1f}s (serving: {ready})")
+
+def rebuild_ann_engine():
+    started = time.perf_counter()
+    ready = product_index.rebuild_engine()
+    log.info(f"{ANN_BACKEND} engine rebuilt in {time.perf_counter() - started:.1f}s (serving: {ready})")
+
+def initial_index_load():
+    """Full load, through the host's shared snapshot when SNAPSHOT_DIR is set"""
+    detect_embedding_column()
+    if SNAPSHOT_DIR:
+        load_product_index_shared()
+    else:
+        load_product_index()
+
+def index_maintenance_loop():
+    """Background delta sync, deletion reconciliation, compaction and snapshot refresh.
+
+    Until a full load has succeeded (e.g. the database was down at startup)
+    each cycle retries it instead, so /readyz turns ready once it does.
+    With INDEX_SYNC_INTERVAL=0 the loop stops after that load.
+    """
+    cycle = 0
+    snapshot_checked = time.monotonic()
+    while True:
+        time.sleep(INDEX_SYNC_INTERVAL if INDEX_SYNC_INTERVAL > 0 else INDEX_LOAD_RETRY_INTERVAL)
+        if product_index.loaded_at is None:
+            try:
+                initial_index_load()
+            except Exception as e:
+                log.warning(f"Product index load retry failed: {e}")
+            continue
+        if INDEX_SYNC_INTERVAL <= 0:
+            return
+        cycle += 1
+        try:
+            synced = sync_product_index()
+            sync_product_attributes()
+            removed = reconcile_product_index() if cycle % INDEX_RECONCILE_EVERY == 0 else 0
+            if synced or removed:
+                log.info(f"Index sync: {synced} upserted, {removed} removed, {len(product_index)} indexed")
+            if product_index.needs_compaction():
+                reclaimed = product_index.compact()
+                log.info(f"Index compaction reclaimed {reclaimed} rows")
+            if SNAPSHOT_DIR and time.monotonic() - snapshot_checked >= min(SNAPSHOT_INTERVAL, 60):
+                snapshot_checked = time.monotonic()
+                refresh_snapshot()
+            if product_index.needs_engine_rebuild():
+                rebuild_ann_engine()
+            if product_index.needs_storage_build():
+                build_vector_storage()
+        except Exception as e:
+            log.warning(f"Index maintenance failed: {e}")
+
+def neighbor_table_loop():
+    """Build the neighbour table, then keep it current incrementally"""
+    while True:
+        try:
+            if (neighbor_table.last_full_build is not None
+                    and time.time() - neighbor_table.last_full_build >= NEIGHBOR_FULL_REBUILD_INTERVAL):
+                neighbor_table.mark_changed(None)
+            started = time.perf_counter()
+            recomputed = neighbor_table.refresh()
+            if recomputed:
+                log.info(f"Neighbour table: {recomputed} lists recomputed in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            log.warning(f"Neighbour table refresh failed: {e}")
+        time.sleep(NEIGHBOR_REFRESH_INTERVAL)
+
+# Display metadata for search winners: PRODUCT_METADATA_CACHE_SIZE products kept
+# for PRODUCT_METADATA_TTL seconds (0 disables), invalidated by the attribute sync
+product_metadata = ProductMetadataCache(
+    max_entries=int(os.getenv("PRODUCT_METADATA_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("PRODUCT_METADATA_TTL", "300")),
+)
+
+def pgvector_summary_loop():
+    """Keep the pgvector backend's row count, categories and version current"""
+    while True:
+        time.sleep(PGVECTOR_SUMMARY_INTERVAL)
+        try:
+            search_index.check()
+        except Exception as e:
+            log.warning(f"pgvector summary refresh failed: {e}")
+
+def fetch_product_details(product_ids):
+    """Price, stock, primary image and store name for the top-k winners (cache, then one query)"""
+    if not product_ids:
+        return {}
+
+    details, missing = product_metadata.get_many([str(pid) for pid in product_ids])
+    if not missing:
+        return details
+
+    with stage("db_fetch"), get_conn() as conn:
+        with conn.cursor() as cursor:
+            # One row per product: the primary image is the first one uploaded
+            cursor.execute("""
+                SELECT p.product_id::text, p.product_price, p.product_quantity,
+                       img.image_path, s.store_name
+                FROM products p
+                LEFT JOIN (
+                    SELECT DISTINCT ON (product_id) product_id, image_path
+                    FROM product_images
+                    WHERE product_id::text = ANY(%s)
+                    ORDER BY product_id, id
+                ) img ON img.product_id = p.product_id
+                LEFT JOIN sellers s ON p.seller_id = s.seller_id
+                WHERE p.product_id::text = ANY(%s)
+            """, (missing, missing))
+            rows = cursor.fetchall()
+
+    fetched = {
+        pid: {
+            "price": float(price) if price else 0.0,
+            "quantity": quantity or 0,
+            "image_path": image_path,
+            "store_name": store_name,
+        }
+        for pid, price, quantity, image_path, store_name in rows
+    }
+    product_metadata.put_many(fetched)
+    details.update(fetched)
+    return details
+
+# Prompt-file or category changes are re-encoded by the category-prototypes
+# thread only, never on the request path: camera searches keep predicting with
+# the previous prototypes and just wake the thread (prototypes_stale). It also
+# rechecks every CATEGORY_PROTOTYPE_INTERVAL seconds.
+CATEGORY_PROTOTYPE_INTERVAL = float(os.getenv("CATEGORY_PROTOTYPE_INTERVAL", "60"))
+
+def build_category_prototypes():
+    """Encode category prompts once the model is up (readiness waits for this too)"""
+    try:
+        clip_loader.get()
+        category_predictor.refresh(search_index.categories())
     except Exception as e:
-        print(f"❌ Error converting embedding: {e}")
-        return None
+        log.warning(f"Category prototypes not built: {e}")
+    finally:
+        prototypes_built.set()
+
+def category_prototype_loop():
+    """Initial build (unless done at startup), then rebuild whenever categories or prompts change"""
+    if CLIP_LOAD_MODE == "background":
+        build_category_prototypes()
+    while True:
+        prototypes_stale.wait(CATEGORY_PROTOTYPE_INTERVAL)
+        prototypes_stale.clear()
+        if not clip_loader.ready:
+            # Lazy mode: the first request that needs the model starts loading it
+            continue
+        try:
+            categories = search_index.categories()
+            if category_predictor.needs_refresh(categories):
+                category_predictor.refresh(categories)
+        except Exception as e:
+            log.warning(f"Category prototype refresh failed: {e}")
+
+prototypes_built = threading.Event()
+prototypes_stale = threading.Event()
+
+@app.on_event("startup")
+def startup_load_index():
+    # Model loading overlaps the index load instead of blocking module import
+    if CLIP_LOAD_MODE == "eager":
+        clip_loader.get()
+    elif CLIP_LOAD_MODE == "background":
+        clip_loader.start()
+
+    if SEARCH_BACKEND == "pgvector":
+        try:
+            detect_embedding_column()
+            search_index.check()
+            log.info(f"✅ pgvector backend: {len(search_index)} products searchable in Postgres")
+        except Exception as e:
+            log.error(f"❌ pgvector backend unavailable: {e}")
+        threading.Thread(target=pgvector_summary_loop, name="pgvector-summary", daemon=True).start()
+    else:
+        try:
+            initial_index_load()
+        except Exception as e:
+            log.error(f"❌ Failed to load product index (retried by index maintenance): {e}")
+
+        try:
+            loaded = sync_product_attributes()
+            log.info(f"✅ Filter attributes loaded for {loaded} products")
+        except Exception as e:
+            log.warning(f"Price/stock filters unavailable until the next sync: {e}")
+
+    if CLIP_LOAD_MODE == "eager":
+        build_category_prototypes()
+    elif CLIP_LOAD_MODE == "lazy":
+        # Built by the thread below once the first request has loaded the model
+        prototypes_built.set()
+    threading.Thread(target=category_prototype_loop, name="category-prototypes", daemon=True).start()
+
+    if SEARCH_BACKEND != "memory":
+        return
+    if neighbor_table is not None:
+        threading.Thread(target=neighbor_table_loop, name="neighbor-table", daemon=True).start()
+    if INDEX_SYNC_INTERVAL > 0 or product_index.loaded_at is None:
+        threading.Thread(target=index_maintenance_loop, name="index-maintenance", daemon=True).start()
+    if product_index.needs_engine_rebuild():
+        # Exact search serves queries until the ANN engine has been trained
+        threading.Thread(target=rebuild_ann_engine, name="ann-build", daemon=True).start()
+    if VECTOR_STORAGE != "float32" and not SNAPSHOT_DIR:
+        log.warning(f"VECTOR_STORAGE={VECTOR_STORAGE} without SNAPSHOT_DIR: the compressed copy adds to "
+                    "each worker's resident float32 matrix instead of replacing it in memory")
+
+# ============================================================
+# 🩺 LIVENESS / READINESS
+# ============================================================
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving HTTP"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: model warmed up (unless CLIP_LOAD_MODE=lazy) and product index loaded"""
+    model_ready = clip_loader.ready or CLIP_LOAD_MODE == "lazy"
+    index_ready = search_index.loaded_at is not None
+    ready = model_ready and index_ready and prototypes_built.is_set()
+    body = {
+        "status": "ready" if ready else "starting",
+        "model": clip_loader.status(),
+        "index": {
+            "backend": SEARCH_BACKEND,
+            "loaded": index_ready,
+            "products": len(search_index),
+            "snapshot_version": snapshot_version,
+        },
+        "category_prototypes": prototypes_built.is_set(),
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
 
 # ============================================================
 # ✅ TEST ROUTE
@@ -142,80 +800,79 @@ async def root():
 # ============================================================
 @app.post("/get_embedding/")
 async def get_image_embedding(image: UploadFile):
-    """Convert image to embedding hex string for Laravel"""
+    """Convert image to a base64 float32 embedding (canonical format) for Laravel"""
     try:
-        image_bytes = await image.read()
-        embedding = get_embedding(image_bytes)
-        embedding_hex = embedding_to_hex(embedding)
+        image_bytes = await read_upload(image)
+        embedding = await embed_image(image_bytes)
         
         return {
-            "embedding_hex": embedding_hex,
+            "embedding_b64": embedding_to_b64(embedding),
             "embedding_shape": embedding.shape,
             "message": "Embedding generated successfully"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 # ============================================================
 # 🟢 ADD PRODUCT EMBEDDING
 # ============================================================
+def store_product_embedding(product_id, name, category_name, embedding_list, created_at, updated_at):
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            row = embedding_row(product_id, name, category_name, embedding_list, created_at, updated_at)
+            cursor.execute(embedding_upsert_sql("(" + ", ".join(["%s"] * len(row)) + ")"), row)
+
 @app.post("/add_product/")
 async def add_product(
     product_id: str = Form(...),
     name: str = Form(...),
     category: str = Form(...),
     image: UploadFile = None,
-    embedding_vector: str = Form(None)
+    embedding_vector: str = Form(None),
+    embedding_b64: str = Form(None)
 ):
     embedding_list = None
     
     # Option 1: image embedding
     if image:
-        image_bytes = await image.read()
-        embedding = get_embedding(image_bytes)
+        image_bytes = await read_upload(image)
+        embedding = await embed_image(image_bytes)
         embedding_list = embedding.tolist()
-        print(f"✅ Generated embedding from image - shape: {embedding.shape}")
+        log.debug(f"Generated embedding from image - shape: {embedding.shape}")
 
-    # Option 2: pre-computed vector
-    elif embedding_vector:
+    # Option 2: pre-computed vector (base64 canonical bytes, or legacy '[...]' / comma text)
+    elif embedding_b64 or embedding_vector:
         try:
-            if embedding_vector.startswith('[') and embedding_vector.endswith(']'):
-                embedding_list = ast.literal_eval(embedding_vector)
+            if embedding_b64:
+                embedding_array = b64_to_embedding(embedding_b64)
             else:
-                embedding_list = [float(x.strip()) for x in embedding_vector.split(',')]
-            
-            embedding_array = np.array(embedding_list, dtype=np.float32)
+                embedding_array = decode_legacy(embedding_vector)
+            embedding_list = embedding_array.tolist()
             norm = np.linalg.norm(embedding_array)
 
             if norm > 0:
                 embedding_array = embedding_array / norm
                 embedding_list = embedding_array.tolist()
 
-            print(f"✅ Using pre-computed vector - length: {len(embedding_list)}")
+            log.debug(f"Using pre-computed vector - length: {len(embedding_list)}")
 
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid embedding vector format: {str(e)}")
 
     # Option 3: category-based embedding
     else:
-        print("⚠️ No image/vector, generating category-based embedding")
+        log.debug("No image/vector, generating category-based embedding")
         try:
-            text_inputs = clip_processor(
-                text=[category.lower().strip()], 
-                return_tensors="pt", 
-                padding=True, 
-                truncation=True
-            )
-            with torch.no_grad():
-                text_features = clip_model.get_text_features(**text_inputs)
-                text_features = text_features / text_features.norm(p=2, dim=-1, keepdim=True)
-
-            embedding = text_features.squeeze().cpu().numpy()
+            embedding = (await inference_executor.run(get_text_embeddings, [category.lower().strip()]))[0]
             embedding_list = embedding.tolist()
-            print(f"✅ Generated category-based embedding - shape: {embedding.shape}")
+            log.debug(f"Generated category-based embedding - shape: {embedding.shape}")
 
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"❌ Failed to generate category embedding: {e}")
+            log.warning(f"Failed to generate category embedding: {e}")
             embedding_list = [0.0] * 512
 
     category_name = category.lower().strip()
@@ -223,39 +880,318 @@ async def add_product(
     updated_at = datetime.utcnow()
 
     try:
-        with get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO product_embeddings (product_id, name, category, embedding, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (product_id) DO UPDATE
-                    SET name = EXCLUDED.name,
-                        category = EXCLUDED.category,
-                        embedding = EXCLUDED.embedding,
-                        updated_at = EXCLUDED.updated_at
-                """, (
-                    product_id,
-                    name,
-                    category_name,
-                    embedding_list,
-                    created_at,
-                    updated_at
-                ))
+        await db_executor.run(
+            store_product_embedding, product_id, name, category_name, embedding_list, created_at, updated_at
+        )
+
+        # Make the product searchable immediately, without waiting for the delta sync
+        await cpu_executor.run(search_index.upsert, product_id, name, category_name, embedding_list)
+        note_local_write()
 
         return {
             "message": "✅ Product added/updated successfully",
             "product_id": product_id,
-            "embedding_source": "image" if image else "pre_computed_vector" if embedding_vector else "category_based",
+            "embedding_source": "image" if image else "pre_computed_vector" if embedding_b64 or embedding_vector else "category_based",
             "created_at": created_at.isoformat(),
             "updated_at": updated_at.isoformat(),
             "embedding_length": len(embedding_list),
             "embedding_norm": round(np.linalg.norm(np.array(embedding_list)), 4)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
+# ============================================================
+# 📥 BULK ADD PRODUCTS (streaming)
+# ============================================================
+# Input, either:
+#   application/x-ndjson  one JSON object per line:
+#       {"product_id", "name", "category", "image_b64"?, "embedding_b64"?, "embedding_vector"?}
+#   multipart/form-data   "products": JSON array of the same objects, with images
+#       as file parts named by each item's "image_field" (default "image_<product_id>")
+# Output: NDJSON, one {"product_id", "status", ...} line per item as soon as its
+# chunk is committed, then a final {"summary": {...}} line.
+#
+# Only NDJSON is read incrementally, so its memory is bounded by the chunk size.
+# A multipart body is parsed whole before the first chunk is processed (file
+# parts spool to disk), and is capped at BULK_MAX_ITEMS images and a
+# BULK_MAX_PRODUCTS_BYTES "products" part; use NDJSON for large catalogs.
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "32"))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(16 * 1024 * 1024)))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+BULK_MAX_PRODUCTS_BYTES = int(os.getenv("BULK_MAX_PRODUCTS_BYTES", str(64 * 1024 * 1024)))
+
+async def iter_ndjson(request: Request):
+    """Yield parsed NDJSON objects from the request body without buffering it whole"""
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer.extend(chunk)
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = bytes(buffer[:newline])
+            del buffer[:newline + 1]
+            if line.strip():
+                yield json.loads(line)
+        if len(buffer) > BULK_MAX_LINE_BYTES:
+            raise ValueError(f"NDJSON line longer than {BULK_MAX_LINE_BYTES} bytes")
+    if bytes(buffer).strip():
+        yield json.loads(bytes(buffer))
+
+async def iter_multipart(request: Request):
+    """Yield product objects from a multipart upload, attaching each item's image bytes"""
+    # Parsed whole up front; Starlette spools file parts to disk. Its defaults
+    # (1000 files/fields, 1 MB non-file parts) are replaced by the bulk limits.
+    form = await request.form(
+        max_files=BULK_MAX_ITEMS,
+        max_fields=BULK_MAX_ITEMS + 16,
+        max_part_size=BULK_MAX_PRODUCTS_BYTES,
+    )
+    try:
+        products = json.loads(form.get("products") or "[]")
+        if len(products) > BULK_MAX_ITEMS:
+            raise ValueError(f"{len(products)} products exceed BULK_MAX_ITEMS={BULK_MAX_ITEMS}; use NDJSON")
+        for item in products:
+            upload = form.get(item.get("image_field") or f"image_{item.get('product_id')}")
+            if upload is not None and hasattr(upload, "read"):
+                item["image_bytes"] = await upload.read()
+            yield item
+    finally:
+        await form.close()
+
+def preprocess_images_safe(images):
+    """Decode a chunk into one (B, 3, 224, 224) batch; returns (pixel_values, {position: error})"""
+    return get_clip_encoder().preprocess_batch(images)
+
+def store_product_embeddings_bulk(rows):
+    """Upsert many (product_id, name, category, embedding_list, created_at, updated_at) rows in one statement"""
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            execute_values(cursor, embedding_upsert_sql("%s"), [embedding_row(*row) for row in rows], page_size=len(rows))
+
+async def ingest_chunk(items):
+    """Embed and store one chunk; returns one result dict per item"""
+    results = [{"product_id": item.get("product_id"), "status": "ok"} for item in items]
+    vectors = [None] * len(items)
+
+    # Resolve each item's source: image, pre-computed vector, or category text
+    image_slots, text_slots = [], []
+    for i, item in enumerate(items):
+        try:
+            if not item.get("product_id") or not item.get("name") or not item.get("category"):
+                raise ValueError("product_id, name and category are required")
+            if item.get("image_bytes") is None and item.get("image_b64"):
+                item["image_bytes"] = base64.b64decode(item["image_b64"], validate=True)
+
+            if item.get("image_bytes") is not None:
+                image_slots.append(i)
+                results[i]["embedding_source"] = "image"
+            elif item.get("embedding_b64"):
+                vectors[i] = b64_to_embedding(item["embedding_b64"])
+                results[i]["embedding_source"] = "pre_computed_vector"
+            elif item.get("embedding_vector"):
+                vectors[i] = decode_legacy(item["embedding_vector"])
+                results[i]["embedding_source"] = "pre_computed_vector"
+            else:
+                text_slots.append(i)
+                results[i]["embedding_source"] = "category_based"
+        except Exception as e:
+            results[i].update(status="error", error=str(e))
+
+    if image_slots:
+        pixels, errors = await cpu_executor.run(preprocess_images_safe, [items[i]["image_bytes"] for i in image_slots])
+        decoded = [i for position, i in enumerate(image_slots) if position not in errors]
+        for position, error in errors.items():
+            results[image_slots[position]].update(status="error", error=f"Image processing failed: {error}")
+        if decoded:
+            # One vision-tower call for the whole chunk
+            embeddings = await inference_executor.run(encode_pixel_batch, pixels)
+            for i, embedding in zip(decoded, embeddings):
+                vectors[i] = embedding
+
+    if text_slots:
+        texts = [items[i]["category"].lower().strip() for i in text_slots]
+        for i, embedding in zip(text_slots, await inference_executor.run(get_text_embeddings, texts)):
+            vectors[i] = embedding
+
+    now = datetime.utcnow()
+    rows = []
+    for i, item in enumerate(items):
+        if results[i]["status"] != "ok":
+            continue
+        vec = normalize(vectors[i])
+        if vec is None:
+            results[i].update(status="error", error="Embedding is empty or zero")
+            continue
+        rows.append((str(item["product_id"]), item["name"], item["category"].lower().strip(), vec.tolist(), now, now))
+
+    if rows:
+        try:
+            await db_executor.run(store_product_embeddings_bulk, rows)
+        except HTTPException:
+            raise
+        except Exception as e:
+            stored = {row[0] for row in rows}
+            for result in results:
+                if str(result["product_id"]) in stored:
+                    result.update(status="error", error=f"Database error: {str(e)}")
+            rows = []
+
+    for pid, name, category, embedding, _, _ in rows:
+        await cpu_executor.run(search_index.upsert, pid, name, category, embedding)
+    if rows:
+        note_local_write()
+    return results
+
+@app.post("/add_products/")
+async def add_products(request: Request):
+    """Bulk add/update product embeddings; streams NDJSON results while ingesting"""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        items = iter_multipart(request)
+    elif "ndjson" in content_type or "jsonlines" in content_type:
+        items = iter_ndjson(request)
+    else:
+        raise HTTPException(status_code=415, detail="Send application/x-ndjson or multipart/form-data")
+
+    async def stream_results():
+        started = time.perf_counter()
+        summary = {"received": 0, "stored": 0, "failed": 0}
+        chunk = []
+
+        async def flush():
+            for result in await ingest_chunk(chunk):
+                summary["stored" if result["status"] == "ok" else "failed"] += 1
+                yield json.dumps(result) + "\n"
+            chunk.clear()
+
+        try:
+            async for item in items:
+                summary["received"] += 1
+                chunk.append(item)
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    async for line in flush():
+                        yield line
+            if chunk:
+                async for line in flush():
+                    yield line
+        except Exception as e:
+            # Headers are already sent; report the failure in-band and stop
+            summary["error"] = str(getattr(e, "detail", e))
+
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        summary["items_per_second"] = round(summary["stored"] / max(summary["seconds"], 1e-9), 2)
+        log.info("✅ Bulk ingest finished", extra={"fields": summary})
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# ============================================================
+# 🗑️ DELETE PRODUCT EMBEDDING
+# ============================================================
+def delete_product_embedding(product_id):
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM product_embeddings WHERE product_id = %s", (product_id,))
+            return cursor.rowcount
+
+@app.post("/delete_product/")
+async def delete_product(product_id: str = Form(...)):
+    """Remove a product's embedding from the database and the search index"""
+    try:
+        deleted = await db_executor.run(delete_product_embedding, product_id)
+        # Takes the index lock and may compact or rebuild; keep it off the event loop
+        removed = await cpu_executor.run(search_index.remove, product_id)
+        note_local_write(removal=True)
+        return {
+            "message": "✅ Product removed" if deleted or removed else "Product not found",
+            "product_id": product_id,
+            "deleted_rows": deleted,
+            "removed_from_index": removed
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# ============================================================
+# 🧾 RESPONSE CACHE (read endpoints)
+# ============================================================
+# RESPONSE_CACHE_SIZE entries for RESPONSE_CACHE_TTL seconds (size 0 and no
+# Redis disables caching); RESPONSE_CACHE_REDIS_URL adds a shared tier
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "60")),
+    redis_url=os.getenv("RESPONSE_CACHE_REDIS_URL") or None,
+)
+
+async def run_cache_op(fn, *args):
+    # Redis lookups block on the network; the memory tier is cheap enough for the loop
+    if response_cache.remote:
+        return await cpu_executor.run(fn, *args)
+    return fn(*args)
+
+def shared_catalog_version(filtered=False):
+    """Catalog version that means the same on every worker of the host, or None.
+
+    search_index.version is a per-process counter (two workers can reach the
+    same number with different catalogs), so the shared Redis tier is keyed on
+    what the catalog was built from instead: the mapped snapshot, the last
+    delta-synced row and the product count. None while this worker has local
+    writes its peers have not synced, which keeps it on its in-process tier.
+    """
+    if SEARCH_BACKEND == "pgvector":
+        # Every worker queries the same database; price/stock are read live
+        return search_index.shared_version
+    with local_write_lock:
+        if local_upsert_at is not None or local_remove_at is not None:
+            return None
+    version = [snapshot_version, str(index_synced_until), len(product_index)]
+    if filtered:
+        version.append(str(attributes_synced_until))
+    return version
+
+async def cached_json_response(http_request: Request, endpoint: str, params: dict, compute,
+                               filtered=False, bypass=False):
+    """Serve `await compute()` through the response cache, answering 304 when the client's ETag still matches.
+
+    `filtered` requests also depend on the price/stock attributes, which are
+    synced separately from the embeddings.
+    """
+    if not response_cache.enabled:
+        return await compute()
+
+    version = [search_index.version]
+    if filtered:
+        version.append(search_index.attributes_version)
+    key = response_cache.make_key(endpoint, params, version)
+    shared_key = None
+    if response_cache.remote:
+        shared = shared_catalog_version(filtered)
+        if shared is not None:
+            shared_key = response_cache.make_key(endpoint, params, ["shared", shared])
+    with stage("response_cache"):
+        cached = None if bypass else await run_cache_op(response_cache.get, key, shared_key)
+    status = "hit"
+    if cached is None:
+        status = "miss"
+        cached = await run_cache_op(response_cache.put, key, jsonable_encoder(await compute()), shared_key)
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Cache": status}
+    if response_cache.etag_matches(http_request.headers.get("if-none-match"), etag):
+        response_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/response_cache_stats/")
+async def get_response_cache_stats():
+    return response_cache.stats()
 
 # ============================================================
 # 🧩 REQUEST BODY (Product Recommendation)
@@ -271,9 +1207,68 @@ class RecommendRequest(BaseModel):
     product_id: str
     top_k: Optional[int] = 5
     similarity_threshold: Optional[float] = 0.70
+    # ANN knobs (ignored by the exact backend)
+    exact: Optional[bool] = False
+    nprobe: Optional[int] = None
+    ef: Optional[int] = None
+    # Recompute this product's materialized list before answering
+    refresh: Optional[bool] = False
+    # Filters, applied inside the search before top-k selection
+    categories: Optional[List[str]] = None
+    exclude_categories: Optional[List[str]] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: Optional[bool] = False
+
+def normalize_categories(categories):
+    """Lowercased, de-duplicated category filter (stored categories are lowercased), or None"""
+    if categories is None:
+        return None
+    if isinstance(categories, str):
+        categories = categories.split(",")
+    normalized = sorted({c.strip().lower() for c in categories if c and c.strip()})
+    return normalized or None
+
+def search_filters(categories=None, exclude_categories=None, min_price=None, max_price=None, in_stock=False):
+    """Keyword arguments for VectorIndex.search filters (empty when nothing is filtered)"""
+    filters = {
+        "include_categories": normalize_categories(categories),
+        "exclude_categories": normalize_categories(exclude_categories),
+        "min_price": min_price,
+        "max_price": max_price,
+        "in_stock": bool(in_stock),
+    }
+    return {key: value for key, value in filters.items() if value not in (None, False)}
 
 @app.post("/recommend/")
-async def recommend_items(request: RecommendRequest = None):
+async def recommend_items(http_request: Request, request: RecommendRequest = None):
+    """Recommend similar products (cached per catalog version, revalidated via ETag)"""
+    if not request:
+        raise HTTPException(status_code=400, detail="JSON payload required")
+
+    filters = search_filters(request.categories, request.exclude_categories,
+                             request.min_price, request.max_price, request.in_stock)
+    params = {
+        "product_id": str(request.product_id),
+        "top_k": request.top_k or 5,
+        "similarity_threshold": request.similarity_threshold or 0.70,
+        "exact": bool(request.exact),
+        "nprobe": request.nprobe,
+        "ef": request.ef,
+        **filters,
+    }
+    # Keyed on the catalog version only: every upsert/removal bumps it, and the
+    # neighbour table recomputing a list (cold compute, refresh=true, background
+    # refresh) does not change which products are indexed, so it must not
+    # invalidate every cached /recommend/ entry
+    return await cached_json_response(
+        http_request, "recommend", params,
+        lambda: compute_recommendations(request),
+        filtered=bool(filters),
+        bypass=bool(request.refresh),
+    )
+
+async def compute_recommendations(request: RecommendRequest):
     """Recommend similar products - accepts both JSON and form-data"""
     try:
         # Handle both JSON and form-data
@@ -286,152 +1281,104 @@ async def recommend_items(request: RecommendRequest = None):
             # This handles form-data if needed, but your Laravel sends JSON
             raise HTTPException(status_code=400, detail="JSON payload required")
         
-        print(f"🔍 Recommendation request for: {product_id}")
-        print(f"📊 Top K: {top_k}, Threshold: {similarity_threshold}")
-
-        with get_conn() as conn:
-            with conn.cursor() as cursor:
-                # Get the source product's embedding and category
-                cursor.execute(
-                    "SELECT embedding, category, name FROM product_embeddings WHERE product_id = %s",
-                    (product_id,)
-                )
-                row = cursor.fetchone()
-
-                if not row:
-                    return {
-                        "error": "Product not found",
-                        "message": f"Product with ID {product_id} not found in database"
-                    }
-
-                embedding_data, source_category, source_product_name = row
-                
-                # Handle embedding data conversion
-                if embedding_data is None:
-                    return {
-                        "error": "No embedding found",
-                        "message": f"Product {source_product_name} has no embedding data"
-                    }
-                
-                # Convert embedding based on type
-                if isinstance(embedding_data, bytes):
-                    target_embedding = pickle.loads(embedding_data)
-                elif isinstance(embedding_data, str):
-                    if embedding_data.startswith('[') and embedding_data.endswith(']'):
-                        embedding_list = ast.literal_eval(embedding_data)
-                        target_embedding = np.array(embedding_list, dtype=np.float32)
-                    else:
-                        embedding_list = [float(x) for x in embedding_data.replace(',', ' ').split()]
-                        target_embedding = np.array(embedding_list, dtype=np.float32)
-                elif isinstance(embedding_data, list):
-                    target_embedding = np.array(embedding_data, dtype=np.float32)
-                else:
-                    return {
-                        "error": "Unknown embedding format",
-                        "message": f"Unsupported embedding format for product {source_product_name}"
-                    }
-
-                print(f"🎯 Source product: {source_product_name}")
-                print(f"📊 Source category: {source_category}")
-                print(f"🔢 Embedding shape: {target_embedding.shape}")
-
-                # Get all products with embeddings
-                cursor.execute("""
-                    SELECT pe.product_id, pe.name, pe.category, pe.embedding,
-                           p.product_price, pi.image_path
-                    FROM product_embeddings pe
-                    LEFT JOIN products p ON pe.product_id = p.product_id::text
-                    LEFT JOIN product_images pi ON p.product_id = pi.product_id
-                    WHERE pe.embedding IS NOT NULL AND pe.product_id != %s
-                """, (product_id,))
-                rows = cursor.fetchall()
-
-        print(f"📊 Total products to compare: {len(rows)}")
-
-        # Calculate similarities
-        similarities = []
-        valid_products = 0
-        
-        for row in rows:
-            pid, name, category, emb_data, price, image_path = row
-            
-            try:
-                if emb_data is None:
-                    continue
-                
-                # Convert product embedding
-                if isinstance(emb_data, bytes):
-                    product_embedding = pickle.loads(emb_data)
-                elif isinstance(emb_data, str):
-                    if emb_data.startswith('[') and emb_data.endswith(']'):
-                        embedding_list = ast.literal_eval(emb_data)
-                        product_embedding = np.array(embedding_list, dtype=np.float32)
-                    else:
-                        embedding_list = [float(x) for x in emb_data.replace(',', ' ').split()]
-                        product_embedding = np.array(embedding_list, dtype=np.float32)
-                elif isinstance(emb_data, list):
-                    product_embedding = np.array(emb_data, dtype=np.float32)
-                else:
-                    continue
-                
-                # Handle shape mismatches
-                if product_embedding.shape != target_embedding.shape:
-                    min_dim = min(product_embedding.shape[0], target_embedding.shape[0])
-                    product_embedding_trimmed = product_embedding[:min_dim]
-                    target_embedding_trimmed = target_embedding[:min_dim]
-                else:
-                    product_embedding_trimmed = product_embedding
-                    target_embedding_trimmed = target_embedding
-                
-                # Calculate similarity
-                sim = float(np.dot(target_embedding_trimmed, product_embedding_trimmed))
-                
-                # Category bonus
-                final_similarity = sim
-                if category == source_category:
-                    final_similarity += 0.03
-                    final_similarity = min(final_similarity, 1.0)
-                
-                similarities.append({
-                    "product_id": pid,
-                    "name": name,
-                    "category": category,
-                    "similarity": round(final_similarity, 4),
-                    "price": float(price) if price else 0.0,
-                    "image_path": image_path or "/default-product-image.jpg",
-                    "is_same_category": category == source_category
-                })
-                
-                valid_products += 1
-                
-            except Exception as e:
-                print(f"❌ Error processing product {pid}: {e}")
-                continue
+        log.debug("Recommendation request", extra={"fields": {
+            "product_id": product_id, "top_k": top_k, "threshold": similarity_threshold,
+        }})
 
-        print(f"✅ Successfully processed {valid_products} products")
+        with stage("source_lookup"):
+            indexed = await search_executor.run(search_index.get, product_id)
+        if indexed is None:
+            return {
+                "error": "Product not found",
+                "message": f"Product with ID {product_id} not found in database"
+            }
+
+        target_embedding, source_product_name, source_category = indexed
+
+        log.debug("Recommendation source", extra={"fields": {
+            "name": source_product_name, "category": source_category,
+        }})
+
+        # Default requests are answered from the materialized neighbour table;
+        # filters, ANN knobs or a top_k beyond the table's K fall through to a live search
+        filters = search_filters(request.categories, request.exclude_categories,
+                                 request.min_price, request.max_price, request.in_stock)
+        materialized = None
+        if (neighbor_table is not None and not filters and not request.exact and request.nprobe is None
+                and request.ef is None and top_k <= neighbor_table.k):
+            if not request.refresh:
+                materialized = neighbor_table.get(product_id, top_k)
+            if materialized is None:
+                # Missing (not built yet) or refresh requested: compute it now and keep it
+                with stage("scoring"):
+                    materialized = await cpu_executor.run(neighbor_table.recompute, product_id)
+
+        if materialized is not None:
+            similarities, computed_at = materialized[0][:top_k], materialized[1]
+            served_from = "neighbor_table"
+        else:
+            # Score every indexed product in one matrix-vector product (same-category bonus capped at 1.0)
+            with stage("scoring"):
+                similarities = await search_executor.run(
+                    search_index.search,
+                    target_embedding,
+                    top_k=top_k,
+                    exclude_ids=[product_id],
+                    boost_category=source_category,
+                    boost=RECOMMEND_CATEGORY_BOOST,
+                    max_score=1.0,
+                    exact=bool(request.exact),
+                    nprobe=request.nprobe,
+                    ef=request.ef,
+                    min_score=similarity_threshold,
+                    **filters,
+                )
+            computed_at = time.time()
+            served_from = "live_search"
+        total_searched = max(len(search_index) - 1, 0)
 
-        # Sort and filter
-        similarities.sort(key=lambda x: x["similarity"], reverse=True)
         filtered_recommendations = [
-            rec for rec in similarities 
+            rec for rec in similarities
             if rec["similarity"] >= similarity_threshold
-        ][:top_k]
+        ]
+
+        with stage("hydration"):
+            details = await db_executor.run(fetch_product_details, [rec["product_id"] for rec in filtered_recommendations])
+        for rec in filtered_recommendations:
+            detail = details.get(rec["product_id"], {})
+            rec["similarity"] = round(rec["similarity"], 4)
+            rec["price"] = detail.get("price", 0.0)
+            rec["image_path"] = detail.get("image_path") or "/default-product-image.jpg"
+            rec["is_same_category"] = rec["category"] == source_category
+
+        log.debug("Recommendations found", extra={"fields": {
+            "product_id": product_id, "found": len(filtered_recommendations), "served_from": served_from,
+        }})
 
-        print(f"🎯 Found {len(filtered_recommendations)} recommendations")
-        
         # Search metrics
         search_metrics = {
-            "total_products_searched": len(rows),
-            "products_with_valid_embeddings": valid_products,
+            "total_products_searched": total_searched,
+            "products_with_valid_embeddings": total_searched,
             "products_found": len(filtered_recommendations),
             "top_similarity_score": filtered_recommendations[0]["similarity"] if filtered_recommendations else 0,
             "similarity_threshold": similarity_threshold,
-            "same_category_matches": len([r for r in filtered_recommendations if r["is_same_category"]])
+            "same_category_matches": len([r for r in filtered_recommendations if r["is_same_category"]]),
+            "served_from": served_from,
+            "filters": filters,
+            "computed_at": datetime.utcfromtimestamp(computed_at).isoformat(),
+            "stale": served_from == "neighbor_table" and neighbor_table.is_stale(product_id),
         }
 
         # Return response
         if not filtered_recommendations:
             top_similarity = similarities[0]["similarity"] if similarities else 0
+            if not similarities and served_from == "live_search":
+                # The threshold was applied inside the search; look up the closest match for the message
+                closest = await search_executor.run(
+                    search_index.search, target_embedding, top_k=1, exclude_ids=[product_id],
+                    boost_category=source_category, boost=RECOMMEND_CATEGORY_BOOST, max_score=1.0, **filters,
+                )
+                top_similarity = closest[0]["similarity"] if closest else 0
             return {
                 "error": "No similar products found",
                 "message": f"No products meet the {similarity_threshold*100}% similarity threshold",
@@ -451,152 +1398,220 @@ async def recommend_items(request: RecommendRequest = None):
             "total_found": len(filtered_recommendations)
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Recommendation error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"❌ Recommendation error: {e}")
         raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
 
+# ============================================================
+# 🧩 BATCH RECOMMENDATIONS (several carousels, one scan)
+# ============================================================
+# Pages with several "you may also like" carousels send every source product
+# (or query vector) at once. Duplicate ids are scored once, all queries share
+# one blocked matrix-matrix product against the catalog, and the union of
+# winners is hydrated with a single metadata lookup.
+RECOMMEND_BATCH_MAX = int(os.getenv("RECOMMEND_BATCH_MAX", "100"))
+
+class RecommendBatchRequest(BaseModel):
+    product_ids: Optional[List[str]] = None
+    # Base64 float32 query vectors (as returned by /get_embedding/)
+    embeddings_b64: Optional[List[str]] = None
+    top_k: Optional[int] = 5
+    similarity_threshold: Optional[float] = 0.70
+    # Never recommended to any query (e.g. products already in the cart)
+    exclude_ids: Optional[List[str]] = None
+
+@app.post("/recommend/batch/")
+async def recommend_batch(http_request: Request, request: RecommendBatchRequest = None):
+    """Per-query top-k recommendations for many product ids / vectors in one scan"""
+    if not request:
+        raise HTTPException(status_code=400, detail="JSON payload required")
+    product_ids = [str(pid) for pid in request.product_ids or []]
+    vectors_b64 = request.embeddings_b64 or []
+    if not product_ids and not vectors_b64:
+        raise HTTPException(status_code=400, detail="product_ids or embeddings_b64 required")
+    if len(product_ids) + len(vectors_b64) > RECOMMEND_BATCH_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {RECOMMEND_BATCH_MAX} queries per batch (got {len(product_ids) + len(vectors_b64)})",
+        )
+
+    params = {
+        "product_ids": product_ids,
+        "embeddings_b64": vectors_b64,
+        "top_k": request.top_k or 5,
+        "similarity_threshold": request.similarity_threshold or 0.70,
+        "exclude_ids": sorted({str(pid) for pid in request.exclude_ids or []}),
+    }
+    return await cached_json_response(
+        http_request, "recommend_batch", params,
+        lambda: compute_batch_recommendations(params),
+    )
+
+def score_batch(queries, top_k, exclude_ids, boost_categories):
+    """One result list per query: a matrix-matrix product in memory, one query at a time on pgvector"""
+    if SEARCH_BACKEND == "memory":
+        return product_index.search_batch(
+            np.vstack(queries), top_k=top_k, exclude_ids=exclude_ids,
+            boost_categories=boost_categories, boost=RECOMMEND_CATEGORY_BOOST, max_score=1.0,
+        )
+    return [
+        search_index.search(query, top_k=top_k, exclude_ids=excluded, boost_category=category,
+                            boost=RECOMMEND_CATEGORY_BOOST, max_score=1.0)
+        for query, excluded, category in zip(queries, exclude_ids, boost_categories)
+    ]
+
+def lookup_sources(product_ids):
+    """product_id -> (vector, name, category) for the ids that are indexed"""
+    sources = {}
+    for product_id in product_ids:
+        indexed = search_index.get(product_id)
+        if indexed is not None:
+            sources[product_id] = indexed
+    return sources
+
+async def compute_batch_recommendations(params):
+    try:
+        top_k = params["top_k"]
+        threshold = params["similarity_threshold"]
+        global_excludes = params["exclude_ids"]
+
+        # Each distinct source product is scored once, however many carousels ask for it
+        with stage("source_lookup"):
+            sources = await search_executor.run(lookup_sources, dict.fromkeys(params["product_ids"]))
+
+        queries, labels, exclude_ids, boost_categories = [], [], [], []
+        for product_id, (vector, _, category) in sources.items():
+            queries.append(vector)
+            labels.append(("product", product_id))
+            exclude_ids.append([product_id, *global_excludes])
+            boost_categories.append(category)
+        errors = {}
+        for position, value in enumerate(params["embeddings_b64"]):
+            try:
+                vector = b64_to_embedding(value)
+                if vector.shape != (search_index.dim,):
+                    raise ValueError(f"expected {search_index.dim} dims, got {vector.shape}")
+                queries.append(vector)
+            except ValueError as e:
+                errors[position] = f"Invalid embedding payload: {e}"
+                continue
+            labels.append(("vector", position))
+            exclude_ids.append(list(global_excludes))
+            boost_categories.append(None)
+
+        lists = []
+        if queries:
+            with stage("scoring"):
+                lists = await search_executor.run(score_batch, queries, top_k, exclude_ids, boost_categories)
+        lists = [[rec for rec in hits if rec["similarity"] >= threshold] for hits in lists]
+
+        # One hydration query for the union of every carousel's winners
+        winners = list(dict.fromkeys(rec["product_id"] for hits in lists for rec in hits))
+        with stage("hydration"):
+            details = await db_executor.run(fetch_product_details, winners)
+
+        by_label = {}
+        for label, hits in zip(labels, lists):
+            source_category = sources[label[1]][2] if label[0] == "product" else None
+            for rec in hits:
+                detail = details.get(rec["product_id"], {})
+                rec["similarity"] = round(rec["similarity"], 4)
+                rec["price"] = detail.get("price", 0.0)
+                rec["image_path"] = detail.get("image_path") or "/default-product-image.jpg"
+                rec["is_same_category"] = source_category is not None and rec["category"] == source_category
+            by_label[label] = hits
+
+        results = []
+        for product_id in params["product_ids"]:
+            if product_id not in sources:
+                results.append({"product_id": product_id, "error": "Product not found", "recommendations": []})
+                continue
+            hits = by_label[("product", product_id)]
+            results.append({"product_id": product_id, "recommendations": hits, "total_found": len(hits)})
+        for position in range(len(params["embeddings_b64"])):
+            if position in errors:
+                results.append({"query_index": position, "error": errors[position], "recommendations": []})
+                continue
+            hits = by_label[("vector", position)]
+            results.append({"query_index": position, "recommendations": hits, "total_found": len(hits)})
+
+        return {
+            "results": results,
+            "similarity_threshold": threshold,
+            "search_metrics": {
+                "queries": len(params["product_ids"]) + len(params["embeddings_b64"]),
+                "unique_queries_scored": len(queries),
+                "total_products_searched": len(search_index),
+                "products_hydrated": len(winners),
+            },
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception(f"❌ Batch recommendation error: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch recommendation error: {str(e)}")
+
 # ============================================================
 # 📸 CAMERA SEARCH (Image → Similar Products)
 # ============================================================
 @app.post("/camera_recommend/")
-async def camera_recommend(image: UploadFile, top_k: int = Form(10)):
+async def camera_recommend(
+    image: UploadFile,
+    top_k: int = Form(10),
+    exact: bool = Form(False),
+    nprobe: Optional[int] = Form(None),
+    ef: Optional[int] = Form(None),
+    categories: Optional[str] = Form(None),
+    exclude_categories: Optional[str] = Form(None),
+    min_price: Optional[float] = Form(None),
+    max_price: Optional[float] = Form(None),
+    in_stock: bool = Form(False),
+    min_score: Optional[float] = Form(None)
+):
     """Search for visually similar products using a photo - returns only product IDs"""
     try:
         # -----------------------------
         # STEP 1: Get image embedding
         # -----------------------------
-        image_bytes = await image.read()
-        query_embedding = get_embedding(image_bytes)
-        print(f"[INFO] Query embedding shape: {query_embedding.shape}")
+        image_bytes = await read_upload(image)
+        query_embedding = await embed_image(image_bytes)
 
         # -----------------------------
-        # STEP 2: Predict category (optional)
+        # STEP 2: Predict category (one matmul against cached text prototypes)
         # -----------------------------
-# In your camera_recommend function, update the predict_category function:
-        def predict_category(image_embedding, categories):
-            sims = []
-            
-            # Add common category variations
-            category_variations = {}
-            for cat in categories:
-                variations = [cat.lower()]
-                # Add common variations
-                if 'electronic' in cat.lower():
-                    variations.extend(['electronics', 'tech', 'technology', 'gadgets'])
-                elif 'cloth' in cat.lower():
-                    variations.extend(['clothing', 'fashion', 'apparel'])
-                elif 'sport' in cat.lower():
-                    variations.extend(['sports', 'fitness', 'outdoor'])
-                elif 'home' in cat.lower():
-                    variations.extend(['home', 'household', 'furniture'])
-                elif 'beauty' in cat.lower():
-                    variations.extend(['beauty', 'cosmetics', 'skincare'])
-                
-                category_variations[cat] = variations
-
-            for cat, variations in category_variations.items():
-                best_sim = 0
-                for variation in variations:
-                    try:
-                        text_inputs = clip_processor(
-                            text=[variation], 
-                            return_tensors="pt", 
-                            padding=True, 
-                            truncation=True
-                        )
-                        with torch.no_grad():
-                            text_features = clip_model.get_text_features(**text_inputs)
-                            text_features = text_features / text_features.norm(p=2, dim=-1, keepdim=True)
-                        text_embedding = text_features.squeeze().cpu().numpy()
-                        sim = float(np.dot(image_embedding, text_embedding))
-                        if sim > best_sim:
-                            best_sim = sim
-                    except Exception as e:
-                        continue
-                
-                sims.append(best_sim)
-                print(f"[DEBUG] Category: {cat}, best similarity: {best_sim:.4f}")
-            
-            if not sims:
-                return "unknown", 0.0
-            
-            best_idx = int(np.argmax(sims))
-            best_category = list(category_variations.keys())[best_idx]
-            return best_category, sims[best_idx]
-
-        # Get all categories
-        with get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT DISTINCT category FROM product_embeddings WHERE category IS NOT NULL")
-                categories = [r[0] for r in cursor.fetchall()]
-
-        predicted_category, category_confidence = "unknown", 0.0
-        if categories:
-            predicted_category, category_confidence = predict_category(query_embedding, categories)
-            print(f"[INFO] Predicted category: {predicted_category} (confidence {category_confidence:.4f})")
-
-        # -----------------------------
-        # STEP 3: Fetch products with embeddings
-        # -----------------------------
-        products_data = []
-        with get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT product_id, name, category, embedding
-                    FROM product_embeddings 
-                    WHERE embedding IS NOT NULL
-                """)
-                products_data = cursor.fetchall()
-                print(f"[INFO] Found {len(products_data)} products with embeddings")
+        with stage("category"):
+            predicted_category, category_confidence = await cpu_executor.run(
+                category_predictor.predict, query_embedding
+            )
+        if category_predictor.needs_refresh(search_index.categories()):
+            prototypes_stale.set()
+        log.debug("Predicted category", extra={"fields": {
+            "category": predicted_category, "confidence": round(category_confidence, 4),
+        }})
 
         # -----------------------------
-        # STEP 4: Compute similarities
+        # STEP 3: Score against the in-memory index
         # -----------------------------
-        similarities = []
-        query_embedding = np.array(query_embedding, dtype=np.float32).flatten()  # ensure 1D
-
-        for row in products_data:
-            product_id, name, category, emb_data = row
-            try:
-            # Convert stored embedding to numpy array
-                if isinstance(emb_data, str):
-                    emb = np.array(ast.literal_eval(emb_data), dtype=np.float32)
-                elif isinstance(emb_data, list):
-                    emb = np.array(emb_data, dtype=np.float32)
-                elif isinstance(emb_data, bytes):
-                    emb = np.array(pickle.loads(emb_data), dtype=np.float32)
-                else:
-                    raise ValueError("Unknown embedding format")
-        
-                emb = emb.flatten()  # ensure 1D
-
-                # Ensure embeddings have the same dimension
-                if emb.shape != query_embedding.shape:
-                    print(f"[WARN] Skipping {product_id}, shape mismatch {emb.shape} vs {query_embedding.shape}")
-                    continue
-
-                # Cosine similarity (dot product, embeddings should be normalized)
-                sim = float(np.dot(query_embedding, emb))
-
-                # Optional category boost
-                if category == predicted_category:
-                    sim += 0.05
-
-                similarities.append({
-                "product_id": product_id,
-                "name": name,
-                "category": category or "unknown",
-                "similarity": round(sim, 4)
-                })
-            except Exception as e:
-                print(f"[WARN] Cannot process product {product_id}: {e}")
-            continue
-
-        # Sort by similarity
-        similarities.sort(key=lambda x: x["similarity"], reverse=True)
-        recommendations = similarities[:top_k]
+        # Optional category boost is applied before top-k selection
+        with stage("scoring"):
+            recommendations = await search_executor.run(
+                search_index.search,
+                query_embedding,
+                top_k=top_k,
+                boost_category=predicted_category,
+                boost=0.05,
+                exact=exact,
+                nprobe=nprobe,
+                ef=ef,
+                min_score=min_score,
+                **search_filters(categories, exclude_categories, min_price, max_price, in_stock),
+            )
+        for rec in recommendations:
+            rec["category"] = rec["category"] or "unknown"
+            rec["similarity"] = round(rec["similarity"], 4)
 
         if not recommendations:
             return {
@@ -611,105 +1626,344 @@ async def camera_recommend(image: UploadFile, top_k: int = Form(10)):
             "recommendations": recommendations,
             "search_metrics": {
                 "top_similarity_score": recommendations[0]["similarity"] if recommendations else 0,
-                "total_products_searched": len(products_data),
+                "total_products_searched": len(search_index),
                 "products_found": len(recommendations),
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Camera recommend failed: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"Camera recommend failed: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 
 # ============================================================
-# 🔍 SEARCH WITH EMBEDDING HEX
+# 🔤 TEXT SEARCH (query text → similar products)
 # ============================================================
-@app.post("/search_by_embedding/")
-async def search_by_embedding(embedding_hex: str = Form(...), top_k: int = Form(10)):
-    """Search using pre-computed embedding hex string (for Laravel direct search)"""
+# The query's CLIP text embedding is scored against the same image-embedding
+# index camera search uses. With lexical_weight > 0 a shortlist of
+# top_k * TEXT_SEARCH_CANDIDATES products is re-ranked by
+#     (1 - lexical_weight) * clip_score + lexical_weight * name_match
+# so names containing the typed words rise without a catalog-wide text scan.
+TEXT_SEARCH_CANDIDATES = int(os.getenv("TEXT_SEARCH_CANDIDATES", "5"))
+
+class SearchTextRequest(BaseModel):
+    query: str
+    top_k: Optional[int] = 10
+    lexical_weight: Optional[float] = 0.0
+    min_score: Optional[float] = None
+    categories: Optional[List[str]] = None
+    exclude_categories: Optional[List[str]] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: Optional[bool] = False
+    exact: Optional[bool] = False
+    nprobe: Optional[int] = None
+    ef: Optional[int] = None
+
+@app.post("/search_text/")
+async def search_text(http_request: Request, request: SearchTextRequest = None):
+    """Search products by free text (cached per catalog version, revalidated via ETag)"""
+    if not request or not normalize_query(request.query):
+        raise HTTPException(status_code=400, detail="A non-empty query is required")
+    lexical_weight = request.lexical_weight or 0.0
+    if not 0.0 <= lexical_weight <= 1.0:
+        raise HTTPException(status_code=400, detail="lexical_weight must be between 0 and 1")
+
+    filters = search_filters(request.categories, request.exclude_categories,
+                             request.min_price, request.max_price, request.in_stock)
+    params = {
+        "query": normalize_query(request.query),
+        "top_k": request.top_k or 10,
+        "lexical_weight": lexical_weight,
+        "min_score": request.min_score,
+        "exact": bool(request.exact),
+        "nprobe": request.nprobe,
+        "ef": request.ef,
+        **filters,
+    }
+    return await cached_json_response(
+        http_request, "search_text", params,
+        lambda: compute_text_search(request, params, filters),
+        filtered=bool(filters),
+    )
+
+async def compute_text_search(request: SearchTextRequest, params, filters):
     try:
-        # Convert hex back to embedding
-        query_embedding = hex_to_embedding(embedding_hex)
-        
-        with get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT pe.product_id, pe.name, pe.category, pe.embedding,
-                           p.product_price, p.product_quantity,
-                           pi.image_path, s.store_name
-                    FROM product_embeddings pe
-                    LEFT JOIN products p ON pe.product_id = p.product_id::text
-                    LEFT JOIN product_images pi ON p.product_id = pi.product_id
-                    LEFT JOIN sellers s ON p.seller_id = s.seller_id
-                    WHERE pe.embedding IS NOT NULL
-                """)
-                rows = cursor.fetchall()
+        top_k = params["top_k"]
+        lexical_weight = params["lexical_weight"]
+        query_embedding = await embed_text(request.query)
+
+        shortlist = top_k * max(1, TEXT_SEARCH_CANDIDATES) if lexical_weight > 0 else top_k
+        with stage("scoring"):
+            candidates = await search_executor.run(
+                search_index.search,
+                query_embedding,
+                top_k=shortlist,
+                exact=params["exact"],
+                nprobe=params["nprobe"],
+                ef=params["ef"],
+                # With blending the threshold applies to the blended score instead
+                min_score=params["min_score"] if lexical_weight == 0 else None,
+                **filters,
+            )
 
-        # Calculate similarities
-        similarities = []
-        for row in rows:
-            pid, name, category, emb_blob, price, quantity, image_path, store_name = row
-            try:
-                emb = pickle.loads(emb_blob)
-                sim = np.dot(query_embedding, emb)
-                
-                if sim >= 0.6:  # Only include similar products
-                    product_data = {
-                        "product_id": pid,
-                        "name": name,
-                        "category": category,
-                        "similarity": round(sim, 4),
-                        "price": float(price) if price else 0.0,
-                        "quantity": quantity or 0,
-                        "image_path": image_path or "/default-product-image.jpg",
-                        "store_name": store_name or "Unknown Store"
-                    }
-                    similarities.append((sim, product_data))
-            except Exception as e:
-                continue
+        query_tokens = tokenize(params["query"])
+        for rec in candidates:
+            rec["clip_score"] = rec["similarity"]
+            rec["lexical_score"] = lexical_score(query_tokens, rec["name"]) if lexical_weight > 0 else 0.0
+            rec["similarity"] = (1 - lexical_weight) * rec["clip_score"] + lexical_weight * rec["lexical_score"]
+        if lexical_weight > 0:
+            candidates.sort(key=lambda rec: rec["similarity"], reverse=True)
+            if params["min_score"] is not None:
+                candidates = [rec for rec in candidates if rec["similarity"] >= params["min_score"]]
+        recommendations = candidates[:top_k]
+
+        with stage("hydration"):
+            details = await db_executor.run(fetch_product_details, [rec["product_id"] for rec in recommendations])
+        for rec in recommendations:
+            detail = details.get(rec["product_id"], {})
+            for key in ("similarity", "clip_score", "lexical_score"):
+                rec[key] = round(rec[key], 4)
+            rec["category"] = rec["category"] or "unknown"
+            rec["price"] = detail.get("price", 0.0)
+            rec["quantity"] = detail.get("quantity", 0)
+            rec["image_path"] = detail.get("image_path") or "/default-product-image.jpg"
+            rec["store_name"] = detail.get("store_name") or "Unknown Store"
+
+        return {
+            # The normalized form the entry is cached under, not this caller's spelling
+            "query": params["query"],
+            "recommendations": recommendations,
+            "search_metrics": {
+                "total_products_searched": len(search_index),
+                "candidates_ranked": len(candidates),
+                "products_found": len(recommendations),
+                "top_similarity_score": recommendations[0]["similarity"] if recommendations else 0,
+                "lexical_weight": lexical_weight,
+                "filters": filters,
+            },
+        }
 
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        recommendations = [product_data for _, product_data in similarities[:top_k]]
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception(f"Text search failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Text search error: {str(e)}")
+
+# ============================================================
+# 🔍 SEARCH WITH PRE-COMPUTED EMBEDDING
+# ============================================================
+@app.post("/search_by_embedding/")
+async def search_by_embedding(
+    embedding_b64: str = Form(...),
+    top_k: int = Form(10),
+    exact: bool = Form(False),
+    nprobe: Optional[int] = Form(None),
+    ef: Optional[int] = Form(None)
+):
+    """Search using a base64 embedding from /get_embedding/ (for Laravel direct search)"""
+    try:
+        try:
+            query_embedding = b64_to_embedding(embedding_b64)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid embedding payload: {str(e)}")
+
+        # Rank in memory, then fetch prices/images only for the winners
+        with stage("scoring"):
+            similarities = await search_executor.run(
+                search_index.search, query_embedding, top_k=top_k, exact=exact, nprobe=nprobe, ef=ef
+            )
+        recommendations = [rec for rec in similarities if rec["similarity"] >= 0.6]
+
+        with stage("hydration"):
+            details = await db_executor.run(fetch_product_details, [rec["product_id"] for rec in recommendations])
+        for rec in recommendations:
+            detail = details.get(rec["product_id"], {})
+            rec["similarity"] = round(rec["similarity"], 4)
+            rec["price"] = detail.get("price", 0.0)
+            rec["quantity"] = detail.get("quantity", 0)
+            rec["image_path"] = detail.get("image_path") or "/default-product-image.jpg"
+            rec["store_name"] = detail.get("store_name") or "Unknown Store"
 
         if not recommendations:
             return {
                 "error": "No similar products found",
-                "closest_match": similarities[0][0] if similarities else 0
+                "closest_match": round(similarities[0]["similarity"], 4) if similarities else 0
             }
 
         return {
             "recommendations": recommendations,
             "search_metrics": {
-                "top_similarity_score": similarities[0][0] if similarities else 0,
+                "top_similarity_score": recommendations[0]["similarity"],
                 "products_found": len(recommendations)
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching with embedding: {str(e)}")
 
+# ============================================================
+# 🩺 DATABASE POOL METRICS
+# ============================================================
+@app.get("/db_pool_stats/")
+async def get_db_pool_stats():
+    """Connection pool size, saturation and checkout wait times"""
+    return db_pool.stats()
+
+@app.get("/executor_stats/")
+async def get_executor_stats():
+    """Queue depth, saturation and rejections of the inference/cpu/db pools"""
+    return {
+        "inference": inference_executor.stats(),
+        "cpu": cpu_executor.stats(),
+        "db": db_executor.stats(),
+    }
+
+class NeighborRefreshRequest(BaseModel):
+    # Recompute these products now; omit to schedule a full rebuild
+    product_ids: Optional[list] = None
+
+@app.get("/neighbor_table_stats/")
+async def get_neighbor_table_stats():
+    if neighbor_table is None:
+        return {"enabled": False}
+    return {"enabled": True, **neighbor_table.stats()}
+
+@app.post("/neighbor_table/refresh/")
+async def refresh_neighbor_table(request: NeighborRefreshRequest = None):
+    """On-demand recompute of specific lists, or a full rebuild by the background job"""
+    if neighbor_table is None:
+        raise HTTPException(status_code=404, detail="Neighbour table is disabled (NEIGHBOR_TABLE_K=0)")
+    if request is None or not request.product_ids:
+        neighbor_table.mark_changed(None)
+        return {"status": "scheduled", "scope": "all"}
+
+    recomputed = 0
+    for product_id in request.product_ids:
+        recomputed += (await cpu_executor.run(neighbor_table.recompute, str(product_id))) is not None
+    return {"status": "done", "recomputed": recomputed, "requested": len(request.product_ids)}
+
+@app.get("/vector_storage_stats/")
+async def get_vector_storage_stats():
+    """Vector storage mode and the bytes held by the float32 matrix and the compressed copy"""
+    return {**product_index.memory_usage(), "rerank_factor": product_index.rerank_factor}
+
+@app.get("/embedding_cache_stats/")
+async def get_embedding_cache_stats():
+    return {**embedding_cache.stats(), "text": text_embedding_cache.stats()}
+
+@app.get("/product_metadata_stats/")
+async def get_product_metadata_stats():
+    return product_metadata.stats()
+
+# ============================================================
+# 📈 PROMETHEUS METRICS + RUNTIME LOG LEVEL
+# ============================================================
+def cache_counts():
+    """(hits, misses) per cache, read from each cache's own counters"""
+    embedding = embedding_cache.stats()
+    response = response_cache.stats()
+    metadata = product_metadata.stats()
+    text = text_embedding_cache.stats()
+    return {
+        "embedding": (embedding["memory_hits"] + embedding["disk_hits"], embedding["misses"]),
+        "text_embedding": (text["memory_hits"], text["misses"]),
+        "response": (response["hits"] + response["remote_hits"], response["misses"]),
+        "product_metadata": (metadata["hits"], metadata["misses"]),
+    }
+
+EXECUTORS = {"inference": inference_executor, "cpu": cpu_executor, "db": db_executor}
+
+REGISTRY.callback("ml_cache_hits_total", "Cache hits by cache",
+                  lambda: [({"cache": name}, hits) for name, (hits, _) in cache_counts().items()], kind="counter")
+REGISTRY.callback("ml_cache_misses_total", "Cache misses by cache",
+                  lambda: [({"cache": name}, misses) for name, (_, misses) in cache_counts().items()], kind="counter")
+REGISTRY.callback("ml_index_rows_scanned_total", "Similarity computations by the in-memory index",
+                  lambda: [({}, product_index.rows_scanned)], kind="counter")
+def vector_bytes():
+    usage = product_index.memory_usage()
+    samples = [({"copy": "float32"}, usage["matrix_bytes"])]
+    if product_index.storage is not None:
+        samples.append(({"copy": usage["storage"]}, usage["compressed_bytes"]))
+    return samples
+
+REGISTRY.callback("ml_index_vector_bytes", "Bytes of the float32 matrix and of its compressed copy", vector_bytes)
+REGISTRY.callback("ml_index_products", "Products searchable by the active backend",
+                  lambda: [({"backend": SEARCH_BACKEND}, len(search_index))])
+REGISTRY.callback("ml_executor_pending", "Queued + running jobs per pool",
+                  lambda: [({"pool": name}, pool.stats()["pending"]) for name, pool in EXECUTORS.items()])
+REGISTRY.callback("ml_executor_rejected_total", "Jobs rejected with 503 per pool",
+                  lambda: [({"pool": name}, pool.stats()["rejected"]) for name, pool in EXECUTORS.items()],
+                  kind="counter")
+REGISTRY.callback("ml_db_pool_in_use", "Checked-out database connections",
+                  lambda: [({}, db_pool.stats()["in_use"])])
+REGISTRY.callback("ml_db_pool_timeouts_total", "Connection checkouts that timed out",
+                  lambda: [({}, db_pool.stats()["timeouts"])], kind="counter")
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, stage, cache and pool metrics"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+class LogLevelRequest(BaseModel):
+    level: str
+
+@app.get("/log_level/")
+async def read_log_level():
+    return {"level": get_log_level()}
+
+@app.post("/log_level/")
+async def change_log_level(request: LogLevelRequest):
+    """Switch logging verbosity at runtime (e.g. DEBUG while investigating, then back to INFO)"""
+    try:
+        level = set_log_level(request.level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    log.info(f"Log level set to {level}")
+    return {"level": level}
+
+@app.get("/embedding_batcher_stats/")
+async def get_embedding_batcher_stats():
+    """Image-encoding batch sizes and queue latency"""
+    return image_batcher.stats()
+
+@app.on_event("shutdown")
+def shutdown_close_pool():
+    for executor in (inference_executor, cpu_executor, db_executor):
+        executor.shutdown()
+    db_pool.closeall()
+
 # ============================================================
 # 📊 GET CATEGORY STATISTICS
 # ============================================================
+def fetch_category_counts():
+    with get_conn() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT category, COUNT(*) as product_count
+                FROM product_embeddings
+                GROUP BY category
+                ORDER BY product_count DESC
+            """)
+            return cursor.fetchall()
+
 @app.get("/categories/")
-async def get_categories():
+async def get_categories(http_request: Request):
     """Get all available categories and their product counts"""
     try:
-        with get_conn() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("""
-                    SELECT category, COUNT(*) as product_count
-                    FROM product_embeddings
-                    GROUP BY category
-                    ORDER BY product_count DESC
-                """)
-                rows = cursor.fetchall()
+        async def compute():
+            rows = await db_executor.run(fetch_category_counts)
+            categories = [{"category": row[0], "product_count": row[1]} for row in rows]
+            return {"categories": categories}
 
-        categories = [{"category": row[0], "product_count": row[1]} for row in rows]
-        return {"categories": categories}
+        # Counts only move when the catalog does
+        return await cached_json_response(http_request, "categories", {}, compute)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -0,0 +1,234 @@
+"""Offline re-embedding of the whole catalog with a pool of CLIP worker processes.
+
+Reads products (first image, name, category) in keyset-paginated chunks,
+fans image decoding + encoding out across worker processes, bulk-upserts
+the vectors into product_embeddings and checkpoints the last committed
+product_id, so an interrupted run resumes where it stopped. The running
+API service picks the new vectors up through its updated_at delta sync.
+
+    python reembed_catalog.py --workers 4
+    python reembed_catalog.py --dry-run --limit 2000      # measure images/s only
+    python reembed_catalog.py --restart                   # ignore the checkpoint
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db import connect
+from embedding_codec import encode_embedding
+from migrate_embeddings import column_type
+from pgvector_index import VECTOR_COLUMN, has_vector_column, vector_literal
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMAGE_ROOT = os.path.join(BASE_DIR, "..", "storage", "app", "public")
+DEFAULT_CHECKPOINT = os.path.join(BASE_DIR, "reembed_checkpoint.json")
+
+# ------------------------------------------------------------
+# Worker process side
+# ------------------------------------------------------------
+_encoder = None
+_pixel_buffer = None  # reused across batches; encoded before the next batch overwrites it
+
+
+def _init_worker(model_name, backend, threads):
+    global _encoder
+    from clip_encoder import ClipEncoder
+
+    # One process per core slice; keep each worker from oversubscribing the CPU
+    _encoder = ClipEncoder(model_name, backend=backend, threads=threads)
+
+
+def _encode_batch(task):
+    """Encode one sub-batch of (product_id, name, category, image_path) rows"""
+    global _pixel_buffer
+    rows, image_root, tag = task
+    readable, payloads, failures = [], [], []
+    for row in rows:
+        try:
+            with open(os.path.join(image_root, row[3]), "rb") as fh:
+                payloads.append(fh.read())
+            readable.append(row)
+        except OSError as e:
+            failures.append((row[0], str(e)))
+
+    pixels, errors = _encoder.preprocess_batch(payloads, out=_pixel_buffer)
+    _pixel_buffer = pixels.base  # the (possibly newly allocated) full buffer behind the view
+    failures.extend((readable[position][0], error) for position, error in errors.items())
+    decoded = [row for position, row in enumerate(readable) if position not in errors]
+
+    vectors = _encoder.encode_images(pixels) if len(decoded) else []
+    return list(zip(decoded, vectors)), failures, tag
+
+
+# ------------------------------------------------------------
+# Coordinator side
+# ------------------------------------------------------------
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def save_checkpoint(path, state):
+    # Write-then-rename so a crash never leaves a truncated checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, indent=2)
+    os.replace(tmp_path, path)
+
+
+def iter_product_chunks(conn, after_id, chunk_size, limit):
+    """Keyset-paginated (product_id, name, category, first image) rows"""
+    fetched = 0
+    while limit is None or fetched < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - fetched)
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT p.product_id, p.product_name, LOWER(c.category_name), img.image_path
+                FROM products p
+                LEFT JOIN categories c ON c.category_id = p.category_id
+                JOIN LATERAL (
+                    SELECT image_path FROM product_images pi
+                    WHERE pi.product_id = p.product_id
+                    ORDER BY pi.id LIMIT 1
+                ) img ON TRUE
+                WHERE p.product_id > %s
+                ORDER BY p.product_id
+                LIMIT %s
+            """, (after_id, size))
+            rows = cursor.fetchall()
+        conn.commit()
+        if not rows:
+            return
+        fetched += len(rows)
+        after_id = rows[-1][0]
+        yield rows
+
+
+def iter_tasks(chunks, batch_size, image_root):
+    """Split chunks into worker sub-batches, tagging the last one of each chunk"""
+    for rows in chunks:
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        for i, batch in enumerate(batches):
+            yield batch, image_root, (rows[-1][0] if i == len(batches) - 1 else None)
+
+
+def write_vectors(conn, encoded, binary_column, vector_column=False):
+    now = datetime.utcnow()
+    values = [
+        (
+            str(pid),
+            name,
+            category,
+            psycopg2.Binary(encode_embedding(vec)) if binary_column else json.dumps(vec.tolist()),
+            *((vector_literal(vec),) if vector_column else ()),
+            now,
+            now,
+        )
+        for (pid, name, category, _), vec in encoded
+    ]
+    # Keep the pgvector column (SEARCH_BACKEND=pgvector) in step once it exists
+    vector_insert = f", {VECTOR_COLUMN}" if vector_column else ""
+    vector_update = f"{VECTOR_COLUMN} = EXCLUDED.{VECTOR_COLUMN}," if vector_column else ""
+    with conn.cursor() as cursor:
+        execute_values(cursor, f"""
+            INSERT INTO product_embeddings (product_id, name, category, embedding{vector_insert}, created_at, updated_at)
+            VALUES %s
+            ON CONFLICT (product_id) DO UPDATE
+            SET name = EXCLUDED.name,
+                category = EXCLUDED.category,
+                embedding = EXCLUDED.embedding,
+                {vector_update}
+                updated_at = EXCLUDED.updated_at
+        """, values, page_size=1000)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--backend", default=os.getenv("CLIP_BACKEND", "torch"), help="torch, torch-int8, onnx or onnx-int8")
+    parser.add_argument("--batch-size", type=int, default=32, help="images per vision-tower call")
+    parser.add_argument("--chunk-size", type=int, default=512, help="rows per DB read/write and checkpoint")
+    parser.add_argument("--image-root", default=os.getenv("PRODUCT_IMAGE_ROOT", DEFAULT_IMAGE_ROOT))
+    parser.add_argument("--model", default=os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32"))
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many products")
+    parser.add_argument("--dry-run", action="store_true", help="read and encode only; no writes, no checkpoint")
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    state = None if args.restart or args.dry_run else load_checkpoint(args.checkpoint)
+    if state and state.get("model") != args.model:
+        raise SystemExit(f"Checkpoint was written for {state.get('model')}; use --restart to re-embed with {args.model}")
+    state = state or {"model": args.model, "last_product_id": "", "processed": 0, "failed": 0}
+    if state["last_product_id"]:
+        print(f"[INFO] Resuming after product_id {state['last_product_id']} ({state['processed']} already done)")
+
+    read_conn, write_conn = connect(), connect()
+    with write_conn.cursor() as cursor:
+        binary_column = column_type(cursor, "embedding") == "bytea"
+        vector_column = has_vector_column(cursor)
+    write_conn.commit()
+
+    chunks = iter_product_chunks(read_conn, state["last_product_id"], args.chunk_size, args.limit)
+    tasks = iter_tasks(chunks, args.batch_size, args.image_root)
+
+    if args.backend.startswith("onnx"):
+        # Export once up front instead of racing to do it in every worker
+        from clip_encoder import CLIP_ONNX_DIR
+        from clip_onnx import ensure_onnx
+        ensure_onnx(args.model, CLIP_ONNX_DIR, quantized=args.backend == "onnx-int8")
+
+    started = time.perf_counter()
+    images, failed, pending = 0, 0, []
+    ctx = mp.get_context("spawn")  # torch is not fork-safe once initialized
+    with ctx.Pool(args.workers, initializer=_init_worker, initargs=(args.model, args.backend, threads)) as pool:
+        # imap keeps results in submission order, so checkpoints only ever move forward
+        for encoded, failures, tag in pool.imap(_encode_batch, tasks):
+            pending.extend(encoded)
+            images += len(encoded)
+            failed += len(failures)
+            for product_id, error in failures:
+                print(f"[WARN] {product_id}: {error}")
+
+            if tag is None:
+                continue
+
+            # End of a chunk: commit its vectors, then advance the checkpoint
+            if not args.dry_run:
+                if pending:
+                    write_vectors(write_conn, pending, binary_column, vector_column)
+                state.update(
+                    last_product_id=tag,
+                    processed=state["processed"] + len(pending),
+                    failed=state["failed"] + failed,
+                    updated_at=datetime.utcnow().isoformat(),
+                )
+                save_checkpoint(args.checkpoint, state)
+                failed = 0
+            pending = []
+
+            elapsed = time.perf_counter() - started
+            print(f"[INFO] {images} images in {elapsed:.1f}s ({images / max(elapsed, 1e-9):.1f} images/s), up to {tag}")
+
+    read_conn.close()
+    write_conn.close()
+
+    elapsed = time.perf_counter() - started
+    mode = "DRY RUN" if args.dry_run else "DONE"
+    print(f"✅ [{mode}] {images} images encoded in {elapsed:.1f}s "
+          f"({images / max(elapsed, 1e-9):.1f} images/s, {args.workers} {args.backend} workers x {threads} threads)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional: only needed for RESPONSE_CACHE_REDIS_URL
+    redis = None
+
+log = logging.getLogger("ml_service")
+
+
+# ============================================================
+# 🧾 RESPONSE CACHE (read endpoints)
+# ============================================================
+# Keys hash the endpoint, its normalized parameters and the catalog version
+# the answer was computed from, so a catalog change (an add/delete bumps the
+# index version) makes old entries unreachable instead of needing explicit
+# purges; they age out via LRU/TTL. Values are the serialized JSON body plus
+# its ETag (a hash of the body), which clients send back in If-None-Match.
+# Tiers: in-process LRU with TTL, then optionally a Redis-compatible server
+# (RESPONSE_CACHE_REDIS_URL) shared by the workers on the host. The index
+# version is a per-process counter, so the shared tier takes its own key built
+# from a host-wide catalog version; without one a lookup stays in process.
+
+class ResponseCache:
+    """LRU + TTL cache of serialized JSON responses, with an optional Redis tier"""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 60.0, redis_url: str = None, namespace: str = "rs"):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, body, etag)
+        self._hits = 0
+        self._remote_hits = 0
+        self._misses = 0
+        self._not_modified = 0
+        self._remote_errors = 0
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                log.warning("RESPONSE_CACHE_REDIS_URL set but the redis package is not installed; using memory only")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.05, socket_connect_timeout=0.2)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self._redis is not None
+
+    @property
+    def remote(self) -> bool:
+        """True when lookups may block on the network (call from a worker thread)"""
+        return self._redis is not None
+
+    def make_key(self, endpoint: str, params: dict, version) -> str:
+        raw = json.dumps([endpoint, params, version], sort_keys=True, separators=(",", ":"), default=str)
+        return f"{self.namespace}:{endpoint}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def serialize(payload):
+        """(body bytes, ETag) for a JSON-compatible payload"""
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+    def get(self, key: str, shared_key: str = None):
+        """(body, etag) or None; Redis is only consulted under `shared_key`"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1], entry[2]
+                del self._entries[key]
+
+        if self._redis is not None and shared_key is not None:
+            try:
+                value = self._redis.get(shared_key)
+            except Exception:
+                value = None
+                with self._lock:
+                    self._remote_errors += 1
+            if value:
+                etag, body = value.split(b"\n", 1)
+                etag = etag.decode("ascii")
+                self._remember(key, body, etag)
+                with self._lock:
+                    self._remote_hits += 1
+                return body, etag
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def _remember(self, key, body, etag):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, payload, shared_key: str = None):
+        """Serialize and store a payload (in Redis too under `shared_key`); returns (body, etag)"""
+        body, etag = self.serialize(payload)
+        self._remember(key, body, etag)
+        if self._redis is not None and shared_key is not None:
+            try:
+                self._redis.set(shared_key, etag.encode("ascii") + b"\n" + body, ex=max(1, int(self.ttl)))
+            except Exception:
+                with self._lock:
+                    self._remote_errors += 1
+        return body, etag
+
+    def record_not_modified(self):
+        with self._lock:
+            self._not_modified += 1
+
+    @staticmethod
+    def etag_matches(if_none_match: str, etag: str) -> bool:
+        if not if_none_match:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._remote_hits + self._misses
+            return {
+                "backend": "memory+redis" if self._redis is not None else "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self._hits,
+                "remote_hits": self._remote_hits,
+                "misses": self._misses,
+                "hit_ratio": round((self._hits + self._remote_hits) / lookups, 4) if lookups else 0.0,
+                "not_modified": self._not_modified,
+                "remote_errors": self._remote_errors,
+            }
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single worker, no cross-process lock needed
+    fcntl = None
+
+log = logging.getLogger("ml_service")
+
+
+# ============================================================
+# 💾 MEMORY-MAPPED INDEX SNAPSHOTS
+# ============================================================
+# Layout of SNAPSHOT_DIR:
+#   CURRENT        name of the live snapshot directory, replaced atomically
+#   v000042/       matrix.npy  float32 (capacity x dim), rows past `rows` are spare
+#                  meta.json   version, dim, rows, ids, names, categories,
+#                              synced_until, created_at
+#   .lock          flock held by whichever worker is building a snapshot
+# Workers map matrix.npy copy-on-write: the file is opened read-only and pages
+# nobody writes stay shared through the OS page cache. Upserts into existing
+# rows or the spare rows only copy the pages they touch into the worker.
+# Only the matrix is shared: ids, names and categories are read from meta.json
+# into Python lists, so each worker still holds its own copy of them (roughly
+# 100-200 bytes per product, small next to 2 KB of float32 vector).
+
+SNAPSHOT_FORMAT = 1
+
+
+class Snapshot:
+    """A mapped snapshot: matrix plus row-aligned ids, names and categories"""
+
+    def __init__(self, path, meta, matrix):
+        self.path = path
+        self.version = meta["version"]
+        self.rows = meta["rows"]
+        self.ids = meta["ids"]
+        self.names = meta["names"]
+        self.categories = meta["categories"]
+        self.created_at = meta["created_at"]
+        synced_until = meta.get("synced_until")
+        self.synced_until = datetime.fromisoformat(synced_until) if synced_until else None
+        self.matrix = matrix
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+def current_version(directory):
+    """Version number of the live snapshot, or None if there is none"""
+    try:
+        with open(os.path.join(directory, "CURRENT"), encoding="utf-8") as fh:
+            name = fh.read().strip()
+    except FileNotFoundError:
+        return None
+    return int(name.lstrip("v")) if name else None
+
+
+def open_snapshot(directory, dim: int):
+    """Map the live snapshot read-only (copy-on-write); None if missing or incompatible"""
+    version = current_version(directory)
+    if version is None:
+        return None
+    path = os.path.join(directory, f"v{version:06d}")
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+        if meta.get("format") != SNAPSHOT_FORMAT or meta.get("dim") != dim:
+            log.warning(f"Snapshot {path} has format/dim {meta.get('format')}/{meta.get('dim')}, ignoring")
+            return None
+        matrix = np.load(os.path.join(path, "matrix.npy"), mmap_mode="c")
+    except (OSError, ValueError, KeyError) as e:
+        log.warning(f"Snapshot {path} unreadable: {e}")
+        return None
+    return Snapshot(path, meta, matrix)
+
+
+def write_snapshot(directory, ids, names, categories, matrix, synced_until=None, headroom=0.1, min_headroom=1024) -> int:
+    """Write a new snapshot and make it CURRENT; returns its version.
+
+    Callers should hold `snapshot_lock(directory)` so versions stay unique.
+    """
+    os.makedirs(directory, exist_ok=True)
+    version = (current_version(directory) or 0) + 1
+    rows, dim = matrix.shape
+    capacity = rows + max(int(rows * headroom), min_headroom)
+
+    # Build in a private directory, then rename: readers never see a half-written snapshot
+    tmp_path = os.path.join(directory, f".tmp-{os.getpid()}-{uuid.uuid4().hex}")
+    os.makedirs(tmp_path)
+    try:
+        out = np.lib.format.open_memmap(
+            os.path.join(tmp_path, "matrix.npy"), mode="w+", dtype=np.float32, shape=(capacity, dim)
+        )
+        out[:rows] = matrix
+        out.flush()
+        del out
+
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "version": version,
+            "dim": dim,
+            "rows": rows,
+            "created_at": time.time(),
+            "synced_until": synced_until.isoformat() if synced_until is not None else None,
+            "ids": list(ids),
+            "names": list(names),
+            "categories": list(categories),
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+
+        name = f"v{version:06d}"
+        os.replace(tmp_path, os.path.join(directory, name))
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(directory, f".CURRENT-{os.getpid()}")
+    with open(pointer, "w", encoding="utf-8") as fh:
+        fh.write(name)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(pointer, os.path.join(directory, "CURRENT"))
+    return version
+
+
+def prune_snapshots(directory, keep: int = 2) -> int:
+    """Delete all but the `keep` newest snapshots; workers still mapping one keep their pages"""
+    live = current_version(directory)
+    versions = sorted(
+        int(name[1:]) for name in os.listdir(directory)
+        if name.startswith("v") and name[1:].isdigit()
+    )
+    removed = 0
+    for version in versions[:-max(keep, 1)]:
+        if version == live:
+            continue
+        shutil.rmtree(os.path.join(directory, f"v{version:06d}"), ignore_errors=True)
+        removed += 1
+    return removed
+
+
+@contextmanager
+def snapshot_lock(directory, blocking: bool = True):
+    """Cross-process writer lock; yields False if non-blocking and another worker holds it"""
+    os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        yield True
+        return
+
+    with open(os.path.join(directory, ".lock"), "w") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
@@ -0,0 +1,32 @@
+"""Run from ml_service/: python -m pytest tests"""
+import numpy as np
+
+from vector_index import VectorIndex
+
+
+def make_index():
+    rng = np.random.default_rng(0)
+    index = VectorIndex(dim=8)
+    index.load((str(i), f"product {i}", "shoes", rng.standard_normal(8)) for i in range(4))
+    return index
+
+
+def test_reapplied_null_price_keeps_attributes_version():
+    index = make_index()
+    assert index.set_attributes([("1", None, 3), ("2", 9.5, None)]) == 2
+    version = index.attributes_version
+
+    # Delta syncs re-read rows with updated_at >= the last mark
+    assert index.set_attributes([("1", None, 3), ("2", 9.5, None)]) == 0
+    assert index.attributes_version == version
+
+
+def test_changed_attributes_bump_version():
+    index = make_index()
+    index.set_attributes([("1", None, 3)])
+    version = index.attributes_version
+
+    assert index.set_attributes([("1", 4.0, 3)]) == 1
+    assert index.set_attributes([("1", None, 3)]) == 1
+    assert index.set_attributes([("1", None, 0)]) == 1
+    assert index.attributes_version == version + 3
@@ -0,0 +1,864 @@
+import threading
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+
+# ============================================================
+# 🗂️ IN-MEMORY VECTOR INDEX
+# ============================================================
+def normalize(vector) -> Optional[np.ndarray]:
+    """Return a flat float32 copy of the vector scaled to unit length (None if empty/zero)"""
+    if vector is None:
+        return None
+    vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vec))
+    if vec.size == 0 or norm == 0.0 or not np.isfinite(norm):
+        return None
+    return vec / norm
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first, using argpartition instead of a full sort"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorIndex:
+    """Contiguous float32 matrix of L2-normalized product embeddings plus a product_id → row map.
+
+    A query is one matrix-vector product over every row followed by an
+    argpartition top-k, so no embedding ever has to be fetched from Postgres
+    at request time.
+
+    The matrix is kept current incrementally: upserts overwrite a row in
+    place or append into spare capacity, removals only tombstone the row,
+    and `compact()` drops tombstoned rows in one pass when enough of them
+    have piled up.
+
+    An optional ANN `engine` (see ann.py) narrows each query to a candidate
+    set that is then rescored exactly; queries fall back to the full scan
+    whenever the engine is not built for the current row layout.
+
+    An optional compressed `storage` (see quantization.py) is scanned
+    instead of the float32 matrix when there is no engine, and its best
+    `top_k * rerank_factor` rows are rescored exactly.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        compact_ratio: float = 0.2,
+        compact_min_rows: int = 64,
+        engine=None,
+        candidate_factor: int = 4,
+        storage=None,
+        rerank_factor: int = 10,
+    ):
+        self.dim = dim
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self.engine = engine
+        self.candidate_factor = candidate_factor
+        self.storage = storage
+        self.rerank_factor = rerank_factor
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._stats_lock = threading.Lock()
+        self._rows_scanned = 0  # similarity computations by search / search_batch
+        self._engine_pending = None
+        self._storage_pending = None
+        # product_id -> (price, quantity) for filtering; kept for products not
+        # indexed yet too, so the attributes apply as soon as they are
+        self._attributes = {}
+        self._attributes_version = 0
+        self._reset([], [], [], np.empty((0, dim), dtype=np.float32), {})
+        self.loaded_at = None
+        self.version = 0
+        self._categories_cache = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback(product_id)` after every upsert/removal, and `callback(None)` after a full reload.
+
+        Callbacks run under the index lock, so they must be cheap (e.g. mark dirty).
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, product_id):
+        for callback in self._listeners:
+            callback(product_id)
+
+    def _reset(self, ids, names, categories, matrix, row_of, compressed=None, keep_engine=False):
+        """Install fresh storage (caller holds the lock or owns the index exclusively).
+
+        `matrix` may have spare rows beyond len(ids); appends fill them first.
+        `compressed` is the storage's copy of the same rows, if any.
+        `keep_engine` is for callers that keep every row number and patch the
+        engine themselves.
+        """
+        size = len(ids)
+        capacity = max(matrix.shape[0], size)
+        category_code_of = {}
+        category_codes = np.full(capacity, -1, dtype=np.int32)
+        category_codes[:size] = np.fromiter(
+            (category_code_of.setdefault(category, len(category_code_of)) for category in categories),
+            dtype=np.int32,
+            count=size,
+        )
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:size] = True
+        prices = np.full(capacity, np.nan, dtype=np.float32)
+        quantities = np.full(capacity, -1, dtype=np.int32)
+        for row, product_id in enumerate(ids):
+            attributes = self._attributes.get(product_id)
+            if attributes is not None:
+                prices[row], quantities[row] = attributes
+        self._prices = prices
+        self._quantities = quantities
+        self._masks = {}
+        self._masks_key = None
+        self._matrix = matrix
+        self._compressed = compressed
+        self._size = size
+        self._alive = alive
+        self._ids = ids
+        self._names = names
+        self._categories = categories
+        self._category_codes = category_codes
+        self._category_code_of = category_code_of
+        self._row_of = row_of
+        self._tombstones = 0
+        if not keep_engine:
+            # Row numbers changed, so any ANN structure is stale until rebuilt
+            self._generation += 1
+            self._engine_valid = False
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, product_id):
+        return str(product_id) in self._row_of
+
+    @property
+    def tombstones(self):
+        return self._tombstones
+
+    def load(self, rows):
+        """Replace the whole index with (product_id, name, category, embedding) rows.
+
+        Returns (loaded, skipped); rows with a missing or wrong-sized
+        embedding are skipped.
+        """
+        ids, names, categories, vectors = [], [], [], []
+        seen = {}
+        skipped = 0
+
+        for product_id, name, category, embedding in rows:
+            vec = normalize(embedding)
+            if vec is None or vec.shape[0] != self.dim:
+                skipped += 1
+                continue
+
+            product_id = str(product_id)
+            if product_id in seen:
+                # Keep the latest row for duplicated ids
+                row = seen[product_id]
+                names[row], categories[row], vectors[row] = name, category, vec
+                continue
+
+            seen[product_id] = len(ids)
+            ids.append(product_id)
+            names.append(name)
+            categories.append(category)
+            vectors.append(vec)
+
+        if vectors:
+            matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+        else:
+            matrix = np.empty((0, self.dim), dtype=np.float32)
+        self._install(ids, names, categories, matrix, seen)
+        return len(ids), skipped
+
+    def load_matrix(self, ids, names, categories, matrix):
+        """Replace the whole index with already-normalized rows, adopting `matrix` without copying.
+
+        Used for memory-mapped snapshots: rows past len(ids) are spare capacity.
+        """
+        ids = [str(pid) for pid in ids]
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim or matrix.shape[0] < len(ids):
+            raise ValueError(f"Snapshot matrix {matrix.shape} does not fit {len(ids)} rows of dim {self.dim}")
+        self._install(ids, list(names), list(categories), matrix, {pid: row for row, pid in enumerate(ids)})
+        return len(ids)
+
+    def _install(self, ids, names, categories, matrix, row_of):
+        """Swap in a full reload, reusing whatever the previous rows make reusable.
+
+        Unchanged vectors keep their compressed codes, and when every product
+        keeps its row number (e.g. a snapshot of the same catalog) the ANN
+        engine survives: changed rows are re-added to it instead of retraining.
+        Listeners hear only about products added, changed or removed, and an
+        identical reload keeps the version, so caches keyed on it stay warm.
+        """
+        diff = self._diff_rows(ids, names, categories, matrix)
+        version, _, previous_rows, same_vector, same_meta, removed = diff
+        changed = [ids[row] for row in np.flatnonzero(~(same_vector & same_meta))] + removed
+        compressed = self._compress(matrix, len(ids), diff)
+
+        with self._lock:
+            keep_engine = (
+                self._engine_valid and self._engine_pending is None and self.version == version
+                and np.array_equal(previous_rows, np.arange(len(ids)))
+            )
+            removed_rows = [self._row_of[pid] for pid in removed if pid in self._row_of] if keep_engine else []
+            self._reset(ids, names, categories, matrix, row_of, compressed, keep_engine=keep_engine)
+            if keep_engine:
+                for row in np.flatnonzero(~same_vector):
+                    self.engine.add(int(row), matrix[row])
+                for row in removed_rows:
+                    self.engine.remove(row)
+            self.loaded_at = datetime.utcnow()
+            if self.version != version or len(changed) > max(len(ids), 1) // 2:
+                # Raced with an update, or most rows changed: treat as a full reload
+                self.version += 1
+                self._notify(None)
+            elif changed:
+                self.version += 1
+                for product_id in changed:
+                    self._notify(product_id)
+
+    def _diff_rows(self, ids, names, categories, matrix, block_rows: int = 16384):
+        """Compare rows about to be loaded with the live ones, outside the lock.
+
+        Returns (version, previous compressed copy, previous_rows, same_vector,
+        same_meta, removed): the index version the comparison holds for, each
+        new row's current row number (-1 if not indexed), whether its vector
+        and its name + category are unchanged, and the ids indexed now but
+        absent from the new rows.
+        """
+        with self._lock:
+            version, size, row_of = self.version, self._size, self._row_of
+            previous_matrix, previous_compressed = self._matrix, self._compressed
+            previous_names, previous_categories = self._names, self._categories
+
+        n = len(ids)
+        previous_rows = np.fromiter((row_of.get(pid, -1) for pid in ids), dtype=np.int64, count=n)
+        # Rows appended after the capture above are treated as new
+        previous_rows[previous_rows >= size] = -1
+        same_vector = np.zeros(n, dtype=bool)
+        for start in range(0, n, block_rows):
+            candidates = previous_rows[start:start + block_rows]
+            known = np.flatnonzero(candidates >= 0)
+            same_vector[start + known] = np.all(
+                previous_matrix[candidates[known]] == matrix[start + known], axis=1,
+            )
+        same_meta = np.fromiter(
+            (row >= 0 and previous_names[row] == name and previous_categories[row] == category
+             for row, name, category in zip(previous_rows.tolist(), names, categories)),
+            dtype=bool,
+            count=n,
+        )
+        new_ids = set(ids)
+        removed = [pid for pid in list(row_of) if pid not in new_ids]
+        return version, previous_compressed, previous_rows, same_vector, same_meta, removed
+
+    def export(self):
+        """Copy of the live rows as (ids, names, categories, matrix), e.g. for writing a snapshot"""
+        with self._lock:
+            keep = np.flatnonzero(self._alive[:self._size])
+            return (
+                [self._ids[row] for row in keep],
+                [self._names[row] for row in keep],
+                [self._categories[row] for row in keep],
+                np.ascontiguousarray(self._matrix[keep]),
+            )
+
+    def _compress(self, matrix, size, diff):
+        """Storage's copy of the rows about to be loaded, built before taking the lock.
+
+        Products whose vector is unchanged (per `_diff_rows`) keep their codes,
+        so reloading a snapshot only encodes what changed (PQ encoding costs
+        far more than the comparison).
+        """
+        storage = self.storage
+        if storage is None:
+            return None
+        _, previous, previous_rows, same_vector, _, _ = diff
+        if previous is None:
+            return storage.compress(matrix, size)
+        rows = np.flatnonzero(same_vector)
+        return storage.compress(matrix, size, reuse=(previous, rows, previous_rows[rows]))
+
+    def memory_usage(self):
+        """Bytes held by the float32 matrix and by the compressed copy"""
+        with self._lock:
+            compressed = self._compressed
+            return {
+                "storage": self.storage.name if self.storage is not None else "float32",
+                "compressed_active": compressed is not None,
+                "matrix_bytes": int(self._matrix.nbytes),
+                "compressed_bytes": int(self.storage.nbytes(compressed)) if compressed is not None else 0,
+            }
+
+    @property
+    def rows_scanned(self) -> int:
+        """Total rows scored by searches since startup"""
+        with self._stats_lock:
+            return self._rows_scanned
+
+    @property
+    def attributes_version(self) -> int:
+        """Bumped whenever an indexed product's price or stock changes"""
+        return self._attributes_version
+
+    def set_attributes(self, rows) -> int:
+        """Update (product_id, price, quantity) filter attributes; returns how many indexed rows changed"""
+        updated = 0
+        with self._lock:
+            for product_id, price, quantity in rows:
+                product_id = str(product_id)
+                attributes = (
+                    np.float32(price) if price is not None else np.float32(np.nan),
+                    np.int32(quantity) if quantity is not None else np.int32(-1),
+                )
+                previous = self._attributes.get(product_id)
+                if (previous is not None and previous[1] == attributes[1]
+                        and (previous[0] == attributes[0] or (np.isnan(previous[0]) and np.isnan(attributes[0])))):
+                    # NaN (no price) never equals itself; re-synced NULL prices must not bump the version
+                    continue
+                self._attributes[product_id] = attributes
+                row = self._row_of.get(product_id)
+                if row is not None:
+                    self._prices[row], self._quantities[row] = attributes
+                    updated += 1
+            if updated:
+                self._attributes_version += 1
+        return updated
+
+    def _cached_mask(self, key, build):
+        """Per-category / in-stock row masks, reused until the index or attributes change (lock held)"""
+        cache_key = (self.version, self._attributes_version, self._size)
+        if self._masks_key != cache_key:
+            self._masks, self._masks_key = {}, cache_key
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._masks[key] = build()
+        return mask
+
+    def _filter_mask(self, size, include_categories, exclude_categories, min_price, max_price, in_stock):
+        """Fresh boolean mask of rows passing the filters, or None when there are none (lock held)"""
+        mask = None
+        codes = self._category_codes[:size]
+
+        def category_mask(category):
+            code = self._category_code_of.get(category)
+            if code is None:
+                return np.zeros(size, dtype=bool)
+            return self._cached_mask(("category", code), lambda: codes == code)
+
+        if include_categories is not None:
+            mask = np.zeros(size, dtype=bool)
+            for category in include_categories:
+                mask |= category_mask(category)
+        for category in exclude_categories or ():
+            mask = ~category_mask(category) if mask is None else mask & ~category_mask(category)
+        if min_price is not None or max_price is not None:
+            prices = self._prices[:size]
+            # Unknown (NaN) prices never pass a price filter
+            in_range = np.ones(size, dtype=bool) if min_price is None else prices >= min_price
+            if max_price is not None:
+                in_range &= prices <= max_price
+            mask = in_range if mask is None else mask & in_range
+        if in_stock:
+            stocked = self._cached_mask(("in_stock",), lambda: self._quantities[:size] > 0)
+            mask = stocked.copy() if mask is None else mask & stocked
+        return mask
+
+    def _category_code(self, category):
+        code = self._category_code_of.get(category)
+        if code is None:
+            code = len(self._category_code_of)
+            self._category_code_of[category] = code
+        return code
+
+    def _grow(self, needed: int):
+        """Make room for `needed` rows, doubling capacity so appends stay amortized O(dim)"""
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 16)
+
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        codes = np.full(new_capacity, -1, dtype=np.int32)
+        codes[:self._size] = self._category_codes[:self._size]
+        prices = np.full(new_capacity, np.nan, dtype=np.float32)
+        prices[:self._size] = self._prices[:self._size]
+        quantities = np.full(new_capacity, -1, dtype=np.int32)
+        quantities[:self._size] = self._quantities[:self._size]
+
+        if self._compressed is not None:
+            self._compressed = self.storage.grow(self._compressed, self._size, new_capacity)
+
+        # Searches that already took a reference keep reading the old arrays
+        self._matrix, self._alive, self._category_codes = matrix, alive, codes
+        self._prices, self._quantities = prices, quantities
+
+    def upsert(self, product_id, name, category, embedding) -> bool:
+        """Insert or replace one product; returns False if the embedding is unusable"""
+        vec = normalize(embedding)
+        product_id = str(product_id)
+        if vec is None or vec.shape[0] != self.dim:
+            self.remove(product_id)
+            return False
+
+        with self._lock:
+            row = self._row_of.get(product_id)
+            if (row is not None and self._names[row] == name and self._categories[row] == category
+                    and np.array_equal(self._matrix[row], vec)):
+                # Re-applied unchanged row (e.g. delta sync overlap): keep version and caches
+                return True
+            if row is None:
+                row = self._size
+                self._grow(row + 1)
+                self._ids.append(product_id)
+                self._names.append(name)
+                self._categories.append(category)
+                self._row_of[product_id] = row
+                self._size += 1
+            else:
+                self._names[row] = name
+                self._categories[row] = category
+
+            self._matrix[row] = vec
+            if self._compressed is not None:
+                self.storage.write(self._compressed, slice(row, row + 1), vec.reshape(1, -1))
+            self._category_codes[row] = self._category_code(category)
+            self._prices[row], self._quantities[row] = self._attributes.get(product_id, (np.nan, -1))
+            self._alive[row] = True
+            self.version += 1
+
+            if self._engine_pending is not None:
+                self._engine_pending.append(row)
+            if self._storage_pending is not None:
+                self._storage_pending.append(row)
+            if self._engine_valid:
+                self.engine.add(row, vec)
+            self._notify(product_id)
+        return True
+
+    def remove(self, product_id) -> bool:
+        """Tombstone a product's row; the slot is reclaimed by the next compaction"""
+        with self._lock:
+            row = self._row_of.pop(str(product_id), None)
+            if row is None:
+                return False
+            self._alive[row] = False
+            self._ids[row] = None
+            self._tombstones += 1
+            self.version += 1
+
+            if self._engine_pending is not None:
+                self._engine_pending.append(row)
+            if self._engine_valid:
+                self.engine.remove(row)
+            self._notify(str(product_id))
+        return True
+
+    def needs_compaction(self) -> bool:
+        return self._tombstones >= max(self.compact_min_rows, self.compact_ratio * max(self._size, 1))
+
+    def compact(self) -> int:
+        """Drop tombstoned rows and shrink storage to fit; returns the number of rows reclaimed"""
+        with self._lock:
+            reclaimed = self._tombstones
+            if reclaimed == 0:
+                return 0
+            keep = np.flatnonzero(self._alive[:self._size])
+            matrix = np.ascontiguousarray(self._matrix[keep])
+            ids = [self._ids[row] for row in keep]
+            names = [self._names[row] for row in keep]
+            categories = [self._categories[row] for row in keep]
+            row_of = {pid: row for row, pid in enumerate(ids)}
+            compressed = self.storage.take(self._compressed, keep) if self._compressed is not None else None
+            self._reset(ids, names, categories, matrix, row_of, compressed)
+            self.version += 1
+        return reclaimed
+
+    def needs_engine_rebuild(self) -> bool:
+        if self.engine is None:
+            return False
+        if not self._engine_valid:
+            return len(self) >= self.engine.min_rows
+        return self.engine.needs_rebuild(len(self))
+
+    def rebuild_engine(self) -> bool:
+        """(Re)build the ANN engine without blocking searches or updates.
+
+        Training runs outside the lock on the current rows; upserts and
+        removals that land meanwhile are replayed before the engine is
+        switched on. Returns True if the engine is now serving queries.
+        """
+        engine = self.engine
+        if engine is None:
+            return False
+
+        with self._lock:
+            size = self._size
+            matrix = self._matrix[:size]
+            alive = self._alive[:size].copy()
+            generation = self._generation
+            self._engine_pending = []
+
+        try:
+            engine.build(matrix, alive)
+        except Exception:
+            with self._lock:
+                self._engine_pending = None
+            raise
+
+        with self._lock:
+            pending, self._engine_pending = self._engine_pending, None
+            if generation != self._generation:
+                # Compacted or reloaded during the build; rows no longer line up
+                return False
+            for row in pending:
+                if self._alive[row]:
+                    engine.add(row, self._matrix[row])
+                else:
+                    engine.remove(row)
+            self._engine_valid = engine.ready
+            return self._engine_valid
+
+    def needs_storage_build(self) -> bool:
+        """True when a compressed storage is configured but not built (e.g. PQ below min_rows at load)"""
+        storage = self.storage
+        return storage is not None and self._compressed is None and len(self) >= getattr(storage, "min_rows", 0)
+
+    def build_storage(self) -> bool:
+        """Train (PQ) and encode the compressed copy without blocking searches or updates.
+
+        Like rebuild_engine: encoding runs outside the lock and rows upserted
+        meanwhile are re-encoded before the copy is switched on. Returns True
+        if queries now scan the compressed copy.
+        """
+        storage = self.storage
+        if storage is None:
+            return False
+
+        with self._lock:
+            size = self._size
+            matrix = self._matrix
+            generation = self._generation
+            self._storage_pending = []
+
+        try:
+            compressed = storage.compress(matrix, size)
+        except Exception:
+            with self._lock:
+                self._storage_pending = None
+            raise
+
+        with self._lock:
+            pending, self._storage_pending = self._storage_pending, None
+            if compressed is None or generation != self._generation:
+                # Too few rows to train on, or compacted/reloaded during the build
+                return self._compressed is not None
+            if self._matrix.shape[0] > matrix.shape[0]:
+                compressed = storage.grow(compressed, size, self._matrix.shape[0])
+            for row in sorted(set(pending)):
+                storage.write(compressed, slice(row, row + 1), self._matrix[row:row + 1])
+            self._compressed = compressed
+            return True
+
+    def categories(self):
+        """Distinct categories of live rows (cached per index version)"""
+        with self._lock:
+            if self._categories_cache is not None and self._categories_cache[0] == self.version:
+                return self._categories_cache[1]
+            live = self._category_codes[:self._size]
+            if self._tombstones:
+                live = live[self._alive[:self._size]]
+            name_of = {code: category for category, code in self._category_code_of.items()}
+            categories = tuple(sorted(
+                (name_of[int(code)] for code in np.unique(live) if name_of.get(int(code)) is not None),
+            ))
+            self._categories_cache = (self.version, categories)
+            return categories
+
+    def product_ids(self):
+        with self._lock:
+            return set(self._row_of)
+
+    def get(self, product_id):
+        """Return (vector, name, category) for a product or None if it is not indexed"""
+        with self._lock:
+            row = self._row_of.get(str(product_id))
+            if row is None:
+                return None
+            return self._matrix[row].copy(), self._names[row], self._categories[row]
+
+    def search(
+        self,
+        query,
+        top_k: int = 10,
+        exclude_ids=(),
+        boost_category: Optional[str] = None,
+        boost: float = 0.0,
+        max_score: Optional[float] = None,
+        exact: bool = False,
+        nprobe: Optional[int] = None,
+        ef: Optional[int] = None,
+        include_categories=None,
+        exclude_categories=None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        in_stock: bool = False,
+        min_score: Optional[float] = None,
+    ):
+        """Return the top_k most similar products as dicts, best first.
+
+        `boost` is added to rows whose category equals `boost_category`
+        before ranking; `max_score` optionally caps the boosted score.
+        `nprobe` / `ef` tune the ANN engine per query and `exact` forces
+        the brute-force float32 scan.
+
+        Filters are applied before top-k selection: a selective filter
+        gathers and scores only the matching rows, so it costs less than
+        an unfiltered query. `min_score` drops rows whose (boosted) score
+        is below it.
+        """
+        query = normalize(query)
+        if query is None or query.shape[0] != self.dim:
+            raise ValueError(f"Query embedding must be a non-zero {self.dim}-dim vector")
+
+        with self._lock:
+            size = self._size
+            matrix = self._matrix[:size]
+            alive = self._alive[:size] if self._tombstones else None
+            codes = self._category_codes[:size]
+            ids = self._ids
+            names = self._names
+            categories = self._categories
+            excluded_rows = [self._row_of[str(pid)] for pid in exclude_ids if str(pid) in self._row_of]
+            boost_code = self._category_code_of.get(boost_category) if boost else None
+            engine = self.engine if self._engine_valid and not exact else None
+            compressed = None
+            if self._compressed is not None and not exact:
+                compressed = self.storage.view(self._compressed, size)
+            mask = self._filter_mask(size, include_categories, exclude_categories, min_price, max_price, in_stock)
+
+        if size == 0:
+            return []
+
+        rows = None
+        if mask is not None:
+            # Exact scan over the filtered rows beats ANN + post-filtering
+            engine = None
+            if alive is not None:
+                mask &= alive
+                alive = None
+            if excluded_rows:
+                mask[excluded_rows] = False
+                excluded_rows = []
+            if not mask.any():
+                return []
+            if np.count_nonzero(mask) < size // 2:
+                rows = np.flatnonzero(mask)
+                mask = None
+
+        # Candidate generation: every row, the filtered rows, or the ANN engine's
+        # or compressed scan's shortlist
+        shortlisted = False
+        if engine is not None:
+            n_candidates = max(top_k * self.candidate_factor, top_k + len(excluded_rows))
+            rows = engine.candidates(query, n_candidates, nprobe=nprobe, ef=ef)
+            if rows is not None:
+                rows = np.unique(rows[rows < size])
+                shortlisted = True
+        n_rerank = max(top_k * self.rerank_factor, top_k + len(excluded_rows))
+        if compressed is not None and not shortlisted and n_rerank < (size if rows is None else rows.shape[0]):
+            rows = self._rerank_candidates(
+                compressed, query, rows, n_rerank, codes, boost_code, boost, max_score, alive, mask, excluded_rows,
+            )
+            mask = None
+
+        if rows is None:
+            scores = matrix @ query
+        else:
+            scores = matrix[rows] @ query
+            codes = codes[rows]
+            if alive is not None:
+                alive = alive[rows]
+        with self._stats_lock:
+            self._rows_scanned += scores.shape[0]
+
+        if boost_code is not None:
+            scores[codes == boost_code] += boost
+            if max_score is not None:
+                np.minimum(scores, max_score, out=scores)
+        if alive is not None:
+            scores[~alive] = -np.inf
+        if mask is not None:
+            scores[~mask] = -np.inf
+        if excluded_rows:
+            if rows is None:
+                scores[excluded_rows] = -np.inf
+            else:
+                scores[np.isin(rows, excluded_rows)] = -np.inf
+
+        if min_score is not None:
+            # Select among the rows over the threshold only
+            passing = np.flatnonzero(scores >= min_score)
+            positions = passing[top_k_indices(scores[passing], top_k)]
+        else:
+            positions = top_k_indices(scores, top_k)
+
+        results = []
+        for position in positions:
+            score = float(scores[position])
+            if not np.isfinite(score):
+                break
+            row = position if rows is None else rows[position]
+            product_id = ids[row]
+            if product_id is None:
+                # Removed while this query was scoring
+                continue
+            results.append({
+                "product_id": product_id,
+                "name": names[row],
+                "category": categories[row],
+                "similarity": score,
+            })
+        return results
+
+    def _rerank_candidates(self, compressed, query, rows, n, codes, boost_code, boost, max_score, alive, mask, excluded_rows):
+        """Rows of the n best approximate scores from the compressed copy, for exact rescoring"""
+        if rows is None:
+            data = compressed
+        else:
+            data = self.storage.take(compressed, rows)
+            codes = codes[rows]
+            alive = alive[rows] if alive is not None else None
+        scores = self.storage.scores(data, query)
+        with self._stats_lock:
+            self._rows_scanned += scores.shape[0]
+
+        if boost_code is not None:
+            scores[codes == boost_code] += boost
+            if max_score is not None:
+                np.minimum(scores, max_score, out=scores)
+        if alive is not None:
+            scores[~alive] = -np.inf
+        if mask is not None:
+            scores[~mask] = -np.inf
+        if excluded_rows:
+            if rows is None:
+                scores[excluded_rows] = -np.inf
+            else:
+                scores[np.isin(rows, excluded_rows)] = -np.inf
+
+        positions = top_k_indices(scores, n)
+        positions = np.sort(positions[np.isfinite(scores[positions])])
+        return positions if rows is None else rows[positions]
+
+    def search_batch(
+        self,
+        queries,
+        top_k: int = 10,
+        exclude_ids=None,
+        boost_categories=None,
+        boost: float = 0.0,
+        max_score: Optional[float] = None,
+        max_block_cells: int = 1 << 24,
+    ):
+        """Exact top_k for many queries with blocked matrix-matrix products.
+
+        `exclude_ids` and `boost_categories` are optional per-query sequences
+        aligned with `queries`. Returns one result list per query (empty for
+        a zero or non-finite query). Each block scores at most
+        `max_block_cells` query x row pairs, bounding the temporary memory.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"Query embeddings must be {self.dim}-dim")
+        n_queries = queries.shape[0]
+        norms = np.linalg.norm(queries, axis=1)
+        valid = np.isfinite(norms) & (norms > 0)
+        queries = queries / np.where(valid, norms, 1.0)[:, None]
+
+        with self._lock:
+            size = self._size
+            matrix = self._matrix[:size]
+            alive = self._alive[:size] if self._tombstones else None
+            codes = self._category_codes[:size]
+            ids = self._ids
+            names = self._names
+            categories = self._categories
+            excluded_rows = [
+                [self._row_of[str(pid)] for pid in excluded if str(pid) in self._row_of]
+                for excluded in (exclude_ids or [()] * n_queries)
+            ]
+            boost_codes = np.array([
+                self._category_code_of.get(category, -2) if boost and category is not None else -2
+                for category in (boost_categories or [None] * n_queries)
+            ], dtype=np.int32)
+
+        results = [[] for _ in range(n_queries)]
+        if size == 0 or top_k <= 0:
+            return results
+
+        k = min(top_k, size)
+        block = max(1, min(n_queries, max_block_cells // max(size, 1)))
+        for start in range(0, n_queries, block):
+            stop = min(start + block, n_queries)
+            scores = queries[start:stop] @ matrix.T
+            with self._stats_lock:
+                self._rows_scanned += scores.size
+
+            if boost and (boost_codes[start:stop] >= 0).any():
+                scores += boost * (codes[None, :] == boost_codes[start:stop, None])
+                if max_score is not None:
+                    np.minimum(scores, max_score, out=scores)
+            if alive is not None:
+                scores[:, ~alive] = -np.inf
+            for i in range(start, stop):
+                if excluded_rows[i]:
+                    scores[i - start, excluded_rows[i]] = -np.inf
+
+            if k < size:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(size), (stop - start, size))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            for i in range(start, stop):
+                if not valid[i]:
+                    continue
+                hits = results[i]
+                for row, score in zip(top[i - start], top_scores[i - start]):
+                    if not np.isfinite(score):
+                        break
+                    product_id = ids[row]
+                    if product_id is None:
+                        continue
+                    hits.append({
+                        "product_id": product_id,
+                        "name": names[row],
+                        "category": categories[row],
+                        "similarity": float(score),
+                    })
+        return results